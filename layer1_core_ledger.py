@@ -1,8 +1,31 @@
 import pandas as pd
 import numpy as np
 import os
+from sovereign_storage import write_dataset, warehouse_path
 from datetime import datetime, timedelta
 
+# Financial Structure shared by the loop and vectorized generators
+ACCOUNTS = {
+    '1000': 'Cash',
+    '4000': 'Revenue',
+    '5000': 'Operating Expenses',
+    '2000': 'Intercompany Payables'
+}
+
+LEDGER_COLUMNS = ['txn_id', 'journal_id', 'date', 'account_code', 'account_name', 'amount', 'currency']
+
+# Balanced two-line journals the vectorized generator draws from: (debit account, credit account)
+JOURNAL_TYPES = [
+    ('5000', '1000'),  # operating expense paid in cash
+    ('1000', '4000'),  # revenue received in cash
+    ('1000', '2000'),  # intercompany funding received
+    ('2000', '1000')   # intercompany balance settled
+]
+
+# Rows per random block. Block b always draws from its own generator (seed, b), so the ledger
+# depends on (rows, seed) only and the write chunk size is purely an I/O setting.
+BLOCK_ROWS = 100_000
+
 def generate_ledger():
     # 1. Create Data Directory
     if not os.path.exists('data'):
@@ -12,21 +35,16 @@ def generate_ledger():
     # 2. Setup Parameters
     rows = 1000
     start_date = datetime(2023, 1, 1)
-    
+
     # Financial Structure
-    accounts = {
-        '1000': 'Cash',
-        '4000': 'Revenue',
-        '5000': 'Operating Expenses',
-        '2000': 'Intercompany Payables'
-    }
+    accounts = ACCOUNTS
 
     # 3. Generate Data
     data = []
     for i in range(rows):
         acc_code = np.random.choice(list(accounts.keys()))
         amount = np.random.uniform(100, 5000)
-        
+
         data.append({
             'txn_id': f'TXN-{1000+i}',
             'date': (start_date + timedelta(days=np.random.randint(0, 365))).strftime('%Y-%m-%d'),
@@ -42,6 +60,136 @@ def generate_ledger():
     df.to_csv(output_path, index=False)
     print(f"SUCCESS: File created at {output_path}")
 
+def build_ledger_chunk(rng, start_index, size, start_date='2023-01-01', days=365):
+    """
+    Builds one block of ledger rows as whole columns (no per-row Python).
+    Rows come as balanced double-entry journals: a debit line (+amount) and a credit line
+    (-amount) sharing a journal_id and date, so size is rounded up to an even number of lines.
+    Row numbering continues from start_index (even) so chunks concatenate into one ledger.
+    """
+    codes = list(ACCOUNTS.keys())
+    names = list(ACCOUNTS.values())
+    # Low-cardinality columns are emitted as categoricals: one label per account/day, int codes per row
+    calendar = np.datetime_as_string(np.datetime64(start_date, 'D') + np.arange(days), unit='D')
+    journals = -(-size // 2)
+
+    # Draw each column in one call, in a fixed order, so a seed always yields the same ledger
+    kind = rng.integers(0, len(JOURNAL_TYPES), journals)
+    amounts = np.round(rng.uniform(100, 5000, journals), 2)
+    day_offsets = rng.integers(0, days, journals)
+
+    # Lines interleave debit, credit per journal
+    debit_idx = np.array([codes.index(dr) for dr, _ in JOURNAL_TYPES])[kind]
+    credit_idx = np.array([codes.index(cr) for _, cr in JOURNAL_TYPES])[kind]
+    acc_idx = np.column_stack([debit_idx, credit_idx]).ravel()
+    line_amounts = np.column_stack([amounts, -amounts]).ravel()
+
+    txn_ids = np.char.add('TXN-', (1000 + start_index + np.arange(2 * journals)).astype(str))
+    journal_ids = np.char.add('JNL-', np.repeat(1000 + start_index // 2 + np.arange(journals), 2).astype(str))
+
+    return pd.DataFrame({
+        'txn_id': txn_ids,
+        'journal_id': journal_ids,
+        'date': pd.Categorical.from_codes(np.repeat(day_offsets, 2), calendar),
+        'account_code': pd.Categorical.from_codes(acc_idx, codes),
+        'account_name': pd.Categorical.from_codes(acc_idx, names),
+        'amount': line_amounts,
+        'currency': 'ZAR'
+    }, columns=LEDGER_COLUMNS)
+
+def ledger_blocks(rows, seed=42):
+    """
+    Yields the ledger as BLOCK_ROWS-row frames (rows rounded up to whole journals).
+    Each block has an independent generator spawned from seed by block index.
+    """
+    rows += rows % 2
+    for block, start in enumerate(range(0, rows, BLOCK_ROWS)):
+        rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(block,)))
+        yield build_ledger_chunk(rng, start, min(BLOCK_ROWS, rows - start))
+
+def _rechunk(blocks, chunk_size):
+    """Regroups a stream of frames into chunk_size-row frames (the last one may be shorter)."""
+    pending, buffered = [], 0
+    for block in blocks:
+        pending.append(block)
+        buffered += len(block)
+        while buffered >= chunk_size:
+            frame = pd.concat(pending, ignore_index=True) if len(pending) > 1 else pending[0]
+            yield frame.iloc[:chunk_size].reset_index(drop=True)
+            rest = frame.iloc[chunk_size:]
+            pending, buffered = ([rest] if len(rest) else []), len(rest)
+    if pending:
+        yield pd.concat(pending, ignore_index=True).reset_index(drop=True)
+
+def generate_ledger_vectorized(rows=10_000_000, seed=42, chunk_size=1_000_000,
+                               output_format='csv', output_path=None):
+    """
+    Vectorized, chunk-streaming Layer 1 generator for 10M-100M row test GLs.
+    The ledger is built column-wise in BLOCK_ROWS blocks (see ledger_blocks) and streamed
+    to disk in chunk_size-row writes, so memory is bounded by chunk_size. Output is
+    byte-for-byte reproducible for a given (rows, seed), whatever the chunk_size.
+
+    output_format: 'csv' (data/ESFE_FACT_GL.csv), 'parquet' (data/ESFE_FACT_GL.parquet)
+    or 'dataset' (entity/fiscal-period partitioned warehouse, see sovereign_storage).
+    """
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    if output_format not in ('csv', 'parquet', 'dataset'):
+        print(f"ERROR: Unsupported output format '{output_format}'. Use 'csv', 'parquet' or 'dataset'.")
+        return
+    if output_format == 'dataset':
+        output_path = warehouse_path('ESFE_FACT_GL', base_dir)
+    elif output_path is None:
+        output_path = os.path.join(base_dir, 'data', f'ESFE_FACT_GL.{output_format}')
+
+    writer = None
+    if output_format == 'parquet':
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            print("ERROR: pyarrow is required for parquet output. Install it or use output_format='csv'.")
+            return
+
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    if os.path.isfile(output_path):
+        os.remove(output_path)
+
+    print(f"--- Layer 1: Vectorized Ledger Generation ({rows:,} rows, seed={seed}) ---")
+
+    # 1. Stream fixed-size chunks to disk
+    written = 0
+    try:
+        for chunk in _rechunk(ledger_blocks(rows, seed), chunk_size):
+            if output_format == 'csv':
+                chunk.to_csv(output_path, mode='a', header=(written == 0), index=False)
+            elif output_format == 'dataset':
+                if write_dataset(chunk, 'ESFE_FACT_GL', mode='append' if written else 'overwrite', base_dir=base_dir) is None:
+                    return
+            else:
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(output_path, table.schema)
+                writer.write_table(table)
+
+            written += len(chunk)
+            print(f"  Wrote {written:,} / {rows + rows % 2:,} rows")
+    finally:
+        if writer is not None:
+            writer.close()
+
+    print(f"SUCCESS: File created at {output_path}")
+    return output_path
+
 if __name__ == "__main__":
-    generate_ledger()
-    
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser(description='Layer 1 ledger generator')
+    parser.add_argument('--rows', type=int, default=10_000_000)
+    parser.add_argument('--format', choices=['csv', 'parquet', 'dataset'], default='csv')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--chunk-size', type=int, default=1_000_000, help='rows per write (does not change the ledger)')
+    parser.add_argument('--legacy', action='store_true', help='original 1,000-row loop generator')
+    args = parser.parse_args()
+    if args.legacy:
+        generate_ledger()
+    else:
+        generate_ledger_vectorized(rows=args.rows, seed=args.seed, chunk_size=args.chunk_size, output_format=args.format)
@@ -1,48 +1,289 @@
 import pandas as pd
+import numpy as np
 import os
+import time
+from sovereign_normalizer import normalize_debit_credit, parse_amounts, to_cents, hash_labels, combine_hashes
+from sovereign_storage import dataset_exists, iter_dataset, write_dataset, csv_path, DATE_COLUMNS, DEFAULT_ENTITY
+from sovereign_coa import valid_code_mask
+from sovereign_fx import default_store
 
-def process_tax_and_consolidation():
+# GL controls. Every rule is a column operation over one streamed chunk; a row PASSes only
+# when no rule fails. Failed rule IDs are kept per row in 'failed_controls' (e.g. "C02;C06").
+CONTROL_RULES = {
+    'C01': 'Journal debits equal credits',
+    'C02': 'Account code in Chart of Accounts',
+    'C03': 'Amounts parseable with a valid debit/credit side',
+    'C04': 'Transaction date inside the reporting period',
+    'C05': 'Currency in FX store, matches entity currency',
+    'C06': 'No duplicate txn_id within an entity'
+}
+RULE_BITS = {rule: np.uint8(1 << i) for i, rule in enumerate(CONTROL_RULES)}
+
+# Reporting period under review (inclusive) and each entity's functional currency
+REPORTING_PERIOD = ('2023-01-01', '2023-12-31')
+ENTITY_CURRENCIES = {
+    DEFAULT_ENTITY: 'ZAR',
+    'Sovereign Germany': 'EUR',
+    'Sovereign UK': 'GBP',
+    'Sovereign USA': 'USD'
+}
+
+SOURCE_DATASET = 'ESFE_FACT_GL'
+OUTPUT_DATASET = 'ESFE_VALIDATED_GL'
+# Seed of the second, independent key hash the duplicate index confirms matches with
+CHECK_SEED = 0x9e3779b97f4a7c15
+
+class DuplicateIndex:
+    """
+    Set of (entity, txn_id) keys seen so far, as two independent 64-bit hashes per key in a few
+    sorted runs. A key counts as seen only when both hashes match, so a false duplicate needs a
+    collision in each (odds about n^2 / 2^129 for n keys). Runs merge like a binary counter, so
+    lookups stay O(log n) per run; the index costs 16 bytes per distinct key (about 1.6 GB for
+    100M transactions).
+    """
+    def __init__(self):
+        self.runs = []  # (hashes, checks), sorted by hash then check
+
+    def flag(self, hashes, checks):
+        """True for keys already seen, earlier in the stream or earlier in this chunk (first one wins)."""
+        order = np.lexsort((checks, hashes))
+        h, c = hashes[order], checks[order]
+        repeat = np.zeros(len(h), dtype=bool)
+        repeat[1:] = (h[1:] == h[:-1]) & (c[1:] == c[:-1])
+
+        seen = np.zeros(len(h), dtype=bool)
+        for run_h, run_c in self.runs:
+            lo, hi = np.searchsorted(run_h, h, 'left'), np.searchsorted(run_h, h, 'right')
+            # A hash match is almost always one stored key: confirm it with the check hash
+            single = np.flatnonzero(hi - lo == 1)
+            seen[single] |= run_c[lo[single]] == c[single]
+            # Several stored keys share the hash (a 64-bit collision): compare each of them
+            for i in np.flatnonzero(hi - lo > 1):
+                seen[i] |= bool((run_c[lo[i]:hi[i]] == c[i]).any())
+
+        fresh = ~repeat & ~seen
+        if fresh.any():
+            self.runs.append((h[fresh], c[fresh]))
+            while len(self.runs) > 1 and len(self.runs[-1][0]) >= len(self.runs[-2][0]):
+                (newer_h, newer_c), (older_h, older_c) = self.runs.pop(), self.runs.pop()
+                merged_h, merged_c = np.concatenate([older_h, newer_h]), np.concatenate([older_c, newer_c])
+                merge = np.lexsort((merged_c, merged_h))
+                self.runs.append((merged_h[merge], merged_c[merge]))
+
+        duplicate = np.empty(len(h), dtype=bool)
+        duplicate[order] = repeat | seen
+        return duplicate
+
+# --- Rules: each returns a boolean failure mask, or None when the ledger layout has nothing to check ---
+
+def check_journal_balance(chunk):
+    """C01: debit minus credit nets to zero over each journal_id (exact, in cents)."""
+    if 'journal_id' not in chunk.columns:
+        return None
+    debit, credit = normalize_debit_credit(chunk)
+    net_cents = to_cents(debit) - to_cents(credit)
+    codes, journals = pd.factorize(chunk['journal_id'])
+    totals = np.zeros(len(journals) + 1, dtype='int64')
+    np.add.at(totals, codes, net_cents)
+    # Lines without a journal_id land in the trailing slot and always fail
+    return (totals[codes] != 0) | (codes < 0)
+
+def check_account_codes(chunk):
+    """C02: account code registered in the Chart of Accounts."""
+    if 'account_code' not in chunk.columns:
+        return None
+    return ~valid_code_mask(chunk['account_code'])
+
+def check_non_negative(chunk):
+    """
+    C03: amounts parse (see parse_amounts) and carry a side. Two-column ledgers have no negative
+    debits or credits; in signed 'amount' ledgers the sign is the side (+ debit, - credit), so a
+    zero amount, which has neither, fails.
+    """
+    if 'debit' in chunk.columns and 'credit' in chunk.columns:
+        debit, credit = parse_amounts(chunk['debit']), parse_amounts(chunk['credit'])
+        # NaN compares False, so ~(x >= 0) fails both negatives and unparseable text
+        return ~(debit >= 0) | ~(credit >= 0)
+    if 'amount' in chunk.columns:
+        # NaN != 0 is True, so ~(x != 0) fails both zero and unparseable amounts
+        return ~(parse_amounts(chunk['amount']) != 0)
+    return None
+
+def parse_dates(values):
+    """datetime64 per row, parsing each distinct label once (ledgers repeat a few hundred dates)."""
+    codes, labels = pd.factorize(values)
+    parsed = pd.to_datetime(pd.Series(labels, dtype='object'), errors='coerce').to_numpy(dtype='datetime64[ns]')
+    return np.append(parsed, np.datetime64('NaT', 'ns'))[codes]
+
+def check_period(chunk, period):
+    """C04: transaction date present, valid and inside the reporting period."""
+    date_col = next((c for c in DATE_COLUMNS if c in chunk.columns), None)
+    if date_col is None:
+        return None
+    values = chunk[date_col]
+    dates = values.to_numpy(dtype='datetime64[ns]') if pd.api.types.is_datetime64_any_dtype(values) else parse_dates(values)
+    start = np.datetime64(pd.Timestamp(period[0]), 'ns')
+    end = np.datetime64(pd.Timestamp(period[1]) + pd.Timedelta(days=1), 'ns')
+    return np.isnat(dates) | (dates < start) | (dates >= end)
+
+def check_currency(chunk, entity):
+    """C05: a currency the FX store can translate, and the entity's functional currency for registered entities."""
+    if 'currency' not in chunk.columns:
+        return None
+    # Offline, read-only lookup: a pipeline stage must not refresh (and rewrite) the FX history it reads
+    known = default_store().currencies()
+    entity_codes, entities = pd.factorize(entity)
+    ccy_codes, currencies = pd.factorize(chunk['currency'])
+    # Evaluate each distinct (entity, currency) pair once (codes shifted by one so missing values are 0)
+    width = len(currencies) + 1
+    pair = (entity_codes.astype('int64') + 1) * width + (ccy_codes + 1)
+    pairs, inverse = np.unique(pair, return_inverse=True)
+    bad = []
+    for p in pairs:
+        e, c = divmod(int(p), width)
+        ccy = currencies[c - 1] if c else None
+        expected = ENTITY_CURRENCIES.get(entities[e - 1]) if e else None
+        bad.append(ccy not in known or (expected is not None and ccy != expected))
+    return np.array(bad, dtype=bool)[inverse.ravel()]
+
+def key_hashes(chunk, entity):
+    """
+    Two independent 64-bit hashes of (entity, txn_id) per row (default seed, CHECK_SEED);
+    entity names are hashed once per distinct value. Returns (hashes, checks).
+    """
+    entity_codes, entities = pd.factorize(entity)
+    names, txn_ids = np.asarray(entities, dtype=object), chunk['txn_id'].to_numpy()
+    hashes = combine_hashes(np.append(hash_labels(names), np.uint64(0))[entity_codes], hash_labels(txn_ids))
+    checks = combine_hashes(np.append(hash_labels(names, CHECK_SEED), np.uint64(0))[entity_codes],
+                            hash_labels(txn_ids, CHECK_SEED), seed=CHECK_SEED)
+    return hashes, checks
+
+# --- Engine ---
+
+def split_open_journal(chunk):
+    """Holds back the trailing journal of a chunk: its lines may continue in the next chunk."""
+    if 'journal_id' not in chunk.columns or chunk.empty:
+        return chunk, None
+    journals = chunk['journal_id'].to_numpy()
+    tail = len(journals) - 1
+    while tail > 0 and journals[tail - 1] == journals[-1]:
+        tail -= 1
+    return chunk.iloc[:tail], chunk.iloc[tail:]
+
+def apply_controls(chunk, index, stats, period=REPORTING_PERIOD):
+    """Runs every rule over one chunk; adds control_status / failed_controls and updates stats."""
+    if 'entity' in chunk.columns:
+        entity = chunk['entity'].to_numpy()
+    else:
+        entity = pd.Categorical.from_codes(np.zeros(len(chunk), dtype='int8'), [DEFAULT_ENTITY])
+    flags = np.zeros(len(chunk), dtype='uint8')
+
+    def _run(rule, check):
+        started = time.perf_counter()
+        failed = check()
+        stats[rule]['seconds'] += time.perf_counter() - started
+        if failed is not None:
+            stats[rule]['applied'] = True
+            stats[rule]['failures'] += int(failed.sum())
+            flags[failed] |= RULE_BITS[rule]
+
+    _run('C01', lambda: check_journal_balance(chunk))
+    _run('C02', lambda: check_account_codes(chunk))
+    _run('C03', lambda: check_non_negative(chunk))
+    _run('C04', lambda: check_period(chunk, period))
+    _run('C05', lambda: check_currency(chunk, entity))
+    _run('C06', lambda: index.flag(*key_hashes(chunk, entity)) if 'txn_id' in chunk.columns else None)
+
+    # Rule IDs per row: label each distinct failure bitmask once
+    masks, inverse = np.unique(flags, return_inverse=True)
+    labels = np.array([';'.join(r for r, bit in RULE_BITS.items() if m & bit) for m in masks], dtype=object)
+    chunk = chunk.copy(deep=False)
+    chunk['control_status'] = np.where(flags == 0, 'PASS', 'FAIL')
+    chunk['failed_controls'] = labels[inverse.ravel()]
+    return chunk
+
+def controls_report(stats, rows, elapsed):
+    """Per-rule failure counts and timings as a frame (rules not applicable to the layout show n/a)."""
+    report = pd.DataFrame([
+        {
+            'rule': rule,
+            'control': description,
+            'applied': stats[rule]['applied'],
+            'failures': stats[rule]['failures'] if stats[rule]['applied'] else None,
+            'failure_rate_pct': round(stats[rule]['failures'] / rows * 100, 4) if rows and stats[rule]['applied'] else None,
+            'seconds': round(stats[rule]['seconds'], 3)
+        }
+        for rule, description in CONTROL_RULES.items()
+    ])
+    report.attrs['rows'] = rows
+    report.attrs['elapsed'] = elapsed
+    return report
+
+def run_controls_engine(source_name=SOURCE_DATASET, chunk_size=1_000_000, period=REPORTING_PERIOD,
+                        write_csv=True, to_warehouse=True):
     """
-    Project 5: Sovereign Engine - Layer 2
-    Purpose: Read Layer 1 data, calculate corporate tax (27%), and consolidate.
+    Layer 2: GL controls.
+    Streams the ledger in chunks of chunk_size rows, runs every control as column operations and
+    writes ESFE_VALIDATED_GL (CSV export and/or warehouse partitions) with control_status and
+    failed_controls. Memory is bounded by the chunk plus the duplicate index (8 bytes per key).
+
+    Journal lines must be contiguous (as in any journal-ordered GL export); a journal that spans
+    a chunk boundary is carried into the next chunk. C01 is skipped when there is no journal_id.
     """
-    input_path = 'data/ESFE_FACT_GL.csv'
-    output_path = 'data/ESFE_CONSOLIDATED_FINANCIALS.csv'
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    output_path = csv_path(OUTPUT_DATASET, base_dir)
+
+    print(f"--- Layer 2: GL Controls Engine ---")
 
     # 1. Check if Layer 1 data exists
-    if not os.path.exists(input_path):
-        print(f"ERROR: {input_path} not found. Please run Layer 1 first.")
+    if not dataset_exists(source_name, base_dir):
+        print(f"ERROR: {csv_path(source_name, base_dir)} not found. Please run Layer 1 first.")
         return
 
-    # 2. Load the Ledger
-    df = pd.read_csv(input_path)
-
-    # 3. Apply Strategic Finance Logic
-    # Filter for Revenue (Code 4000) to calculate tax liability
-    revenue_total = df[df['account_code'] == 4000]['amount'].sum()
-    tax_rate = 0.27  # 27% SA Corporate Tax
-    tax_liability = revenue_total * tax_rate
-
-    # 4. Create Consolidated Summary
-    summary_data = [
-        {'Metric': 'Total Revenue', 'Amount': round(revenue_total, 2)},
-        {'Metric': 'Corporate Tax Liability (27%)', 'Amount': round(tax_liability, 2)},
-        {'Metric': 'Net After-Tax Revenue', 'Amount': round(revenue_total - tax_liability, 2)}
-    ]
-    
-    summary_df = pd.DataFrame(summary_data)
-
-    # 5. Save the processed data
-    summary_df.to_csv(output_path, index=False)
-    
-    print("-" * 30)
-    print("LAYER 2: PROCESSING COMPLETE")
-    print(f"Total Revenue Found: R{revenue_total:,.2f}")
-    print(f"Tax Calculated: R{tax_liability:,.2f}")
-    print(f"Consolidated file saved at: {output_path}")
-    print("-" * 30)
+    if write_csv and os.path.exists(output_path):
+        os.remove(output_path)
+
+    # 2. Stream the ledger through the rules
+    stats = {rule: {'applied': False, 'failures': 0, 'seconds': 0.0} for rule in CONTROL_RULES}
+    index = DuplicateIndex()
+    rows = passed = 0
+    started = time.perf_counter()
+
+    def _emit(block):
+        nonlocal rows, passed
+        validated = apply_controls(block, index, stats, period)
+        if write_csv:
+            validated.to_csv(output_path, mode='a', header=(rows == 0), index=False)
+        if to_warehouse:
+            write_dataset(validated, OUTPUT_DATASET, mode='append' if rows else 'overwrite', base_dir=base_dir)
+        rows += len(validated)
+        passed += int((validated['control_status'] == 'PASS').sum())
+
+    carry = None
+    for chunk in iter_dataset(source_name, chunk_size=chunk_size, base_dir=base_dir):
+        if carry is not None and len(carry):
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+        chunk, carry = split_open_journal(chunk)
+        if len(chunk):
+            _emit(chunk)
+    if carry is not None and len(carry):
+        _emit(carry)
+
+    # 3. Controls report
+    elapsed = time.perf_counter() - started
+    report = controls_report(stats, rows, elapsed)
+    report_path = os.path.join(base_dir, 'data', 'ESFE_CONTROLS_REPORT.csv')
+    report.to_csv(report_path, index=False)
+
+    print(f"\n{'Rule':<5} {'Control':<50} {'Failures':>12} {'Time (s)':>9}")
+    for r in report.itertuples():
+        failures = f"{int(r.failures):,}" if r.applied else 'n/a'
+        print(f"{r.rule:<5} {r.control:<50} {failures:>12} {r.seconds:>9.2f}")
+    print(f"-----------------------------------------------")
+    print(f"Rows checked: {rows:,} | PASS: {passed:,} | FAIL: {rows - passed:,} ({elapsed:.1f}s)")
+    print(f"SUCCESS: Validated ledger saved to {output_path if write_csv else OUTPUT_DATASET}")
+    print(f"Controls report saved to {report_path}")
+    return report
 
 if __name__ == "__main__":
-    process_tax_and_consolidation()
-    
-    
\ No newline at end of file
+    run_controls_engine()
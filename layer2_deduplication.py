@@ -0,0 +1,353 @@
+import pandas as pd
+import numpy as np
+import os
+import glob
+import json
+import math
+import shutil
+import uuid
+from sovereign_normalizer import normalize_debit_credit, to_cents, hash_labels, hash_integers, combine_hashes
+from sovereign_storage import write_dataset, dataset_files, csv_path, HAS_ARROW, DATE_COLUMNS, DEFAULT_ENTITY
+from layer2_controls_validation import parse_dates
+
+# Deduplication gate for multi-year histories. Each row gets a 64-bit fingerprint of
+# (entity, txn_id, date, account, amount) plus an independent 64-bit check hash. A persisted
+# Bloom filter screens new rows; only its hits are confirmed against the exact index, which is
+# sharded by the fingerprint's top bits into sorted runs on disk (memory-mapped, never reloaded whole).
+HISTORY_DATASET = 'ESFE_GL_HISTORY'
+CHECK_SEED = 0x9e3779b97f4a7c15
+
+SHARD_BITS = 6                  # 64 shards
+MAX_RUNS_PER_SHARD = 8          # runs are merged into one once a shard holds more
+DEFAULT_CAPACITY = 10_000_000   # Bloom filter sized for this many rows; rebuilt 4x larger when exceeded
+DEFAULT_FP_RATE = 0.01
+
+def _state_dir(base_dir):
+    return os.path.join(base_dir, 'data', 'state', 'dedup')
+
+def _hash_distinct(values, canonical=str):
+    """Label hash evaluated once per distinct value (entities, dates, account codes repeat heavily)."""
+    codes, uniques = pd.factorize(pd.Series(values))
+    hashes = hash_labels(np.array([canonical(u) for u in uniques] + [''], dtype=object))
+    return hashes[codes]
+
+def _canonical_code(code):
+    # '4000', 4000 and 4000.0 are the same account
+    try:
+        return str(int(float(code)))
+    except (TypeError, ValueError):
+        return str(code)
+
+def fingerprint_rows(df):
+    """
+    (fingerprint, check) uint64 arrays for a block of ledger rows. Identical postings hash the same
+    whatever the file layout: dates by calendar day, amounts as signed cents, codes canonicalized.
+    """
+    n = len(df)
+    entity = _hash_distinct(df['entity']) if 'entity' in df.columns else np.full(n, hash_labels([DEFAULT_ENTITY])[0])
+    txn = hash_labels(df['txn_id'].to_numpy()) if 'txn_id' in df.columns else np.zeros(n, dtype=np.uint64)
+
+    date_col = next((c for c in DATE_COLUMNS if c in df.columns), None)
+    if date_col is not None:
+        days = parse_dates(df[date_col]).astype('datetime64[D]')
+        date = np.where(np.isnat(days), np.uint64(0), hash_integers(days.astype('int64')))
+    else:
+        date = np.zeros(n, dtype=np.uint64)
+
+    account = _hash_distinct(df['account_code'], _canonical_code) if 'account_code' in df.columns else np.zeros(n, dtype=np.uint64)
+    debit, credit = normalize_debit_credit(df)
+    amount = hash_integers(to_cents(debit) - to_cents(credit))
+
+    columns = (entity, txn, date, account, amount)
+    return combine_hashes(*columns), combine_hashes(*columns, seed=CHECK_SEED)
+
+class BloomFilter:
+    """Bit array on disk (np.memmap), k positions per key by double hashing of the fingerprint."""
+    def __init__(self, path, bits, hashes):
+        self.path = path
+        self.bits = int(bits)
+        self.hashes = int(hashes)
+        mode = 'r+' if os.path.exists(path) else 'w+'
+        self.array = np.memmap(path, dtype=np.uint8, mode=mode, shape=(self.bits + 7) // 8)
+
+    @staticmethod
+    def sizing(capacity, fp_rate):
+        bits = math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2)
+        return bits, max(1, round(bits / capacity * math.log(2)))
+
+    def _positions(self, fingerprints):
+        h1 = fingerprints
+        h2 = hash_integers(fingerprints.view(np.int64)) | np.uint64(1)
+        steps = np.arange(self.hashes, dtype=np.uint64)
+        with np.errstate(over='ignore'):
+            return (h1[:, None] + steps[None, :] * h2[:, None]) % np.uint64(self.bits)
+
+    def contains(self, fingerprints):
+        if len(fingerprints) == 0:
+            return np.zeros(0, dtype=bool)
+        pos = self._positions(fingerprints)
+        bits = (self.array[(pos >> np.uint64(3)).astype(np.int64)] >> (pos & np.uint64(7)).astype(np.uint8)) & 1
+        return bits.all(axis=1)
+
+    def add(self, fingerprints):
+        if len(fingerprints) == 0:
+            return
+        pos = self._positions(fingerprints).ravel()
+        np.bitwise_or.at(self.array, (pos >> np.uint64(3)).astype(np.int64), (1 << (pos & np.uint64(7))).astype(np.uint8))
+
+    def flush(self):
+        self.array.flush()
+
+class DedupIndex:
+    """
+    Persisted membership index over every fingerprint ever ingested (data/state/dedup).
+    Bloom filter screen, then exact confirmation on (fingerprint, check) in the sharded sorted runs.
+    Each chunk is committed together with its history write (begin / commit): index.json records the
+    pending write first, and a chunk interrupted before commit is rolled back on the next open (its
+    history files or CSV tail and its runs are removed), so the history and the index always agree.
+    Leftover Bloom bits from a rolled-back chunk only cost an extra exact lookup.
+    """
+    def __init__(self, base_dir, capacity=DEFAULT_CAPACITY, fp_rate=DEFAULT_FP_RATE):
+        self.base_dir = base_dir
+        self.root = _state_dir(base_dir)
+        self.stale = []  # files replaced since the last save, removed once index.json no longer names them
+        os.makedirs(self.root, exist_ok=True)
+        self.meta_path = os.path.join(self.root, 'index.json')
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                self.meta = json.load(f)
+        else:
+            bits, hashes = BloomFilter.sizing(capacity, fp_rate)
+            self.meta = {'count': 0, 'capacity': capacity, 'fp_rate': fp_rate, 'bloom_bits': bits,
+                         'bloom_hashes': hashes, 'bloom_file': 'bloom.bin', 'runs': {}}
+        self.bloom = BloomFilter(os.path.join(self.root, self.meta['bloom_file']),
+                                 self.meta['bloom_bits'], self.meta['bloom_hashes'])
+        self._recover()
+
+    @property
+    def count(self):
+        return self.meta['count']
+
+    @staticmethod
+    def _shards(fingerprints):
+        return (fingerprints >> np.uint64(64 - SHARD_BITS)).astype(np.int64)
+
+    def _load_run(self, name):
+        return (np.load(os.path.join(self.root, f'{name}.fp.npy'), mmap_mode='r'),
+                np.load(os.path.join(self.root, f'{name}.chk.npy'), mmap_mode='r'))
+
+    def _write_run(self, fps, chks):
+        name = f'run-{uuid.uuid4().hex}'
+        np.save(os.path.join(self.root, f'{name}.fp.npy'), fps)
+        np.save(os.path.join(self.root, f'{name}.chk.npy'), chks)
+        return name
+
+    def _drop_run(self, name):
+        for suffix in ('.fp.npy', '.chk.npy'):
+            self.stale.append(os.path.join(self.root, name + suffix))
+
+    def _recover(self):
+        """Rolls back a chunk left pending by an interrupted run and removes files index.json does not name."""
+        pending = self.meta.pop('pending', None)
+        if pending:
+            if pending['mode'] == 'parquet':
+                for path in dataset_files(HISTORY_DATASET, pending['token'], self.base_dir):
+                    os.remove(path)
+            else:
+                history_csv = csv_path(HISTORY_DATASET, self.base_dir)
+                if pending['csv_offset'] is None:
+                    if os.path.exists(history_csv):
+                        os.remove(history_csv)
+                elif os.path.exists(history_csv):
+                    with open(history_csv, 'r+b') as f:
+                        f.truncate(pending['csv_offset'])
+            print(f"NOTE: rolled back an interrupted history write ({pending['token']})")
+        referenced = {f'{name}{suffix}' for names in self.meta['runs'].values() for name in names
+                      for suffix in ('.fp.npy', '.chk.npy')} | {self.meta['bloom_file']}
+        for path in glob.glob(os.path.join(self.root, 'run-*.npy')) + glob.glob(os.path.join(self.root, 'bloom*.bin')):
+            if os.path.basename(path) not in referenced:
+                os.remove(path)
+        if pending:
+            self.save()
+
+    def confirm(self, fingerprints, checks):
+        """Exact membership of (fingerprint, check) pairs in the persisted runs."""
+        found = np.zeros(len(fingerprints), dtype=bool)
+        shards = self._shards(fingerprints)
+        for shard in np.unique(shards):
+            rows = np.flatnonzero(shards == shard)
+            for name in self.meta['runs'].get(str(shard), []):
+                run_fps, run_chks = self._load_run(name)
+                lo = np.searchsorted(run_fps, fingerprints[rows], side='left')
+                hi = np.searchsorted(run_fps, fingerprints[rows], side='right')
+                match = hi > lo
+                # Runs are sorted by (fingerprint, check): the first equal fingerprint settles almost every row
+                found[rows[match]] |= np.asarray(run_chks[lo[match]]) == checks[rows[match]]
+                # 64-bit fingerprint collisions: scan the (tiny) range of equal fingerprints
+                for i in np.flatnonzero((hi - lo > 1) & ~found[rows]):
+                    found[rows[i]] = (np.asarray(run_chks[lo[i]:hi[i]]) == checks[rows[i]]).any()
+        return found
+
+    def lookup(self, fingerprints, checks):
+        """
+        Duplicate flags for a batch: repeats inside the batch (first occurrence kept) and rows already
+        in the history. Returns (duplicate mask, 'batch' / 'history' / '' reason per row, bloom hits).
+        """
+        order = np.lexsort((checks, fingerprints))
+        fp_sorted, chk_sorted = fingerprints[order], checks[order]
+        repeat_sorted = np.zeros(len(order), dtype=bool)
+        repeat_sorted[1:] = (fp_sorted[1:] == fp_sorted[:-1]) & (chk_sorted[1:] == chk_sorted[:-1])
+        in_batch = np.empty(len(order), dtype=bool)
+        in_batch[order] = repeat_sorted
+
+        in_history = np.zeros(len(order), dtype=bool)
+        candidates = np.flatnonzero(~in_batch)
+        hits = candidates[self.bloom.contains(fingerprints[candidates])]
+        if len(hits):
+            in_history[hits] = self.confirm(fingerprints[hits], checks[hits])
+
+        reason = np.where(in_history, 'history', np.where(in_batch, 'batch', ''))
+        return in_batch | in_history, reason, len(hits)
+
+    def add(self, fingerprints, checks):
+        """Records new (already deduplicated) fingerprints: Bloom bits plus one sorted run per shard."""
+        if len(fingerprints) == 0:
+            return
+        self.bloom.add(fingerprints)
+        order = np.lexsort((checks, fingerprints))
+        fingerprints, checks = fingerprints[order], checks[order]
+        shards = self._shards(fingerprints)
+        bounds = np.searchsorted(shards, np.arange((1 << SHARD_BITS) + 1))
+        for shard in range(1 << SHARD_BITS):
+            lo, hi = bounds[shard], bounds[shard + 1]
+            if hi > lo:
+                runs = self.meta['runs'].setdefault(str(shard), [])
+                runs.append(self._write_run(fingerprints[lo:hi], checks[lo:hi]))
+                if len(runs) > MAX_RUNS_PER_SHARD:
+                    self._compact(str(shard))
+        self.meta['count'] += len(fingerprints)
+        if self.meta['count'] > self.meta['capacity']:
+            self._grow_bloom(self.meta['capacity'] * 4)
+
+    def _compact(self, shard):
+        """Merges all runs of a shard into one sorted run (size-bounded by the shard)."""
+        names = self.meta['runs'][shard]
+        loaded = [self._load_run(name) for name in names]
+        fps = np.concatenate([np.asarray(f) for f, _ in loaded])
+        chks = np.concatenate([np.asarray(c) for _, c in loaded])
+        order = np.lexsort((chks, fps))
+        del loaded
+        self.meta['runs'][shard] = [self._write_run(fps[order], chks[order])]
+        for name in names:
+            self._drop_run(name)
+
+    def _grow_bloom(self, capacity):
+        """Rebuilds a larger Bloom filter from the exact runs (the ledger history is not re-read)."""
+        bits, hashes = BloomFilter.sizing(capacity, self.meta['fp_rate'])
+        bloom_file = f'bloom-{uuid.uuid4().hex[:8]}.bin'
+        bloom = BloomFilter(os.path.join(self.root, bloom_file), bits, hashes)
+        for names in self.meta['runs'].values():
+            for name in names:
+                bloom.add(np.asarray(self._load_run(name)[0]))
+        bloom.flush()
+        self.stale.append(self.bloom.path)
+        self.bloom = bloom
+        self.meta.update({'capacity': capacity, 'bloom_bits': bits, 'bloom_hashes': hashes, 'bloom_file': bloom_file})
+
+    def begin(self, history_csv=None):
+        """
+        Records a pending history write before it happens. Returns the token to tag the Parquet files
+        with (write_dataset write_id); in CSV mode the current size of history_csv is kept for rollback.
+        """
+        token = uuid.uuid4().hex
+        if history_csv is None:
+            self.meta['pending'] = {'token': token, 'mode': 'parquet'}
+        else:
+            offset = os.path.getsize(history_csv) if os.path.exists(history_csv) else None
+            self.meta['pending'] = {'token': token, 'mode': 'csv', 'csv_offset': offset}
+        self.save()
+        return token
+
+    def commit(self):
+        """Marks the pending history write done; the runs added since begin() become part of the index."""
+        self.meta.pop('pending', None)
+        self.save()
+
+    def save(self):
+        self.bloom.flush()
+        tmp_path = self.meta_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.meta, f, indent=2)
+        os.replace(tmp_path, self.meta_path)
+        for path in self.stale:
+            if os.path.exists(path):
+                os.remove(path)
+        self.stale = []
+
+def reset_index(base_dir=None):
+    """Forgets all ingested history (the deduplicated history dataset is left in place)."""
+    shutil.rmtree(_state_dir(base_dir or os.path.dirname(os.path.abspath(__file__))), ignore_errors=True)
+
+def run_deduplication(pattern='Sovereign_*.csv', chunk_size=1_000_000, capacity=DEFAULT_CAPACITY, fp_rate=DEFAULT_FP_RATE,
+                      base_dir=None):
+    """
+    Layer 2: Deduplication gate.
+    Streams every data/global_raw/<pattern> batch, drops rows whose fingerprint was already ingested
+    (this batch or any earlier one), appends the new rows to the ESFE_GL_HISTORY dataset and logs the
+    duplicates of this run to data/ESFE_DUPLICATES.csv (replaced on every run). Re-ingesting a file adds nothing.
+    Each chunk's history write and index update are committed together (see DedupIndex).
+    Group consolidation reads ESFE_GL_HISTORY rather than the raw batches once it exists.
+    """
+    base_dir = base_dir or os.path.dirname(os.path.abspath(__file__))
+    sources = sorted(glob.glob(os.path.join(base_dir, 'data', 'global_raw', pattern)))
+    duplicates_path = os.path.join(base_dir, 'data', 'ESFE_DUPLICATES.csv')
+    history_csv = csv_path(HISTORY_DATASET, base_dir)
+
+    print(f"--- Layer 2: Deduplication Gate ---")
+    if not sources:
+        print(f"ERROR: No files matching {pattern} in data/global_raw. Run the global generator first.")
+        return
+
+    index = DedupIndex(base_dir, capacity=capacity, fp_rate=fp_rate)
+    print(f"History index: {index.count:,} fingerprints")
+    if os.path.exists(duplicates_path):
+        os.remove(duplicates_path)
+
+    results = []
+    for path in sources:
+        rows = new = bloom_hits = 0
+        dup_reasons = {'batch': 0, 'history': 0}
+        for chunk in pd.read_csv(path, chunksize=chunk_size):
+            fps, chks = fingerprint_rows(chunk)
+            duplicate, reason, hits = index.lookup(fps, chks)
+            fresh = chunk[~duplicate]
+            if len(fresh):
+                token = index.begin(None if HAS_ARROW else history_csv)
+                index.add(fps[~duplicate], chks[~duplicate])
+                if HAS_ARROW:
+                    write_dataset(fresh, HISTORY_DATASET, mode='append', base_dir=base_dir, write_id=token)
+                else:
+                    fresh.to_csv(history_csv, mode='a', header=not os.path.exists(history_csv), index=False)
+                index.commit()
+            if duplicate.any():
+                dups = chunk[duplicate].assign(source_file=os.path.basename(path), duplicate_of=reason[duplicate])
+                dups.to_csv(duplicates_path, mode='a', header=not os.path.exists(duplicates_path), index=False)
+                for key in dup_reasons:
+                    dup_reasons[key] += int((reason == key).sum())
+            rows += len(chunk)
+            new += len(fresh)
+            bloom_hits += hits
+        results.append({'file': os.path.basename(path), 'rows': rows, 'new': new,
+                        'duplicate_in_batch': dup_reasons['batch'], 'duplicate_in_history': dup_reasons['history'],
+                        'bloom_hits': bloom_hits})
+        print(f"  {os.path.basename(path):<28} rows {rows:>12,} | new {new:>12,} | duplicates {rows - new:>12,}")
+
+    report = pd.DataFrame(results)
+    print(f"-----------------------------------------------")
+    print(f"History index now holds {index.count:,} fingerprints")
+    print(f"SUCCESS: {int(report['new'].sum()):,} new rows appended to {HISTORY_DATASET}"
+          f"{'' if report['new'].sum() == report['rows'].sum() else f'; duplicates logged to {duplicates_path}'}")
+    return report
+
+if __name__ == "__main__":
+    run_deduplication()
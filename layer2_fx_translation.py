@@ -0,0 +1,118 @@
+import pandas as pd
+import numpy as np
+from sovereign_fx import default_store
+from sovereign_coa import classify_accounts
+
+# IFRS (IAS 21) translation: income and expenses at the average rate of their period,
+# assets and liabilities at the closing rate. 'spot' uses the rate on each txn_date.
+RATE_METHODS = ['spot', 'ifrs']
+PNL_CATEGORIES = ['revenue', 'opex', 'tax']
+
+def zar_rate_history(store=None, fallback=None):
+    """
+    Sorted ZAR rate history (date, currency, rate_zar = ZAR per 1 unit of currency),
+    cross-rated from the FX store. When the store is empty, fallback ({currency: rate_zar})
+    becomes a single-date history so translation still runs offline.
+    """
+    store = store or default_store()
+    history = store.history()
+    if not history.empty:
+        table = history.pivot_table(index='date', columns='currency', values='rate', aggfunc='last').sort_index()
+        if 'ZAR' in table.columns:
+            # (ZAR per base unit) / (currency per base unit) = ZAR per unit of currency
+            table = table.rdiv(table['ZAR'], axis=0)
+            long = table.stack().rename('rate_zar').reset_index()
+            long.columns = ['date', 'currency', 'rate_zar']
+            return long.sort_values(['date', 'currency'], kind='mergesort').reset_index(drop=True)
+    if not fallback:
+        return pd.DataFrame(columns=['date', 'currency', 'rate_zar'])
+    return pd.DataFrame({
+        'date': pd.Timestamp('1900-01-01'),
+        'currency': list(fallback.keys()),
+        'rate_zar': [float(v) for v in fallback.values()]
+    })
+
+def monthly_average_history(history):
+    """Average ZAR rate per currency and calendar month, keyed on the first day of the month."""
+    if history.empty:
+        return history
+    month = history['date'].dt.to_period('M').dt.to_timestamp()
+    return (history.assign(date=month)
+            .groupby(['date', 'currency'], as_index=False)['rate_zar'].mean()
+            .sort_values('date', kind='mergesort'))
+
+def reporting_period_end(dates):
+    """IAS 21 reporting date for a set of transaction dates: the month-end of the latest one (NaT if none parse)."""
+    latest = pd.to_datetime(pd.Series(dates), errors='coerce').max()
+    if pd.isna(latest):
+        return pd.NaT
+    return latest.to_period('M').to_timestamp(how='end').normalize()
+
+def asof_rates(keys, currency, history):
+    """
+    Vectorized as-of lookup: for each (key date, currency) the latest history rate on or before
+    the key, per currency (pd.merge_asof with by=). Returns a float array aligned with the inputs,
+    NaN where there is no such rate: unknown currencies, keys before the first history point of
+    their currency, and NaT keys (merge_asof cannot join null keys, so those rows are left out).
+    """
+    n = len(keys)
+    keys = np.asarray(keys, dtype='datetime64[ns]')
+    dated = np.flatnonzero(~np.isnat(keys))
+    # Join 'by' integer currency codes: much cheaper than grouping on strings
+    ccy_codes, ccy_values = pd.factorize(np.asarray(currency, dtype=object))
+    right_codes = pd.Index(ccy_values).get_indexer(history['currency'].astype(str))
+    left = pd.DataFrame({'date': keys[dated], 'ccy': ccy_codes[dated], 'pos': dated}).sort_values('date', kind='mergesort')
+    right = pd.DataFrame({
+        'date': history['date'].to_numpy(dtype='datetime64[ns]'),
+        'ccy': right_codes,
+        'rate_zar': history['rate_zar'].to_numpy(dtype='float64')
+    })
+    right = right[right['ccy'] >= 0].sort_values('date', kind='mergesort')
+    joined = pd.merge_asof(left, right, on='date', by='ccy', direction='backward')
+
+    rates = np.full(n, np.nan)
+    rates[joined['pos'].to_numpy()] = joined['rate_zar'].to_numpy(dtype='float64')
+    return rates
+
+def earliest_rates(currency, history):
+    """First recorded ZAR rate of each currency (aligned with currency; NaN if it has none)."""
+    first = history.sort_values('date', kind='mergesort').drop_duplicates('currency')
+    return pd.Series(np.asarray(currency, dtype=object)).map(first.set_index('currency')['rate_zar']).to_numpy(dtype='float64')
+
+def effective_rates(df, history, method='ifrs', date_col='txn_date', reporting_date=None):
+    """
+    Date-effective ZAR rate per ledger row, plus the rate type applied.
+    spot: rate on txn_date. ifrs: monthly average of the transaction month for P&L accounts, and the
+    closing rate at reporting_date for everything else (IAS 21; default: reporting_period_end of the
+    rows' dates). Account classes come from the Chart-of-Accounts registry.
+    Rows whose lookup date falls before the FX history take its earliest rate and are typed
+    'PRE_HISTORY' so callers can report them; P&L / spot rows whose date does not parse get NaN.
+    """
+    if method not in RATE_METHODS:
+        raise ValueError(f"Unknown rate method '{method}'. Use one of {RATE_METHODS}.")
+    dates = pd.to_datetime(df[date_col], errors='coerce').to_numpy(dtype='datetime64[ns]')
+    currency = df['currency'].astype(str).to_numpy()
+
+    if method == 'spot':
+        keys = dates
+        rates = asof_rates(keys, currency, history)
+        types = np.full(len(df), 'SPOT', dtype=object)
+    else:
+        if reporting_date is None:
+            reporting_date = reporting_period_end(dates)
+        pnl = classify_accounts(df).isin(PNL_CATEGORIES).to_numpy()
+        month_start = dates.astype('datetime64[M]').astype('datetime64[ns]')
+        closing_key = np.full(len(df), pd.Timestamp(reporting_date).to_datetime64(), dtype='datetime64[ns]')
+        keys = np.where(pnl, month_start, closing_key)
+        average = asof_rates(month_start, currency, monthly_average_history(history))
+        closing = asof_rates(closing_key, currency, history)
+        rates = np.where(pnl, average, closing)
+        types = np.where(pnl, 'AVERAGE', 'CLOSING').astype(object)
+
+    early = np.flatnonzero(np.isnan(rates) & ~np.isnat(keys))
+    if len(early):
+        first = earliest_rates(currency[early], history)
+        known = ~np.isnan(first)
+        rates[early[known]] = first[known]
+        types[early[known]] = 'PRE_HISTORY'
+    return rates, types
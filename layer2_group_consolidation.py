@@ -0,0 +1,248 @@
+import pandas as pd
+import numpy as np
+import os
+import glob
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from sovereign_storage import write_dataset, warehouse_path, csv_path, dataset_exists, read_dataset, iter_dataset, HAS_ARROW
+from layer2_fx_translation import zar_rate_history, effective_rates, reporting_period_end, RATE_METHODS
+from sovereign_fx import default_store, FALLBACK_RATES
+from layer2_intercompany_matching import match_intercompany, elimination_amounts
+from layer2_deduplication import HISTORY_DATASET
+
+# Group reporting currency is ZAR. Closing rates come from the FX store history on disk (see zar_closing_rates).
+GROUP_CURRENCY = 'ZAR'
+# Translation method used by every entry point (file consolidation, pipeline, in-process run)
+DEFAULT_RATE_METHOD = 'ifrs'
+
+# Intercompany accounts: lines the matcher pairs across entities are eliminated on consolidation
+# (kept in *_zar, netted in reporting_*_zar); unmatched lines and residuals stay on the books
+ELIMINATION_ACCOUNTS = [2000]
+
+GROUP_COLUMNS = [
+    'txn_id', 'txn_date', 'entity', 'counterparty', 'currency', 'account_code', 'account_name', 'debit', 'credit',
+    'fx_rate', 'debit_zar', 'credit_zar', 'elimination_flag', 'reporting_debit_zar', 'reporting_credit_zar'
+]
+
+def zar_closing_rates(as_of=None, store=None):
+    """
+    Closing ZAR rate per currency (ZAR per 1 unit): the latest FX store day on or before as_of
+    (default: the latest stored day), cross-rated through the store's base currency.
+    Reads the history on disk only and never starts a network refresh, so a run translates with
+    rates pinned to its reporting date. FALLBACK_RATES when nothing is stored by then.
+    """
+    as_of = pd.Timestamp.max if as_of is None or pd.isna(as_of) else as_of
+    rates = (store or default_store()).rates_on(as_of) or dict(FALLBACK_RATES)
+    return {currency: rates[GROUP_CURRENCY] / rate for currency, rate in rates.items() if rate}
+
+def apply_eliminations(df, eliminated):
+    """
+    Sets reporting_*_zar on translated rows: *_zar less the ZAR eliminated against the line's matched
+    counterpart (on the line's own side; see elimination_amounts). elimination_flag marks the netted lines.
+    """
+    eliminated = np.asarray(eliminated, dtype='float64')
+    payable = df['credit_zar'].to_numpy(dtype='float64') > 0
+    df['elimination_flag'] = np.where(eliminated > 0, 'YES', 'NO')
+    df['reporting_debit_zar'] = np.round(df['debit_zar'].to_numpy(dtype='float64') - np.where(payable, 0.0, eliminated), 2)
+    df['reporting_credit_zar'] = np.round(df['credit_zar'].to_numpy(dtype='float64') - np.where(payable, eliminated, 0.0), 2)
+    return df
+
+def intercompany_eliminations(ic):
+    """ZAR eliminated per translated intercompany line (aligned with ic), from the matcher's pairs."""
+    if ic.empty:
+        return np.zeros(0)
+    return elimination_amounts(match_intercompany(ic.reset_index(drop=True)))
+
+def eliminate_intercompany(df):
+    """In-memory elimination for a whole translated group ledger (the in-process pipeline)."""
+    ic = df['account_code'].isin(ELIMINATION_ACCOUNTS).to_numpy()
+    eliminated = np.zeros(len(df))
+    eliminated[ic] = intercompany_eliminations(df[ic])
+    return apply_eliminations(df, eliminated)
+
+def translate_entity_chunk(df, fx_rates=None, rate_history=None, rate_method=DEFAULT_RATE_METHOD, eliminated=None,
+                           reporting_date=None, stats=None):
+    """
+    Applies FX translation and intercompany eliminations to one block of an entity ledger (column arithmetic only).
+    fx_rates ({currency: ZAR per unit}) defaults to zar_closing_rates(). With rate_history (see
+    layer2_fx_translation), each row is translated at its date-effective rate instead of one flat rate per currency;
+    'ifrs' takes the closing rate at reporting_date (pass the group's, so every chunk uses the same one).
+    Rows without a usable txn_date take the flat closing rate.
+    eliminated: ZAR to eliminate per row (aligned with df, from intercompany_eliminations); none by default.
+    stats: optional dict; 'pre_history' counts rows translated at the earliest rate because they predate the FX history.
+    """
+    df = df.copy(deep=False)
+    if 'counterparty' not in df.columns:
+        df['counterparty'] = None
+    if rate_history is not None:
+        values, types = effective_rates(df, rate_history, rate_method, reporting_date=reporting_date)
+        rates = pd.Series(values, index=df.index)
+        if stats is not None:
+            stats['pre_history'] = stats.get('pre_history', 0) + int((types == 'PRE_HISTORY').sum())
+        undated = rates.isna() & pd.to_datetime(df['txn_date'], errors='coerce').isna()
+        if undated.any():
+            rates[undated] = df.loc[undated, 'currency'].map(fx_rates or zar_closing_rates())
+    else:
+        rates = df['currency'].map(fx_rates or zar_closing_rates())
+    if rates.isna().any():
+        missing = sorted(df.loc[rates.isna(), 'currency'].astype(str).unique())
+        raise KeyError(f"No ZAR translation rate for currencies: {missing}")
+
+    fx = rates.to_numpy(dtype='float64')
+    debit = df['debit'].to_numpy(dtype='float64')
+    credit = df['credit'].to_numpy(dtype='float64')
+
+    df['fx_rate'] = fx
+    df['debit_zar'] = np.round(debit * fx, 2)
+    df['credit_zar'] = np.round(credit * fx, 2)
+    apply_eliminations(df, np.zeros(len(df)) if eliminated is None else eliminated)
+    return df[GROUP_COLUMNS]
+
+def entity_chunks(source, chunk_size=1_000_000, from_history=False, base_dir=None):
+    """
+    Chunks of one entity ledger: the data/global_raw file at path source or, with from_history,
+    the rows of entity source in the deduplicated ESFE_GL_HISTORY dataset (see layer2_deduplication).
+    """
+    if from_history:
+        return iter_dataset(HISTORY_DATASET, chunk_size=chunk_size, entities=[source], base_dir=base_dir)
+    return pd.read_csv(source, chunksize=chunk_size)
+
+def scan_entity(source, chunk_size=1_000_000, from_history=False, base_dir=None):
+    """
+    Worker task (pass 1): the intercompany lines of one entity ledger, with their row number in it
+    (source_row), and its latest txn_date. Returns (lines, latest).
+    """
+    lines, latest, offset = [], [], 0
+    for chunk in entity_chunks(source, chunk_size, from_history, base_dir):
+        ic = chunk['account_code'].isin(ELIMINATION_ACCOUNTS).to_numpy()
+        lines.append(chunk[ic].assign(source_row=offset + np.flatnonzero(ic)))
+        latest.append(pd.to_datetime(chunk['txn_date'], errors='coerce').max())
+        offset += len(chunk)
+    return pd.concat(lines, ignore_index=True), pd.Series(latest, dtype='datetime64[ns]').max()
+
+def consolidate_entity(source, part_path, chunk_size=1_000_000, fx_rates=None,
+                       to_warehouse=True, base_dir=None, rate_history=None, rate_method=DEFAULT_RATE_METHOD,
+                       eliminated=None, reporting_date=None, from_history=False):
+    """
+    Worker task (pass 2): translates one entity ledger (see entity_chunks) chunk by chunk into a
+    header-less CSV part (and warehouse partitions). eliminated: pd.Series of ZAR to eliminate,
+    indexed by source_row. Returns (source, row_count, pre_history_rows).
+    """
+    rows = 0
+    stats = {'pre_history': 0}
+    with open(part_path, 'w', newline='') as part:
+        for chunk in entity_chunks(source, chunk_size, from_history, base_dir):
+            amounts = None
+            if eliminated is not None and len(eliminated):
+                amounts = pd.Series(np.arange(rows, rows + len(chunk))).map(eliminated).fillna(0.0).to_numpy()
+            translated = translate_entity_chunk(chunk, fx_rates, rate_history, rate_method, amounts, reporting_date, stats)
+            translated.to_csv(part, header=False, index=False)
+            if to_warehouse:
+                write_dataset(translated, 'ESFE_GROUP_CONSOLIDATED_ZAR', mode='append', base_dir=base_dir)
+            rows += len(translated)
+    return source, rows, stats['pre_history']
+
+def run_group_consolidation(pattern='Sovereign_*.csv', workers=None, chunk_size=1_000_000, fx_rates=None,
+                            rate_method=DEFAULT_RATE_METHOD, use_history=None, base_dir=None):
+    """
+    Layer 2: Multi-entity consolidation.
+    Reads every data/global_raw/Sovereign_*.csv on a process pool, translates each entity to ZAR,
+    eliminates matched intercompany pairs and merges the parts into ESFE_GROUP_CONSOLIDATED_ZAR.
+    Entities are merged in file-name order, so the output is deterministic for any worker count.
+
+    use_history reads the deduplicated ESFE_GL_HISTORY (one worker per entity) instead of the raw
+    files, so a batch ingested twice is counted once; by default it is used whenever it exists.
+    Run the deduplication gate (layer2_deduplication) first; the pipeline does.
+
+    Two passes: the intercompany lines of every entity are collected first and matched across the
+    group (layer2_intercompany_matching); the translation pass then nets the agreed amount of each
+    MATCHED / PARTIAL pair out of reporting_*_zar. Unmatched lines and residuals stay on the books.
+
+    rate_method: 'closing' applies fx_rates flat per currency (default: the FX store's closing
+    rates at the reporting date, see zar_closing_rates); 'spot' and 'ifrs' translate each row at its
+    date-effective rate from the FX store history (as-of join, see layer2_fx_translation). 'ifrs'
+    takes the closing rate at the group reporting date (month-end of the latest txn_date).
+    Default: DEFAULT_RATE_METHOD ('ifrs').
+    """
+    base_dir = base_dir or os.path.dirname(os.path.abspath(__file__))
+    output_path = csv_path('ESFE_GROUP_CONSOLIDATED_ZAR', base_dir)
+    parts_dir = os.path.join(base_dir, 'data', '.consolidation_parts')
+
+    print(f"--- Sovereign Engine: Group Consolidation ---")
+    if use_history is None:
+        use_history = dataset_exists(HISTORY_DATASET, base_dir)
+    if use_history:
+        if not dataset_exists(HISTORY_DATASET, base_dir):
+            print(f"ERROR: {HISTORY_DATASET} not found. Run the deduplication gate (layer2_deduplication) first.")
+            return
+        sources = sorted(read_dataset(HISTORY_DATASET, columns=['entity'], base_dir=base_dir)['entity'].astype(str).unique())
+        print(f"Source: {HISTORY_DATASET} (deduplicated history, {len(sources)} entities)")
+    else:
+        sources = sorted(glob.glob(os.path.join(base_dir, 'data', 'global_raw', pattern)))
+        if not sources:
+            print(f"ERROR: No entity ledgers matching data/global_raw/{pattern}. Run the global generator first.")
+            return
+
+    if rate_method != 'closing' and rate_method not in RATE_METHODS:
+        print(f"ERROR: Unknown rate method '{rate_method}'. Use 'closing', 'spot' or 'ifrs'.")
+        return
+
+    # 1. Reset intermediate parts and the warehouse copy
+    shutil.rmtree(parts_dir, ignore_errors=True)
+    os.makedirs(parts_dir)
+    shutil.rmtree(warehouse_path('ESFE_GROUP_CONSOLIDATED_ZAR', base_dir), ignore_errors=True)
+
+    part_paths = [os.path.join(parts_dir, f'{i:05d}.csv') for i in range(len(sources))]
+    print(f"Consolidating {len(sources)} entities on {workers or os.cpu_count()} processes...")
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # 2. Intercompany lines and the group reporting date (only account 2000 rows leave the workers)
+        n = len(sources)
+        scans = list(pool.map(scan_entity, sources, [chunk_size] * n, [use_history] * n, [base_dir] * n))
+        ic = pd.concat([lines.assign(source=i) for i, (lines, _) in enumerate(scans)], ignore_index=True)
+        reporting_date = reporting_period_end([latest for _, latest in scans])
+        print(f"Reporting date: {reporting_date.date() if pd.notna(reporting_date) else 'n/a'}")
+
+        # Rates are resolved once here, pinned to the reporting date, so every worker translates with the same table
+        fx_rates = fx_rates or zar_closing_rates(reporting_date)
+        rate_history = None
+        if rate_method != 'closing':
+            rate_history = zar_rate_history(fallback=fx_rates)
+            print(f"Date-effective translation ({rate_method}): {rate_history['date'].nunique():,} rate dates")
+
+        # 3. Match intercompany lines across the group
+        translated = translate_entity_chunk(ic, fx_rates, rate_history, rate_method, reporting_date=reporting_date)
+        eliminated = pd.Series(intercompany_eliminations(translated), index=ic.index)
+        ic_total = translated['debit_zar'].sum() + translated['credit_zar'].sum()
+        print(f"Intercompany: {int((eliminated > 0).sum()):,} of {len(ic):,} lines matched, R {eliminated.sum():,.2f} eliminated, "
+              f"R {ic_total - eliminated.sum():,.2f} left on the books")
+        by_source = [pd.Series(eliminated[ic['source'] == i].to_numpy(), index=ic.loc[ic['source'] == i, 'source_row'].to_numpy())
+                     for i in range(len(sources))]
+
+        # 4. Translate entities in parallel (each worker streams its own file)
+        futures = [
+            pool.submit(consolidate_entity, src, part, chunk_size, fx_rates, HAS_ARROW, base_dir, rate_history, rate_method,
+                        elim[elim > 0], reporting_date, use_history)
+            for src, part, elim in zip(sources, part_paths, by_source)
+        ]
+        results = [f.result() for f in futures]
+
+    # 5. Merge parts into the group CSV export (byte copy, no re-parsing)
+    with open(output_path, 'w', newline='') as out:
+        out.write(','.join(GROUP_COLUMNS) + '\n')
+        for part in part_paths:
+            with open(part, 'r', newline='') as src:
+                shutil.copyfileobj(src, out, length=16 * 1024 * 1024)
+    shutil.rmtree(parts_dir, ignore_errors=True)
+
+    total_rows = sum(rows for _, rows, _ in results)
+    for src, rows, _ in results:
+        print(f"  {src if use_history else os.path.basename(src):<30} {rows:>12,} rows")
+    pre_history = sum(early for _, _, early in results)
+    if pre_history:
+        first = rate_history['date'].min().date()
+        print(f"WARNING: {pre_history:,} rows predate the FX history (first rate {first}) and were translated at its earliest rate.")
+    print(f"SUCCESS: {total_rows:,} group rows consolidated to {output_path}")
+    return output_path
+
+if __name__ == "__main__":
+    run_group_consolidation()
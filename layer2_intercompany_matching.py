@@ -0,0 +1,200 @@
+import pandas as pd
+import numpy as np
+import os
+import glob
+from sovereign_storage import dataset_exists, read_dataset, publish_dataset
+
+IC_COLUMNS = ['txn_id', 'txn_date', 'entity', 'counterparty', 'account_code', 'debit_zar', 'credit_zar']
+
+def load_intercompany_rows(base_dir=None):
+    """
+    Intercompany lines in ZAR from the consolidated group dataset, or straight from
+    data/global_raw when consolidation has not run yet.
+    """
+    # Consolidation matches through this module, so its helpers are imported at call time
+    from layer2_group_consolidation import translate_entity_chunk, ELIMINATION_ACCOUNTS
+    base_dir = base_dir or os.path.dirname(os.path.abspath(__file__))
+    if dataset_exists('ESFE_GROUP_CONSOLIDATED_ZAR', base_dir):
+        df = read_dataset('ESFE_GROUP_CONSOLIDATED_ZAR', columns=IC_COLUMNS, base_dir=base_dir)
+    else:
+        frames = [translate_entity_chunk(pd.read_csv(p)) for p in sorted(glob.glob(os.path.join(base_dir, 'data', 'global_raw', 'Sovereign_*.csv')))]
+        df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=IC_COLUMNS)
+    df = df[df['account_code'].isin(ELIMINATION_ACCOUNTS)]
+    return df.reset_index(drop=True)
+
+def _counterparties(ic):
+    """Counterparty labels, None where the ledger does not name one."""
+    if 'counterparty' not in ic.columns:
+        return np.full(len(ic), None, dtype=object)
+    cp = ic['counterparty']
+    return np.where(cp.notna().to_numpy(), cp.astype(str).to_numpy(), None)
+
+def _prepare_sides(ic):
+    """Splits intercompany lines into payables (credit) and receivables (debit) with numeric keys."""
+    debit = ic['debit_zar'].to_numpy(dtype='float64')
+    credit = ic['credit_zar'].to_numpy(dtype='float64')
+    # Ties are broken on (entity, txn_id) rank rather than row position, so the pairs do not
+    # depend on the order the lines were read in (entity files or warehouse partitions)
+    entity = ic['entity'].astype(str).to_numpy()
+    rank = np.empty(len(ic), dtype='int64')
+    rank[np.lexsort((ic['txn_id'].astype(str).to_numpy(), entity))] = np.arange(len(ic))
+    base = pd.DataFrame({
+        'row': np.arange(len(ic)),
+        'rank': rank,
+        'entity': entity,
+        'counterparty': _counterparties(ic),
+        'amount': np.where(credit > 0, credit, debit),
+        'day': pd.to_datetime(ic['txn_date']).to_numpy().astype('datetime64[D]').astype('int64')
+    })
+    payables = base[credit > 0].reset_index(drop=True)
+    receivables = base[(debit > 0) & ~(credit > 0)].reset_index(drop=True)
+    return payables, receivables
+
+def _candidate_pairs(pay, rec, amount_bucket, date_window_days, amount_ok):
+    """
+    Hash-joins payables to receivables on (counterparty pair, amount bucket, date bucket),
+    probing neighbouring buckets so tolerances that straddle a boundary still match.
+    Work is proportional to rows plus true candidates, not rows squared.
+    """
+    if pay.empty or rec.empty:
+        return pd.DataFrame(columns=['row_p', 'row_r', 'rank_p', 'rank_r', 'amount_diff', 'day_diff'])
+
+    with_cp = pay['counterparty'].notna().all() and rec['counterparty'].notna().all()
+    pay = pay.assign(a_bkt=amount_bucket(pay['amount']), d_bkt=pay['day'] // max(date_window_days, 1))
+    rec = rec.assign(a_bkt=amount_bucket(rec['amount']), d_bkt=rec['day'] // max(date_window_days, 1))
+    if with_cp:
+        # Payable of A owed to B pairs with the receivable B holds on A
+        pay = pay.assign(k1=pay['entity'], k2=pay['counterparty'])
+        rec = rec.assign(k1=rec['counterparty'], k2=rec['entity'])
+        keys = ['k1', 'k2', 'a_bkt', 'd_bkt']
+    else:
+        keys = ['a_bkt', 'd_bkt']
+
+    frames = []
+    for da in (-1, 0, 1):
+        for dd in (-1, 0, 1):
+            probe = rec.assign(a_bkt=rec['a_bkt'] + da, d_bkt=rec['d_bkt'] + dd)
+            joined = pay.merge(probe, on=keys, suffixes=('_p', '_r'))
+            if joined.empty:
+                continue
+            joined = joined[
+                (joined['entity_p'] != joined['entity_r']) &
+                ((joined['day_p'] - joined['day_r']).abs() <= date_window_days) &
+                amount_ok(joined['amount_p'], joined['amount_r'])
+            ]
+            frames.append(pd.DataFrame({
+                'row_p': joined['row_p'].to_numpy(),
+                'row_r': joined['row_r'].to_numpy(),
+                'rank_p': joined['rank_p'].to_numpy(),
+                'rank_r': joined['rank_r'].to_numpy(),
+                'amount_diff': (joined['amount_p'] - joined['amount_r']).abs().to_numpy(),
+                'day_diff': (joined['day_p'] - joined['day_r']).abs().to_numpy()
+            }))
+    if not frames:
+        return pd.DataFrame(columns=['row_p', 'row_r', 'rank_p', 'rank_r', 'amount_diff', 'day_diff'])
+    return pd.concat(frames, ignore_index=True).drop_duplicates(['row_p', 'row_r'])
+
+def _assign_one_to_one(candidates):
+    """Greedy best-first 1:1 assignment, done in vectorized rounds instead of a per-pair loop."""
+    accepted = []
+    candidates = candidates.sort_values(['amount_diff', 'day_diff', 'rank_p', 'rank_r'], kind='mergesort')
+    while not candidates.empty:
+        best = candidates.drop_duplicates('row_p').drop_duplicates('row_r')
+        accepted.append(best)
+        candidates = candidates[~candidates['row_p'].isin(best['row_p']) & ~candidates['row_r'].isin(best['row_r'])]
+    if not accepted:
+        return candidates
+    return pd.concat(accepted, ignore_index=True)
+
+def match_intercompany(ic, amount_tolerance=1.0, date_window_days=5, partial_tolerance=0.05):
+    """
+    Pairs each entity's intercompany payable with the counterparty's receivable.
+    Stage 1 (MATCHED): amounts agree within amount_tolerance ZAR inside the date window.
+    Stage 2 (PARTIAL): remaining lines whose amounts agree within partial_tolerance (relative).
+    Everything left is UNMATCHED. Returns one reconciliation row per intercompany line.
+    """
+    pay, rec = _prepare_sides(ic)
+
+    # Stage 1: absolute ZAR buckets
+    exact = _assign_one_to_one(_candidate_pairs(
+        pay, rec,
+        amount_bucket=lambda a: np.floor(a / amount_tolerance).astype('int64'),
+        date_window_days=date_window_days,
+        amount_ok=lambda p, r: (p - r).abs() <= amount_tolerance
+    ))
+
+    # Stage 2: log-scale buckets give a relative tolerance on what is left
+    step = np.log1p(partial_tolerance)
+    partial = _assign_one_to_one(_candidate_pairs(
+        pay[~pay['row'].isin(exact['row_p'])], rec[~rec['row'].isin(exact['row_r'])],
+        amount_bucket=lambda a: np.floor(np.log(a) / step).astype('int64'),
+        date_window_days=date_window_days,
+        amount_ok=lambda p, r: (p - r).abs() <= partial_tolerance * np.maximum(p, r)
+    ))
+
+    # Build the reconciliation (one row per IC line, linked to its counterpart)
+    recon = ic.reset_index(drop=True).copy()
+    recon['side'] = np.where(recon['credit_zar'] > 0, 'PAYABLE', 'RECEIVABLE')
+    recon['amount_zar'] = np.where(recon['credit_zar'] > 0, recon['credit_zar'], recon['debit_zar'])
+    recon['match_status'] = 'UNMATCHED'
+    recon['match_id'] = pd.Series(pd.NA, index=recon.index, dtype='Int64')
+    recon['matched_entity'] = None
+    recon['matched_txn_id'] = None
+    recon['difference_zar'] = np.nan
+
+    offset = 0
+    for status, pairs in (('MATCHED', exact), ('PARTIAL', partial)):
+        if pairs.empty:
+            continue
+        ids = np.arange(offset, offset + len(pairs))
+        offset += len(pairs)
+        p_rows = pairs['row_p'].to_numpy(dtype='int64')
+        r_rows = pairs['row_r'].to_numpy(dtype='int64')
+        diff = pairs['amount_diff'].to_numpy(dtype='float64')
+        for own, other in ((p_rows, r_rows), (r_rows, p_rows)):
+            recon.loc[own, 'match_status'] = status
+            recon.loc[own, 'match_id'] = ids
+            recon.loc[own, 'matched_entity'] = recon['entity'].to_numpy()[other]
+            recon.loc[own, 'matched_txn_id'] = recon['txn_id'].to_numpy()[other]
+            recon.loc[own, 'difference_zar'] = diff
+    return recon
+
+def elimination_amounts(recon):
+    """
+    ZAR eliminated per reconciliation line: the amount both sides of its MATCHED / PARTIAL pair agree on
+    (the smaller of the two). UNMATCHED lines and the residual of a partial pair stay on the books.
+    """
+    common = recon.groupby('match_id')['amount_zar'].transform('min')
+    return np.round(common.fillna(0.0).to_numpy(dtype='float64'), 2)
+
+def run_intercompany_matching(amount_tolerance=1.0, date_window_days=5, partial_tolerance=0.05, base_dir=None):
+    """
+    Layer 2: Intercompany reconciliation across the group entities.
+    Consolidation eliminates the same MATCHED / PARTIAL pairs (see layer2_group_consolidation);
+    this report lists every intercompany line with its match and the amount left on the books.
+    """
+    base_dir = base_dir or os.path.dirname(os.path.abspath(__file__))
+    print(f"--- Sovereign Engine: Intercompany Elimination Matching ---")
+
+    ic = load_intercompany_rows(base_dir)
+    if ic.empty:
+        print("ERROR: No intercompany lines found. Run the group consolidation first.")
+        return
+
+    recon = match_intercompany(ic, amount_tolerance, date_window_days, partial_tolerance)
+    recon['eliminated_zar'] = elimination_amounts(recon)
+    recon['residual_zar'] = np.round(recon['amount_zar'] - recon['eliminated_zar'], 2)
+    output_path = publish_dataset(recon, 'ESFE_IC_RECONCILIATION', partition_cols=None, base_dir=base_dir)
+
+    counts = recon['match_status'].value_counts()
+    unmatched_zar = recon.loc[recon['match_status'] == 'UNMATCHED', 'amount_zar'].sum()
+    print(f"Intercompany lines:       {len(recon):,}")
+    print(f"Matched:                  {counts.get('MATCHED', 0):,}")
+    print(f"Partially matched:        {counts.get('PARTIAL', 0):,}")
+    print(f"Unmatched:                {counts.get('UNMATCHED', 0):,} (R {unmatched_zar:,.2f})")
+    print(f"Eliminated:               R {recon['eliminated_zar'].sum():,.2f} | left on the books R {recon['residual_zar'].sum():,.2f}")
+    print(f"SUCCESS: Reconciliation saved to {output_path}")
+    return recon
+
+if __name__ == "__main__":
+    run_intercompany_matching()
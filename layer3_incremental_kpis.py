@@ -0,0 +1,313 @@
+import pandas as pd
+import numpy as np
+import os
+import json
+import hashlib
+from datetime import datetime
+from urllib.parse import unquote
+from sovereign_normalizer import normalize_debit_credit, to_cents
+from sovereign_storage import (
+    dataset_exists, has_warehouse, warehouse_path, csv_path, iter_dataset,
+    publish_dataset, DATE_COLUMNS, DEFAULT_ENTITY
+)
+from layer3_kpis_engine import KPI_COLUMNS, build_kpi_summary, print_kpi_snapshot
+from sovereign_cube import cube_source, SOURCE_ENV, SOURCE_DATASETS
+
+# Running aggregates are kept per (entity, fiscal_period, account) so a single
+# period can be replaced when upstream data changes, without touching the rest.
+STATE_KEYS = ['entity', 'fiscal_period', 'account_name']
+INCREMENTAL_COLUMNS = KPI_COLUMNS + ['txn_id', 'entity'] + DATE_COLUMNS
+# Period label for rows without a valid date (the warehouse's null fiscal_period partition);
+# they are kept, as run_kpi_engine keeps them
+UNDATED_PERIOD = 'UNDATED'
+NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+# CSV sources: the processed prefix is checksummed in blocks; each run re-reads a rotating sample
+PREFIX_BLOCK_BYTES = 4 * 1024 * 1024
+SAMPLE_BLOCKS = 8
+
+def _state_paths(base_dir):
+    state_dir = os.path.join(base_dir, 'data', 'state')
+    return (os.path.join(state_dir, 'ESFE_KPI_STATE.csv'),
+            os.path.join(state_dir, 'ESFE_KPI_WATERMARK.json'))
+
+def load_state(base_dir):
+    """Returns (aggregates, watermark) from the last run, or (None, None) on a cold start."""
+    state_path, watermark_path = _state_paths(base_dir)
+    if not (os.path.exists(state_path) and os.path.exists(watermark_path)):
+        return None, None
+    aggregates = pd.read_csv(state_path, dtype={'entity': str, 'fiscal_period': str, 'account_name': str})
+    with open(watermark_path) as f:
+        watermark = json.load(f)
+    return aggregates.set_index(STATE_KEYS), watermark
+
+def save_state(aggregates, watermark, base_dir):
+    state_path, watermark_path = _state_paths(base_dir)
+    os.makedirs(os.path.dirname(state_path), exist_ok=True)
+    aggregates.reset_index().to_csv(state_path, index=False)
+    with open(watermark_path, 'w') as f:
+        json.dump(watermark, f, indent=2)
+
+def partition_totals(df):
+    """Per (entity, fiscal_period, account) debit/credit cents for one block of ledger rows."""
+    if 'control_status' in df.columns:
+        df = df[df['control_status'] == 'PASS']
+
+    debit, credit = normalize_debit_credit(df)
+    date_col = next((c for c in DATE_COLUMNS if c in df.columns), None)
+    if date_col:
+        periods = pd.to_datetime(df[date_col], errors='coerce').dt.strftime('%Y-%m').fillna(UNDATED_PERIOD)
+    else:
+        periods = pd.Series('ALL', index=df.index)
+    entities = df['entity'].astype(str) if 'entity' in df.columns else pd.Series(DEFAULT_ENTITY, index=df.index)
+
+    block = pd.DataFrame({
+        'entity': entities.to_numpy(),
+        'fiscal_period': periods.to_numpy(),
+        'account_name': df['account_name'].astype(str).to_numpy(),
+        'debit': to_cents(debit),
+        'credit': to_cents(credit)
+    })
+    return block.groupby(STATE_KEYS).sum()
+
+def _merge(frames):
+    frames = [f for f in frames if f is not None and not f.empty]
+    if not frames:
+        return pd.DataFrame(columns=['debit', 'credit'], index=pd.MultiIndex.from_arrays([[], [], []], names=STATE_KEYS))
+    return pd.concat(frames).groupby(level=STATE_KEYS).sum()
+
+def _advance_high_water(watermark, df, count_late=False):
+    """Moves the txn_id / date high-water marks forward; optionally counts appended rows that arrived out of order."""
+    late = 0
+    if 'txn_id' in df.columns and len(df):
+        seq = pd.to_numeric(df['txn_id'].astype(str).str.extract(r'(\d+)$')[0], errors='coerce')
+        if count_late and watermark.get('max_txn_seq') is not None:
+            late += int((seq <= watermark['max_txn_seq']).sum())
+        if seq.notna().any():
+            watermark['max_txn_seq'] = int(max(seq.max(), watermark.get('max_txn_seq') or 0))
+    date_col = next((c for c in DATE_COLUMNS if c in df.columns), None)
+    if date_col and len(df):
+        latest = pd.to_datetime(df[date_col], errors='coerce').max()
+        if pd.notna(latest):
+            latest = latest.strftime('%Y-%m-%d')
+            watermark['max_date'] = max(latest, watermark.get('max_date') or latest)
+    watermark['late_rows'] = watermark.get('late_rows', 0) + late
+
+def _scan(source_name, base_dir, watermark, chunk_size, **filters):
+    """Aggregates a (filtered) slice of the source chunk by chunk."""
+    partials = []
+    for chunk in iter_dataset(source_name, columns=INCREMENTAL_COLUMNS, chunk_size=chunk_size, base_dir=base_dir, **filters):
+        _advance_high_water(watermark, chunk)
+        partials.append(partition_totals(chunk))
+        if len(partials) > 16:
+            partials = [_merge(partials)]
+    return _merge(partials)
+
+# --- CSV sources: append-only watermark on byte offset ---
+
+def _block_checksums(path, first, end, blocks=None):
+    """Checksums of the PREFIX_BLOCK_BYTES blocks of [0, end) numbered from first on (or just the listed ones)."""
+    numbers = range(first, -(-end // PREFIX_BLOCK_BYTES)) if blocks is None else blocks
+    sums = []
+    with open(path, 'rb') as f:
+        for block in numbers:
+            start = block * PREFIX_BLOCK_BYTES
+            f.seek(start)
+            sums.append(hashlib.sha256(f.read(min(PREFIX_BLOCK_BYTES, end - start))).hexdigest()[:16])
+    return sums
+
+def _verify_prefix(path, state, verify_prefix):
+    """
+    Compares the processed prefix with its stored block checksums. 'sample' re-reads the first
+    and last block plus SAMPLE_BLOCKS more from a cursor that rotates across runs, so every block
+    is re-checked within a few runs; 'full' re-reads them all. Returns (unchanged, blocks_checked).
+    """
+    stored = state['blocks']
+    n = len(stored)
+    if verify_prefix == 'full' or n <= SAMPLE_BLOCKS + 2:
+        blocks = list(range(n))
+    else:
+        cursor = state.get('cursor', 0)
+        blocks = sorted({0, n - 1} | {(cursor + k) % n for k in range(SAMPLE_BLOCKS)})
+        state['cursor'] = (cursor + SAMPLE_BLOCKS) % n
+    current = _block_checksums(path, 0, state.get('offset', 0), blocks)
+    return all(stored[b] == c for b, c in zip(blocks, current)), len(blocks)
+
+def _csv_delta(path, watermark, chunk_size, verify_prefix):
+    """
+    Returns (delta_totals, reason, blocks_checked). delta_totals is None when the processed
+    prefix changed upstream and a rebuild is required; reason explains why.
+    """
+    state = watermark.get('csv', {})
+    offset = state.get('offset', 0)
+    size = os.path.getsize(path)
+    if size < offset:
+        return None, "source file shrank", 0
+    if 'blocks' not in state:
+        return None, "stored state has no prefix checksums", 0
+    unchanged, checked = _verify_prefix(path, state, verify_prefix)
+    if not unchanged:
+        return None, "rows inside the processed history were changed", checked
+
+    with open(path, 'rb') as f:
+        header = f.readline().decode('utf-8').rstrip('\r\n').split(',')
+        f.seek(max(0, offset - 1))
+        if offset and f.read(1) != b'\n':
+            return None, "last processed line was extended", checked
+        if header != state.get('header'):
+            return None, "source columns changed", checked
+
+        partials = []
+        if size > offset:
+            f.seek(offset)
+            for chunk in pd.read_csv(f, header=None, names=header, chunksize=chunk_size):
+                chunk = chunk[[c for c in chunk.columns if c in INCREMENTAL_COLUMNS]]
+                _advance_high_water(watermark, chunk, count_late=True)
+                partials.append(partition_totals(chunk))
+                if len(partials) > 16:
+                    partials = [_merge(partials)]
+    return _merge(partials), None, checked
+
+def _csv_mark(path, watermark):
+    """Records the new offset; only blocks touched by the appended bytes are checksummed."""
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        header = f.readline().decode('utf-8').rstrip('\r\n').split(',')
+    previous = watermark.get('csv', {})
+    keep = previous.get('offset', 0) // PREFIX_BLOCK_BYTES if 'blocks' in previous else 0
+    blocks = previous.get('blocks', [])[:keep] + _block_checksums(path, keep, size)
+    watermark['csv'] = {'offset': size, 'header': header, 'blocks': blocks, 'cursor': previous.get('cursor', 0)}
+
+# --- Warehouse sources: per-partition file signatures ---
+
+def _partition_signatures(source_name, base_dir):
+    """Maps 'entity=../fiscal_period=..' to a signature of its parquet files (name, size, mtime)."""
+    root = warehouse_path(source_name, base_dir)
+    signatures = {}
+    for dirpath, _, files in os.walk(root):
+        parts = [f for f in sorted(files) if f.endswith('.parquet')]
+        if not parts:
+            continue
+        stats = [(f, os.stat(os.path.join(dirpath, f))) for f in parts]
+        key = os.path.relpath(dirpath, root).replace(os.sep, '/')
+        signatures[key] = hashlib.sha256(
+            ';'.join(f"{f}:{st.st_size}:{st.st_mtime_ns}" for f, st in stats).encode()
+        ).hexdigest()
+    return signatures
+
+def _partition_filters(key):
+    """
+    Turns a hive directory key into read filters (entity + fiscal period date bounds).
+    The null fiscal_period partition (unparseable dates) is read with undated=True.
+    """
+    values = {k: unquote(v) for k, v in (part.split('=', 1) for part in key.split('/') if '=' in part)}
+    filters = {}
+    if 'entity' in values:
+        filters['entities'] = [values['entity']]
+    if values.get('fiscal_period') == NULL_PARTITION:
+        values['fiscal_period'] = UNDATED_PERIOD
+        filters['undated'] = True
+    elif 'fiscal_period' in values:
+        start = pd.Period(values['fiscal_period'], freq='M')
+        filters['date_from'] = start.start_time
+        filters['date_to'] = start.end_time
+    return filters, values
+
+def run_incremental_kpi_engine(chunk_size=1_000_000, verify_prefix='sample', force_rebuild=False, source_name=None,
+                               base_dir=None):
+    """
+    Layer 3 (incremental): refreshes ESFE_KPIS by applying only what changed since the last run.
+
+    Running aggregates per (entity, fiscal_period, account) are persisted in data/state with a
+    high-water mark on txn_id and date.
+    - Warehouse sources: partitions whose files changed are re-aggregated (partial rebuild),
+      new partitions are added and deleted ones dropped; untouched periods are never read.
+    - CSV sources: only bytes appended after the stored offset are parsed. The processed prefix
+      is kept as 4 MB block checksums and the history is rebuilt when a block changed.
+      verify_prefix='sample' (default) re-reads the first and last block and 8 more that rotate
+      from run to run, so the cost does not grow with the file and a correction anywhere is
+      caught within a few runs; 'full' re-reads the whole prefix on every run.
+    Rows without a valid date are aggregated under the UNDATED period.
+    The resulting ESFE_KPIS.csv is identical to a full run_kpi_engine() on the same source_name
+    (default: the pinned or most processed ledger, see sovereign_cube.cube_source).
+    """
+    base_dir = base_dir or os.path.dirname(os.path.abspath(__file__))
+    source_name = source_name or cube_source(base_dir) or os.environ.get(SOURCE_ENV) or SOURCE_DATASETS[-1]
+    mode = 'warehouse' if has_warehouse(source_name, base_dir) else 'csv'
+
+    print(f"--- KPI Engine Execution (Incremental) ---")
+    print(f"Source Data: {source_name} ({mode})")
+
+    if not dataset_exists(source_name, base_dir):
+        print(f"ERROR: Data not found. Please run Layer 1 or Layer 2 first.")
+        return
+
+    aggregates, watermark = (None, None) if force_rebuild else load_state(base_dir)
+    if watermark is not None and (watermark.get('source') != source_name or watermark.get('mode') != mode):
+        print("Source changed since last run. Rebuilding history.")
+        aggregates, watermark = None, None
+
+    # 1. Apply only the delta
+    if watermark is None:
+        watermark = {'source': source_name, 'mode': mode}
+        print("No usable state found. Building aggregates from full history.")
+        aggregates = _scan(source_name, base_dir, watermark, chunk_size)
+        if mode == 'warehouse':
+            watermark['partitions'] = _partition_signatures(source_name, base_dir)
+        else:
+            _csv_mark(csv_path(source_name, base_dir), watermark)
+
+    elif mode == 'warehouse':
+        current = _partition_signatures(source_name, base_dir)
+        previous = watermark.get('partitions', {})
+        changed = [k for k, sig in current.items() if previous.get(k) != sig]
+        removed = [k for k in previous if k not in current]
+        print(f"Partitions: {len(current)} total | {len(changed)} new/changed | {len(removed)} removed")
+
+        for key in changed + removed:
+            _, values = _partition_filters(key)
+            mask = np.ones(len(aggregates), dtype=bool)
+            if 'entity' in values:
+                mask &= aggregates.index.get_level_values('entity') == values['entity']
+            if 'fiscal_period' in values:
+                mask &= aggregates.index.get_level_values('fiscal_period') == values['fiscal_period']
+            aggregates = aggregates[~mask]
+
+        refreshed = []
+        for key in changed:
+            filters, _ = _partition_filters(key)
+            refreshed.append(_scan(source_name, base_dir, watermark, chunk_size, **filters))
+        aggregates = _merge([aggregates] + refreshed)
+        watermark['partitions'] = current
+
+    else:
+        path = csv_path(source_name, base_dir)
+        delta, reason, checked = _csv_delta(path, watermark, chunk_size, verify_prefix)
+        if delta is None:
+            print(f"Upstream correction detected ({reason}). Rebuilding history.")
+            watermark = {'source': source_name, 'mode': mode}
+            aggregates = _scan(source_name, base_dir, watermark, chunk_size)
+        else:
+            new_bytes = os.path.getsize(path) - watermark['csv']['offset']
+            print(f"Appended data since last run: {new_bytes:,} bytes "
+                  f"(prefix blocks verified: {checked} of {len(watermark['csv']['blocks'])}, {verify_prefix})")
+            aggregates = _merge([aggregates, delta])
+        _csv_mark(path, watermark)
+
+    if aggregates.empty:
+        print("ERROR: No records found to process.")
+        return
+
+    # 2. Persist running aggregates and the new watermark
+    watermark['updated_at'] = datetime.now().isoformat(timespec='seconds')
+    save_state(aggregates, watermark, base_dir)
+    print(f"Watermark: txn seq {watermark.get('max_txn_seq')} | date {watermark.get('max_date')} | "
+          f"late rows seen {watermark.get('late_rows', 0)}")
+
+    # 3. Roll up to accounts and export exactly like the full engine
+    totals = aggregates.groupby(level='account_name').sum()
+    summary = build_kpi_summary(totals)
+    publish_dataset(summary, 'ESFE_KPIS', partition_cols=None, base_dir=base_dir)
+    print_kpi_snapshot(summary)
+
+if __name__ == "__main__":
+    run_incremental_kpi_engine()
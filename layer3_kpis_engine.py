@@ -1,88 +1,104 @@
 import pandas as pd
 import os
-import re
+from sovereign_normalizer import from_cents, DEBIT_COLUMNS, CREDIT_COLUMNS
+from sovereign_storage import dataset_exists, iter_dataset, publish_dataset
+from sovereign_coa import classify_accounts, CURRENT_ASSET_CATEGORIES, CURRENT_LIABILITY_CATEGORIES
+from sovereign_statutory import corporate_tax, cit_rate
+from sovereign_cube import load_cube, query_cube, cube_manifest, cube_source, aggregate_cube
 
-def run_kpi_engine():
+# Columns the KPI engine reads from raw ledgers (streaming and incremental runs); the default run reads the GL cube
+KPI_COLUMNS = ['account_name', 'control_status', 'amount', 'amount_zar'] + DEBIT_COLUMNS + CREDIT_COLUMNS
+
+def cube_account_totals(cube):
+    """Per-account reporting debit/credit totals in int64 cents, rolled up from the GL cube."""
+    totals = query_cube(cube, by='account_name', measures=['debit_zar', 'credit_zar'], as_cents=True)
+    totals = totals.rename(columns={'debit_zar': 'debit', 'credit_zar': 'credit'}).set_index('account_name')
+    # Cube dimensions are categorical; merge on plain labels
+    totals.index = totals.index.astype(str)
+    return totals
+
+def account_totals(df):
+    """
+    Per-account debit/credit totals for one block of ledger rows, in int64 cents.
+    Same rules as the GL cube (PASS rows only, reporting amounts first): the block is rolled up through it.
+    """
+    return cube_account_totals(aggregate_cube([df]))
+
+def merge_account_totals(partials):
+    """Combines per-chunk account totals into one frame (exact integer sums)."""
+    return pd.concat(partials).groupby(level=0).sum()
+
+def build_kpi_summary(totals):
+    """Turns merged cent totals into the ESFE_KPIS layout, in alphabetical account order."""
+    totals = totals.sort_index()
+    summary = pd.DataFrame({
+        'account_name': totals.index.to_numpy(),
+        'debit': from_cents(totals['debit']),
+        'credit': from_cents(totals['credit']),
+        'total_volume_zar': from_cents(totals['debit'] + totals['credit'])
+    })
+    return summary
+
+def compute_kpis(cube):
+    """In-memory Layer 3 core: the ESFE_KPIS table from a GL cube (empty when no rows passed controls)."""
+    return build_kpi_summary(cube_account_totals(cube))
+
+def run_kpi_engine(streaming=False, chunk_size=1_000_000, source_name=None):
     """
     Step 3 of the Sovereign Engine:
     Transforms validated ledger entries into financial intelligence (KPIs).
     Localized for the South African (ZAR) reporting environment.
+
+    Reads the materialized GL cube (see sovereign_cube), which is rebuilt in chunks of
+    chunk_size rows only when its source ledger has changed. source_name pins the ledger
+    (e.g. 'ESFE_VALIDATED_GL'); by default the most processed ledger available is used.
+
+    streaming=True skips the cube: the ledger is read in chunks of chunk_size rows and the
+    per-account partial sums are merged (account_totals), without writing anything but ESFE_KPIS.
+    Both modes write an identical ESFE_KPIS.csv.
     """
     base_dir = os.path.dirname(os.path.abspath(__file__))
-    # Prioritize the Consolidated ZAR file for the South African reporting entity
-    consolidated_path = os.path.join(base_dir, 'data', 'ESFE_GROUP_CONSOLIDATED_ZAR.csv')
-    validated_path = os.path.join(base_dir, 'data', 'ESFE_VALIDATED_GL.csv')
-    fact_gl_path = os.path.join(base_dir, 'data', 'ESFE_FACT_GL.csv')
-    
-    # Fallback logic to find the best available data source
-    if os.path.exists(consolidated_path):
-        input_path = consolidated_path
-    elif os.path.exists(validated_path):
-        input_path = validated_path
-    else:
-        input_path = fact_gl_path
-
-    output_path = os.path.join(base_dir, 'data', 'ESFE_KPIS.csv')
 
     print(f"--- KPI Engine Execution (South African Edition) ---")
-    print(f"Source Data: {os.path.basename(input_path)}")
-    
-    if not os.path.exists(input_path):
-        print(f"ERROR: Data not found. Please run Layer 1 or Layer 2 first.")
-        return
 
-    # 1. Load data
-    df = pd.read_csv(input_path)
-
-    # 2. Filter for valid records if validation has run
-    if 'control_status' in df.columns:
-        clean_df = df[df['control_status'] == 'PASS'].copy()
+    # 1. Load per-account totals (only PASS rows; the preferred source is the consolidated ZAR ledger)
+    if streaming:
+        source = source_name or cube_source(base_dir)
+        if source is None or not dataset_exists(source, base_dir):
+            print(f"ERROR: {source_name or 'Data'} not found. Please run Layer 1 or Layer 2 first.")
+            return
+        print(f"Source Data: {source}.csv (streaming)")
+        partials = [account_totals(chunk) for chunk in
+                    iter_dataset(source, columns=KPI_COLUMNS, chunk_size=chunk_size, base_dir=base_dir)]
+        totals = merge_account_totals(partials) if partials else cube_account_totals(aggregate_cube([]))
     else:
-        clean_df = df.copy()
-    
-    if clean_df.empty:
+        cube = load_cube(base_dir, chunk_size=chunk_size, source_name=source_name)
+        if cube is None:
+            print(f"ERROR: {source_name or 'Data'} not found. Please run Layer 1 or Layer 2 first.")
+            return
+        print(f"Source Data: {cube_manifest(base_dir).get('source')}.csv (via GL cube)")
+        totals = cube_account_totals(cube)
+
+    # 2. Aggregation Logic
+    summary = build_kpi_summary(totals)
+    if summary.empty:
         print("ERROR: No records found to process.")
         return
 
-    # 3. Dynamic Column Detection
-    cols = clean_df.columns.tolist()
-    is_single_col = 'amount' in cols or 'amount_zar' in cols
-    
-    def clean_val(val):
-        if pd.isna(val): return 0.0
-        if isinstance(val, (int, float)): return float(val)
-        clean_str = re.sub(r'[^\d.-]', '', str(val))
-        return float(clean_str) if clean_str else 0.0
-
-    # 4. Normalize Data into standard Debit/Credit for aggregation
-    if is_single_col:
-        amt_col = 'amount_zar' if 'amount_zar' in cols else 'amount'
-        clean_df['norm_debit'] = clean_df[amt_col].apply(lambda x: clean_val(x) if clean_val(x) > 0 else 0.0)
-        clean_df['norm_credit'] = clean_df[amt_col].apply(lambda x: abs(clean_val(x)) if clean_val(x) < 0 else 0.0)
-    else:
-        d_col = next((c for c in ['rep_debit_zar', 'debit_zar', 'debit'] if c in cols), 'debit')
-        c_col = next((c for c in ['rep_credit_zar', 'credit_zar', 'credit'] if c in cols), 'credit')
-        clean_df['norm_debit'] = clean_df[d_col].apply(clean_val)
-        clean_df['norm_credit'] = clean_df[c_col].apply(clean_val)
-
-    # 5. Aggregation Logic
-    summary = clean_df.groupby('account_name').agg({
-        'norm_debit': 'sum',
-        'norm_credit': 'sum'
-    }).reset_index()
-
-    summary.columns = ['account_name', 'debit', 'credit']
-    summary['total_volume_zar'] = summary['debit'] + summary['credit']
-    
-    # 6. Export KPI Summary
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    summary.to_csv(output_path, index=False)
-
-    # 7. Advanced Financial Intelligence (ZAR Focused)
-    rev_mask = summary['account_name'].str.contains('Revenue|Sales|Subscription', case=False, na=False)
-    exp_mask = summary['account_name'].str.contains('Cost|Expense|Salary|Operating|Infrastructure', case=False, na=False)
-    cash_mask = summary['account_name'].str.contains('Cash|Bank|Receivable', case=False, na=False)
-    liab_mask = summary['account_name'].str.contains('Payable|Liability|Debt', case=False, na=False)
+    # 3. Export KPI Summary
+    publish_dataset(summary, 'ESFE_KPIS', partition_cols=None, base_dir=base_dir)
+
+    # 4. Advanced Financial Intelligence (ZAR Focused)
+    print_kpi_snapshot(summary)
+    return summary
+
+def print_kpi_snapshot(summary):
+    """Derives the headline ZAR KPIs from an ESFE_KPIS summary and prints the executive snapshot."""
+    category = classify_accounts(summary)
+    rev_mask = category == 'revenue'
+    exp_mask = category == 'opex'
+    cash_mask = category.isin(CURRENT_ASSET_CATEGORIES)
+    liab_mask = category.isin(CURRENT_LIABILITY_CATEGORIES)
     
     total_rev = summary[rev_mask]['credit'].sum()
     total_opex = summary[exp_mask]['debit'].sum()
@@ -95,8 +111,8 @@ def run_kpi_engine():
     # Current Ratio (Liquidity Check)
     current_ratio = current_assets / current_liabs if current_liabs > 0 else 0
     
-    sa_tax_rate = 0.27
-    projected_tax = max(0, ebitda * sa_tax_rate)
+    sa_tax_rate = cit_rate()  # statutory rate table (see sovereign_statutory)
+    projected_tax = corporate_tax(ebitda)
     net_profit = ebitda - projected_tax
     margin_pct = (net_profit / total_rev * 100) if total_rev > 0 else 0
 
@@ -106,7 +122,7 @@ def run_kpi_engine():
     print(f"-----------------------------------------------")
     print(f"EBITDA:                   R {ebitda:,.2f}")
     print(f"Current Ratio:            {current_ratio:.2f}x")
-    print(f"Tax Provision (27%):      R {projected_tax:,.2f} (Projected)")
+    print(f"Tax Provision ({sa_tax_rate:.0%}):      R {projected_tax:,.2f} (Projected)")
     print(f"-----------------------------------------------")
     print(f"Net Operational Result:   R {net_profit:,.2f}")
     print(f"Net Profit Margin:        {margin_pct:.2f}%")
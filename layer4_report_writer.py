@@ -0,0 +1,157 @@
+import pandas as pd
+import numpy as np
+import os
+from datetime import datetime
+from sovereign_storage import read_dataset
+from layer4_simulation_engine import SimulationAccumulator
+
+try:
+    import xlsxwriter
+    HAS_XLSXWRITER = True
+except ImportError:
+    HAS_XLSXWRITER = False
+
+# Excel workbooks carry summaries only: raw paths belong in the parquet sidecar
+EXCEL_MAX_ROWS = 1_048_576
+REPORT_PERCENTILES = [0.1, 1, 5, 10, 25, 50, 75, 90, 95, 99, 99.9]
+HISTOGRAM_BUCKETS = 100
+ENGINE_VERSION = 'v1.0.0'
+
+def accumulator_from_values(values, bins=20_000):
+    """Wraps an in-memory result array in an accumulator so small runs share the report path."""
+    values = np.asarray(values, dtype=np.float64)
+    lo, hi = (values.min(), values.max()) if values.size else (0.0, 1.0)
+    acc = SimulationAccumulator(lo=lo, hi=hi if hi > lo else lo + 1.0, bins=bins)
+    acc.add(values)
+    return acc
+
+def metrics_table(metrics):
+    """
+    One row per metric. Numbers go in the numeric Value_ZAR column; labels and flags
+    (e.g. 'Sampling', 'Converged') go in a separate text Value column.
+    """
+    numeric = [isinstance(v, (int, float, np.number)) and not isinstance(v, (bool, np.bool_)) for v in metrics.values()]
+    return pd.DataFrame({
+        'Metric': list(metrics.keys()),
+        'Value_ZAR': pd.Series([float(v) if n else np.nan for v, n in zip(metrics.values(), numeric)], dtype='float64'),
+        'Value': [None if n else str(v) for v, n in zip(metrics.values(), numeric)]
+    })
+
+def percentile_table(acc, percentiles=REPORT_PERCENTILES):
+    """Net result at each percentile, read from the streaming histogram."""
+    return pd.DataFrame({
+        'Percentile': percentiles,
+        'Net_Result_ZAR': [acc.quantile(p / 100) for p in percentiles]
+    })
+
+def histogram_table(acc, buckets=HISTOGRAM_BUCKETS, tail=0.001):
+    """
+    Re-bins the fine accumulator histogram into report buckets spanning the
+    [tail, 1 - tail] quantile range. Paths beyond the range count in the edge buckets.
+    """
+    edges = np.linspace(acc.quantile(tail), acc.quantile(1 - tail), buckets + 1)
+    centres = acc.lo + (np.arange(acc.bins) + 0.5) * acc.width
+    counts, _ = np.histogram(np.clip(centres, edges[0], edges[-1]), bins=edges, weights=acc.hist_counts[1:-1])
+    counts[0] += acc.hist_counts[0]
+    counts[-1] += acc.hist_counts[-1]
+    share = counts / acc.count * 100 if acc.count else counts
+    return pd.DataFrame({
+        'Bin_From_ZAR': edges[:-1],
+        'Bin_To_ZAR': edges[1:],
+        'Paths': counts.astype('int64'),
+        'Share_Pct': share,
+        'Cumulative_Pct': np.cumsum(share)
+    })
+
+def _cell(value):
+    # xlsxwriter rejects NaN/inf and numpy scalars in some versions
+    if isinstance(value, (np.generic,)):
+        value = value.item()
+    if isinstance(value, float) and not np.isfinite(value):
+        return None
+    return value
+
+def write_workbook(output_path, sheets, charts=None):
+    """
+    Streams sheets to an .xlsx in xlsxwriter constant-memory mode: each row is flushed
+    as soon as it is written, so memory stays flat regardless of sheet length.
+    charts: optional list of dicts {'sheet', 'data_sheet', 'category_col', 'value_col', 'title', 'type'}
+    placed on their own worksheet after the data sheets.
+    """
+    if not HAS_XLSXWRITER:
+        raise ImportError("xlsxwriter is required for report output.")
+
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    workbook = xlsxwriter.Workbook(output_path, {'constant_memory': True})
+    header = workbook.add_format({'bold': True, 'bottom': 1})
+    money = workbook.add_format({'num_format': '#,##0.00'})
+    sizes = {}
+
+    for name, frame in sheets:
+        if len(frame) + 1 > EXCEL_MAX_ROWS:
+            workbook.close()
+            raise ValueError(f"Sheet '{name}' has {len(frame):,} rows; write raw rows to a sidecar instead.")
+        sheet = workbook.add_worksheet(name)
+        for col, column in enumerate(frame.columns):
+            is_float = pd.api.types.is_float_dtype(frame[column])
+            width = max(len(str(column)) + 2, 16 if is_float else 12)
+            sheet.set_column(col, col, width, money if is_float else None)
+        sheet.write_row(0, 0, [str(c) for c in frame.columns], header)
+        for row, values in enumerate(frame.itertuples(index=False, name=None), start=1):
+            sheet.write_row(row, 0, [_cell(v) for v in values])
+        sizes[name] = (len(frame), list(frame.columns))
+
+    for spec in charts or []:
+        rows, columns = sizes[spec['data_sheet']]
+        category_col = columns.index(spec['category_col'])
+        value_col = columns.index(spec['value_col'])
+        chart = workbook.add_chart({'type': spec.get('type', 'column')})
+        chart.add_series({
+            'name': spec['value_col'],
+            'categories': [spec['data_sheet'], 1, category_col, rows, category_col],
+            'values': [spec['data_sheet'], 1, value_col, rows, value_col]
+        })
+        chart.set_title({'name': spec.get('title', spec['value_col'])})
+        chart.set_legend({'none': True})
+        workbook.add_worksheet(spec['sheet']).insert_chart('B2', chart, {'x_scale': 1.5, 'y_scale': 1.5})
+
+    workbook.close()
+    return output_path
+
+def write_simulation_report(output_path, metrics, acc):
+    """Executive summary, percentile table and distribution histogram for a simulation run."""
+    # Summary sheets are a few hundred rows at most: built in process
+    sheets = [
+        ('Executive_Summary', metrics_table(metrics)),
+        ('Percentiles', percentile_table(acc)),
+        ('Distribution', histogram_table(acc))
+    ]
+    charts = [{'sheet': 'Distribution_Chart', 'data_sheet': 'Distribution', 'category_col': 'Bin_From_ZAR',
+               'value_col': 'Share_Pct', 'title': 'Distribution of Simulated Net Result (ZAR)'}]
+    return write_workbook(output_path, sheets, charts)
+
+def kpi_summary_sheet(base_dir):
+    df = read_dataset('ESFE_KPIS', columns=['account_name', 'debit', 'credit', 'total_volume_zar'], base_dir=base_dir)
+    df = df.sort_values('account_name', kind='mergesort').reset_index(drop=True)
+    return pd.DataFrame({
+        'Account Name': df['account_name'].astype(str),
+        'Debit': df['debit'].astype('float64'),
+        'Credit': df['credit'].astype('float64'),
+        'Total Volume': df['total_volume_zar'].astype('float64')
+    })
+
+def governance_sheet(source='ESFE_KPIS.csv'):
+    return pd.DataFrame({
+        'Audit Field': ['Report Name', 'Generation Timestamp', 'Source Data', 'Engine Version'],
+        'Value': ['Sovereign Executive Report', datetime.now().strftime('%Y-%m-%d %H:%M:%S'), source, ENGINE_VERSION]
+    })
+
+def write_executive_report(output_path, base_dir):
+    """reports/ESFE_Executive_Report.xlsx: KPI summary, governance trail and volume chart."""
+    sheets = [
+        ('Executive Summary', kpi_summary_sheet(base_dir)),
+        ('Governance', governance_sheet())
+    ]
+    charts = [{'sheet': 'Executive Chart', 'data_sheet': 'Executive Summary', 'category_col': 'Account Name',
+               'value_col': 'Total Volume', 'title': 'Total Volume by Account (ZAR)'}]
+    return write_workbook(output_path, sheets, charts)
@@ -1,74 +1,201 @@
 import pandas as pd
 import numpy as np
 import os
+from sovereign_storage import dataset_exists, read_dataset, HAS_ARROW
+from sovereign_coa import classify_accounts
+from sovereign_cube import load_cube, headline_totals
+from layer4_simulation_engine import run_simulation_engine, run_adaptive_simulation, summarize
+from layer4_report_writer import write_simulation_report, write_executive_report, write_workbook, metrics_table, accumulator_from_values
 
-def run_monte_carlo_simulation():
+def simulate_monte_carlo(baseline_rev, baseline_exp, simulations=1000, rev_volatility=0.15, exp_volatility=0.05, seed=None):
+    """
+    In-memory Layer 4 core: one normal draw per scenario for revenue and costs.
+    Returns (scenario table, metrics). seed=None draws from NumPy's global generator.
+    """
+    rng = np.random if seed is None else np.random.default_rng(seed)
+
+    # Generate Random Scenarios
+    # Using a normal distribution to simulate "Real World" fluctuations
+    simulated_revs = rng.normal(baseline_rev, baseline_rev * rev_volatility, simulations)
+    simulated_exps = rng.normal(baseline_exp, baseline_exp * exp_volatility, simulations)
+
+    # Calculate Simulated Net Results
+    results = simulated_revs - simulated_exps
+
+    sim_df = pd.DataFrame({
+        'Scenario': range(1, simulations + 1),
+        'Simulated_Revenue_ZAR': simulated_revs,
+        'Simulated_Expense_ZAR': simulated_exps,
+        'Net_Result_ZAR': results
+    })
+
+    # Statistical Summaries (Decision Intelligence)
+    prob_profit = (np.count_nonzero(results > 0) / simulations) * 100
+    var_95 = np.percentile(results, 5)  # Value at Risk (5th percentile)
+    metrics = {
+        'Baseline Net Result': baseline_rev - baseline_exp,
+        'Mean Simulated Result': np.mean(results),
+        'Probability of Profit (%)': prob_profit,
+        '95% Confidence Value at Risk (VaR)': var_95
+    }
+    return sim_df, metrics
+
+def run_monte_carlo_simulation(simulations=1000, seed=None):
     """
     Advanced Layer 4: Decision Intelligence Framework.
     Runs 1,000 simulations to model financial risk and probability.
+    File wrapper around simulate_monte_carlo.
     """
     base_dir = os.path.dirname(os.path.abspath(__file__))
-    kpi_path = os.path.join(base_dir, 'data', 'ESFE_KPIS.csv')
     output_path = os.path.join(base_dir, 'reports', 'Strategic_Risk_Simulation.xlsx')
 
     print(f"--- Strategic Simulation Engine Execution ---")
     
-    if not os.path.exists(kpi_path):
+    if not dataset_exists('ESFE_KPIS', base_dir):
         print("ERROR: KPI data missing. Run Layer 3 first.")
         return
 
     # 1. Load the "Static" Reality from Layer 3
-    df_kpi = pd.read_csv(kpi_path)
-    
     # Extract baseline figures
     # We use the credit (Revenue) and debit (Expenses) totals
-    baseline_rev = df_kpi[df_kpi['account_name'].str.contains('Revenue', case=False, na=False)]['credit'].sum()
-    baseline_exp = df_kpi[df_kpi['account_name'].str.contains('Operating', case=False, na=False)]['debit'].sum()
-    
-    # 2. Define Risk Parameters (Simulating Volatility)
-    simulations = 1000
-    rev_volatility = 0.15  # 15% standard deviation in revenue
-    exp_volatility = 0.05  # 5% standard deviation in costs
+    baseline_rev, baseline_exp = load_simulation_baseline(base_dir)
     
+    # 2.-6. Simulate (15% revenue and 5% cost volatility)
     print(f"Running {simulations} iterations for Monte Carlo Analysis...")
-
-    # 3. Generate Random Scenarios
-    # Using a normal distribution to simulate "Real World" fluctuations
-    simulated_revs = np.random.normal(baseline_rev, baseline_rev * rev_volatility, simulations)
-    simulated_exps = np.random.normal(baseline_exp, baseline_exp * exp_volatility, simulations)
-    
-    # 4. Calculate Simulated Net Results
-    results = simulated_revs - simulated_exps
+    sim_df, metrics = simulate_monte_carlo(baseline_rev, baseline_exp, simulations=simulations, seed=seed)
     
-    # 5. Build Simulation Dataframe
-    sim_df = pd.DataFrame({
-        'Scenario': range(1, simulations + 1),
-        'Simulated_Revenue_ZAR': simulated_revs,
-        'Simulated_Expense_ZAR': simulated_exps,
-        'Net_Result_ZAR': results
-    })
-
-    # 6. Statistical Summaries (Decision Intelligence)
-    prob_profit = (len(sim_df[sim_df['Net_Result_ZAR'] > 0]) / simulations) * 100
-    var_95 = np.percentile(results, 5) # Value at Risk (5th percentile)
-    
-    # 7. Export to Advanced Excel Report
+    # 7. Export to Advanced Excel Report (histograms and percentiles; raw paths go to the parquet sidecar)
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    
-    with pd.ExcelWriter(output_path, engine='xlsxwriter') as writer:
-        sim_df.to_excel(writer, sheet_name='Simulation_Data', index=False)
-        
-        # Summary Sheet
-        summary_stats = pd.DataFrame({
-            'Metric': ['Baseline Net Result', 'Mean Simulated Result', 'Probability of Profit (%)', '95% Confidence Value at Risk (VaR)'],
-            'Value_ZAR': [baseline_rev - baseline_exp, np.mean(results), prob_profit, var_95]
-        })
-        summary_stats.to_excel(writer, sheet_name='Executive_Summary', index=False)
+    sidecar_path = save_paths_sidecar(sim_df, output_path)
+    write_simulation_report(output_path, metrics, accumulator_from_values(sim_df['Net_Result_ZAR'].to_numpy()))
+
+    print(f"\n--- SIMULATION COMPLETE ---")
+    print(f"Probability of turning a profit: {metrics['Probability of Profit (%)']:.2f}%")
+    print(f"95% Confidence Value at Risk: R {abs(metrics['95% Confidence Value at Risk (VaR)']):,.2f}")
+    print(f"Strategic Report Saved: {output_path}")
+    if sidecar_path:
+        print(f"Scenario paths saved: {sidecar_path}")
+    return metrics
+
+def save_paths_sidecar(sim_df, output_path):
+    """Raw scenario rows next to the workbook as parquet (columnar, no Excel row limit)."""
+    if not HAS_ARROW:
+        print("NOTE: pyarrow not installed, raw scenario paths not saved.")
+        return None
+    sidecar_path = os.path.splitext(output_path)[0] + '_paths.parquet'
+    sim_df.to_parquet(sidecar_path, index=False)
+    return sidecar_path
+
+def simulation_baseline(cube=None, kpis=None):
+    """Baseline revenue (credit) and operating cost (debit) totals from an in-memory GL cube, else a KPI table."""
+    if cube is not None:
+        totals = headline_totals(cube)
+        return totals['revenue'], totals['opex']
+    category = classify_accounts(kpis)
+    return kpis[category == 'revenue']['credit'].sum(), kpis[category == 'opex']['debit'].sum()
+
+def load_simulation_baseline(base_dir):
+    """
+    Baseline revenue (credit) and operating cost (debit) totals, from the GL cube when a ledger
+    is available (see sovereign_cube), otherwise from the published Layer 3 KPIs.
+    """
+    cube = load_cube(base_dir)
+    if cube is not None:
+        return simulation_baseline(cube=cube)
+    return simulation_baseline(kpis=read_dataset('ESFE_KPIS', columns=['account_name', 'debit', 'credit'], base_dir=base_dir))
+
+def run_scaled_simulation(paths=10_000_000, seed=42, workers=None, save_paths=False):
+    """
+    Layer 4 at board scale: 10M+ paths across processes with independent seeded Generator
+    streams. Results stream into fixed-size accumulators, so memory stays flat and the
+    same seed always reproduces the same figures.
+    save_paths streams every raw path to reports/Strategic_Risk_Summary_paths/ (parquet per block).
+    """
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    output_path = os.path.join(base_dir, 'reports', 'Strategic_Risk_Summary.xlsx')
+
+    print(f"--- Strategic Simulation Engine Execution (Scaled) ---")
+
+    if not dataset_exists('ESFE_KPIS', base_dir):
+        print("ERROR: KPI data missing. Run Layer 3 first.")
+        return
+
+    baseline_rev, baseline_exp = load_simulation_baseline(base_dir)
+    print(f"Running {paths:,} paths (seed={seed}) on {workers or os.cpu_count()} processes...")
+
+    paths_dir = None
+    if save_paths:
+        if HAS_ARROW:
+            paths_dir = os.path.splitext(output_path)[0] + '_paths'
+        else:
+            print("NOTE: pyarrow not installed, raw paths not saved.")
+
+    acc = run_simulation_engine(baseline_rev, baseline_exp, paths=paths, seed=seed, workers=workers, paths_dir=paths_dir)
+    metrics = summarize(acc, baseline_rev, baseline_exp)
+    write_simulation_report(output_path, metrics, acc)
 
     print(f"\n--- SIMULATION COMPLETE ---")
-    print(f"Probability of turning a profit: {prob_profit:.2f}%")
-    print(f"95% Confidence Value at Risk: R {abs(var_95):,.2f}")
+    print(f"Probability of turning a profit: {acc.prob_profit:.2f}%")
+    print(f"95% Confidence Value at Risk: R {abs(acc.quantile(0.05)):,.2f}")
+    print(f"95% Expected Shortfall: R {abs(acc.expected_shortfall(0.05)):,.2f}")
     print(f"Strategic Report Saved: {output_path}")
+    if paths_dir:
+        print(f"Raw paths saved: {paths_dir}")
+    return metrics
+
+def run_adaptive_risk_simulation(target_var_ci_pct=0.5, target_prob_ci=0.25, sampling='antithetic',
+                                 control_variate=True, max_paths=100_000_000, seed=42, workers=None):
+    """
+    Layer 4 with a precision target instead of a path count: batches are drawn (with
+    variance reduction) until the VaR and probability-of-profit confidence intervals
+    are tight enough. Reports the paths actually used and the CI achieved.
+    """
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    output_path = os.path.join(base_dir, 'reports', 'Strategic_Risk_Summary.xlsx')
+
+    print(f"--- Strategic Simulation Engine Execution (Adaptive) ---")
+
+    if not dataset_exists('ESFE_KPIS', base_dir):
+        print("ERROR: KPI data missing. Run Layer 3 first.")
+        return
+
+    baseline_rev, baseline_exp = load_simulation_baseline(base_dir)
+    print(f"Target: VaR CI within {target_var_ci_pct}%, probability CI within {target_prob_ci} pts ({sampling})...")
+
+    try:
+        metrics = run_adaptive_simulation(
+            baseline_rev, baseline_exp, target_var_ci_pct=target_var_ci_pct, target_prob_ci=target_prob_ci,
+            max_paths=max_paths, seed=seed, workers=workers, sampling=sampling, control_variate=control_variate
+        )
+    except ImportError as exc:
+        print(f"ERROR: {exc}")
+        return
+
+    write_workbook(output_path, [('Executive_Summary', metrics_table(metrics))])
+
+    var = metrics['95% Confidence Value at Risk (VaR)']
+    print(f"\n--- SIMULATION COMPLETE ({'converged' if metrics['Converged'] else 'path limit reached'}) ---")
+    print(f"Paths used: {metrics['Simulated Paths']:,} in {metrics['Batches']} batches")
+    print(f"Probability of turning a profit: {metrics['Probability of Profit (%)']:.2f}% "
+          f"(+/- {metrics['Probability CI Half-Width (95%, pts)']:.3f} pts)")
+    print(f"95% Confidence Value at Risk: R {abs(var):,.2f} (+/- R {metrics['VaR CI Half-Width (95%)']:,.2f})")
+    print(f"Strategic Report Saved: {output_path}")
+    return metrics
+
+def run_executive_report():
+    """Rebuilds reports/ESFE_Executive_Report.xlsx from the Layer 3 KPIs (constant-memory writer)."""
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    output_path = os.path.join(base_dir, 'reports', 'ESFE_Executive_Report.xlsx')
+
+    print(f"--- Executive Report Export ---")
+
+    if not dataset_exists('ESFE_KPIS', base_dir):
+        print("ERROR: KPI data missing. Run Layer 3 first.")
+        return
+
+    write_executive_report(output_path, base_dir)
+    print(f"SUCCESS: Executive Report Saved: {output_path}")
+    return output_path
 
 if __name__ == "__main__":
-    run_monte_carlo_simulation()
\ No newline at end of file
+    run_monte_carlo_simulation()
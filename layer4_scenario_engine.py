@@ -0,0 +1,197 @@
+import pandas as pd
+import numpy as np
+import os
+import glob
+from sovereign_coa import classify_accounts
+from sovereign_cube import load_cube, query_cube, cube_manifest
+from layer2_group_consolidation import zar_closing_rates
+from layer4_simulation_engine import SimulationAccumulator, RANGE_SIGMAS
+from layer4_report_writer import write_workbook, percentile_table
+
+# Annual volatilities per factor type (FX is the log-vol of the ZAR rate)
+FACTOR_VOLATILITY = {'revenue': 0.15, 'opex': 0.05, 'fx': 0.10}
+
+# Default correlation structure between factor types
+CORRELATION_DEFAULTS = {
+    ('revenue', 'revenue'): 0.5,   # entity revenues move with the group's markets
+    ('opex', 'opex'): 0.3,
+    ('revenue', 'opex'): 0.4,      # same entity only: costs follow activity
+    ('fx', 'fx'): 0.6,             # EUR/GBP/USD vs ZAR largely a ZAR move
+    ('revenue', 'fx'): 0.3         # same currency only: weak rand coincides with stronger foreign sales
+}
+
+def load_entity_baselines(base_dir=None, pattern='Sovereign_*.csv'):
+    """
+    Revenue (credit) and opex (debit) per entity in local currency. Read from the GL cube when it
+    is built on the consolidated group ledger (see sovereign_cube), otherwise from data/global_raw.
+    """
+    base_dir = base_dir or os.path.dirname(os.path.abspath(__file__))
+    cube = load_cube(base_dir)
+    if cube is not None and cube_manifest(base_dir).get('source') == 'ESFE_GROUP_CONSOLIDATED_ZAR':
+        totals = query_cube(cube, by=['entity', 'currency', 'account_category'], measures=['debit', 'credit'],
+                            categories=['revenue', 'opex'])
+        totals = totals.pivot_table(index=['entity', 'currency'], columns='account_category',
+                                    values=['credit', 'debit'], aggfunc='sum', observed=True, fill_value=0.0)
+        baselines = pd.DataFrame({
+            'revenue': totals[('credit', 'revenue')] if ('credit', 'revenue') in totals.columns else 0.0,
+            'opex': totals[('debit', 'opex')] if ('debit', 'opex') in totals.columns else 0.0
+        }, index=totals.index).reset_index()
+        baselines[['entity', 'currency']] = baselines[['entity', 'currency']].astype(str)
+        return baselines[['entity', 'currency', 'revenue', 'opex']]
+
+    rows = []
+    for path in sorted(glob.glob(os.path.join(base_dir, 'data', 'global_raw', pattern))):
+        df = pd.read_csv(path, usecols=['entity', 'currency', 'account_code', 'account_name', 'debit', 'credit'])
+        category = classify_accounts(df)
+        rows.append({
+            'entity': df['entity'].iloc[0],
+            'currency': df['currency'].iloc[0],
+            'revenue': df.loc[category == 'revenue', 'credit'].sum(),
+            'opex': df.loc[category == 'opex', 'debit'].sum()
+        })
+    return pd.DataFrame(rows, columns=['entity', 'currency', 'revenue', 'opex'])
+
+def build_factors(baselines):
+    """Factor table: one revenue and one opex factor per entity, one FX factor per foreign currency."""
+    factors = []
+    for entity, currency in zip(baselines['entity'], baselines['currency']):
+        factors.append(('revenue', entity, currency))
+        factors.append(('opex', entity, currency))
+    for currency in sorted(set(baselines['currency']) - {'ZAR'}):
+        factors.append(('fx', None, currency))
+    return pd.DataFrame(factors, columns=['kind', 'entity', 'currency'])
+
+def build_covariance(factors, volatility=FACTOR_VOLATILITY, correlations=CORRELATION_DEFAULTS):
+    """Covariance matrix of factor shocks from per-type volatilities and pairwise correlations."""
+    kind = factors['kind'].to_numpy()
+    entity = factors['entity'].to_numpy()
+    currency = factors['currency'].to_numpy()
+    n = len(factors)
+
+    corr = np.zeros((n, n))
+    for (a, b), rho in correlations.items():
+        pair = (kind[:, None] == a) & (kind[None, :] == b)
+        pair |= pair.T
+        if {a, b} == {'revenue', 'opex'}:
+            pair &= entity[:, None] == entity[None, :]
+        elif {a, b} == {'revenue', 'fx'}:
+            pair &= currency[:, None] == currency[None, :]
+        corr[pair] = rho
+    np.fill_diagonal(corr, 1.0)
+
+    sigma = np.array([volatility[k] for k in kind])
+    return corr * np.outer(sigma, sigma)
+
+def cholesky_factor(cov):
+    """Cholesky factor, clipping negative eigenvalues first when the input is not positive definite."""
+    try:
+        return np.linalg.cholesky(cov)
+    except np.linalg.LinAlgError:
+        values, vectors = np.linalg.eigh(cov)
+        repaired = vectors @ np.diag(np.clip(values, 1e-12, None)) @ vectors.T
+        return np.linalg.cholesky((repaired + repaired.T) / 2)
+
+class ScenarioModel:
+    """Index arrays that turn a (paths x factors) shock matrix into entity and group ZAR results."""
+
+    def __init__(self, baselines, factors, cov, fx_rates=None):
+        self.entities = baselines['entity'].tolist()
+        self.chol = cholesky_factor(cov)
+        kind = factors['kind'].to_numpy()
+        self.rev_idx = np.flatnonzero(kind == 'revenue')
+        self.opex_idx = np.flatnonzero(kind == 'opex')
+        fx_idx = np.flatnonzero(kind == 'fx')
+        fx_currencies = factors['currency'].to_numpy()[fx_idx].tolist()
+
+        self.base_rev = baselines['revenue'].to_numpy(dtype='float64')
+        self.base_opex = baselines['opex'].to_numpy(dtype='float64')
+        # Column 0 of the FX block is ZAR itself (rate 1, no shock)
+        self.fx_idx = fx_idx
+        fx_rates = fx_rates or zar_closing_rates()
+        self.fx_spot = np.array([1.0] + [fx_rates[c] for c in fx_currencies])
+        self.fx_drift = -0.5 * np.diag(cov)[fx_idx]
+        self.entity_fx = np.array([0 if c == 'ZAR' else 1 + fx_currencies.index(c) for c in baselines['currency']])
+
+    def evaluate(self, z):
+        """z: independent standard normals (paths x factors). Returns (entity ZAR net results, group)."""
+        shocks = z @ self.chol.T
+        revenue = self.base_rev * (1 + shocks[:, self.rev_idx])
+        opex = self.base_opex * (1 + shocks[:, self.opex_idx])
+        fx = np.empty((len(z), len(self.fx_spot)))
+        fx[:, 0] = 1.0
+        # Lognormal rates, centred on the closing spot
+        fx[:, 1:] = self.fx_spot[1:] * np.exp(self.fx_drift + shocks[:, self.fx_idx])
+        entity_zar = (revenue - opex) * fx[:, self.entity_fx]
+        return entity_zar, entity_zar.sum(axis=1)
+
+def simulate_scenarios(model, paths=1_000_000, seed=42, chunk_size=250_000):
+    """
+    Draws all factors for all entities in one matrix per chunk and folds the results into
+    one accumulator per entity plus the group. The histogram range comes from the first chunk.
+    """
+    rng = np.random.default_rng(seed)
+    accumulators = None
+    done = 0
+    while done < paths:
+        n = min(chunk_size, paths - done)
+        entity_zar, group = model.evaluate(rng.standard_normal((n, model.chol.shape[0])))
+        results = np.column_stack([entity_zar, group])
+        if accumulators is None:
+            centre, spread = results.mean(axis=0), np.maximum(results.std(axis=0), 1.0)
+            accumulators = [
+                SimulationAccumulator(lo=c - RANGE_SIGMAS * s, hi=c + RANGE_SIGMAS * s, bins=50_000)
+                for c, s in zip(centre, spread)
+            ]
+        for acc, column in zip(accumulators, results.T):
+            acc.add(column)
+        done += n
+    names = model.entities + ['Group']
+    return dict(zip(names, accumulators or []))
+
+def scenario_summary(results, confidence=0.95):
+    tail = 1 - confidence
+    return pd.DataFrame([{
+        'Entity': name,
+        'Mean_Net_ZAR': acc.mean,
+        'Std_Dev_ZAR': acc.std,
+        'Probability_of_Profit_Pct': acc.prob_profit,
+        f'VaR_{confidence:.0%}_ZAR': acc.quantile(tail),
+        f'Expected_Shortfall_{confidence:.0%}_ZAR': acc.expected_shortfall(tail)
+    } for name, acc in results.items()])
+
+def run_scenario_engine(paths=1_000_000, seed=42, chunk_size=250_000):
+    """Layer 4: correlated revenue / opex / FX scenarios for every entity, translated to group ZAR."""
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    output_path = os.path.join(base_dir, 'reports', 'Strategic_Group_Scenarios.xlsx')
+
+    print(f"--- Strategic Scenario Engine (Correlated Entities & FX) ---")
+
+    baselines = load_entity_baselines(base_dir)
+    if baselines.empty:
+        print("ERROR: No entity ledgers in data/global_raw. Run the global generator first.")
+        return
+    # Spot rates for the FX factors come from the shared FX store
+    fx_rates = zar_closing_rates()
+    missing = sorted(set(baselines['currency']) - set(fx_rates))
+    if missing:
+        print(f"ERROR: No ZAR translation rate for currencies: {missing}")
+        return
+
+    factors = build_factors(baselines)
+    model = ScenarioModel(baselines, factors, build_covariance(factors), fx_rates)
+    print(f"Running {paths:,} paths over {len(factors)} correlated factors ({len(baselines)} entities)...")
+
+    results = simulate_scenarios(model, paths, seed, chunk_size)
+    summary = scenario_summary(results)
+
+    percentiles = pd.concat(
+        [percentile_table(acc).assign(Entity=name) for name, acc in results.items()], ignore_index=True
+    )[['Entity', 'Percentile', 'Net_Result_ZAR']]
+    write_workbook(output_path, [('Summary', summary), ('Percentiles', percentiles)])
+
+    print(summary.to_string(index=False, float_format=lambda v: f'{v:,.2f}'))
+    print(f"SUCCESS: Scenario report saved to {output_path}")
+    return summary
+
+if __name__ == "__main__":
+    run_scenario_engine()
@@ -0,0 +1,353 @@
+import numpy as np
+import os
+import shutil
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor
+from statistics import NormalDist
+
+# Defaults mirror the Layer 4 risk parameters
+REV_VOLATILITY = 0.15
+EXP_VOLATILITY = 0.05
+HISTOGRAM_BINS = 200_000
+RANGE_SIGMAS = 10.0
+SAMPLING_METHODS = ('pseudo', 'antithetic', 'sobol')
+
+
+@dataclass
+class SimulationAccumulator:
+    """
+    Streaming summary of simulated net results. Memory is fixed by the histogram size,
+    not by the number of paths; quantiles and expected shortfall are read from a
+    fine fixed-width histogram that also keeps the sum of values in each bin.
+    """
+    lo: float
+    hi: float
+    bins: int = HISTOGRAM_BINS
+    count: int = 0
+    total: float = 0.0
+    total_sq: float = 0.0
+    profit_count: int = 0
+    minimum: float = np.inf
+    maximum: float = -np.inf
+    # bins + 2 slots: underflow, regular bins, overflow
+    hist_counts: np.ndarray = field(default=None, repr=False)
+    hist_sums: np.ndarray = field(default=None, repr=False)
+    # Control-variate moments of the (revenue, expense) standard-normal shocks, whose mean is known to be 0
+    cv_count: int = 0
+    cv_sum_z: np.ndarray = field(default=None, repr=False)
+    cv_sum_zz: np.ndarray = field(default=None, repr=False)
+    cv_sum_iz: np.ndarray = field(default=None, repr=False)
+
+    def __post_init__(self):
+        if self.hist_counts is None:
+            self.hist_counts = np.zeros(self.bins + 2, dtype=np.int64)
+        if self.hist_sums is None:
+            self.hist_sums = np.zeros(self.bins + 2, dtype=np.float64)
+        if self.cv_sum_z is None:
+            self.cv_sum_z = np.zeros(2)
+            self.cv_sum_zz = np.zeros((2, 2))
+            self.cv_sum_iz = np.zeros(2)
+
+    @property
+    def width(self):
+        return (self.hi - self.lo) / self.bins
+
+    def _slots(self, values):
+        idx = np.floor((values - self.lo) / self.width).astype(np.int64) + 1
+        return np.clip(idx, 0, self.bins + 1)
+
+    def add(self, values, controls=None):
+        values = np.asarray(values, dtype=np.float64)
+        if values.size == 0:
+            return
+        if controls is not None:
+            profit = (values > 0).astype(np.float64)
+            self.cv_count += values.size
+            self.cv_sum_z += controls.sum(axis=0)
+            self.cv_sum_zz += controls.T @ controls
+            self.cv_sum_iz += profit @ controls
+        slots = self._slots(values)
+        self.hist_counts += np.bincount(slots, minlength=self.bins + 2)
+        self.hist_sums += np.bincount(slots, weights=values, minlength=self.bins + 2)
+        self.count += values.size
+        self.total += values.sum()
+        self.total_sq += np.dot(values, values)
+        self.profit_count += int(np.count_nonzero(values > 0))
+        self.minimum = min(self.minimum, values.min())
+        self.maximum = max(self.maximum, values.max())
+
+    def merge(self, other):
+        self.hist_counts += other.hist_counts
+        self.hist_sums += other.hist_sums
+        self.count += other.count
+        self.total += other.total
+        self.total_sq += other.total_sq
+        self.profit_count += other.profit_count
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+        self.cv_count += other.cv_count
+        self.cv_sum_z += other.cv_sum_z
+        self.cv_sum_zz += other.cv_sum_zz
+        self.cv_sum_iz += other.cv_sum_iz
+        return self
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    @property
+    def std(self):
+        if self.count < 2:
+            return 0.0
+        variance = (self.total_sq - self.count * self.mean ** 2) / (self.count - 1)
+        return float(np.sqrt(max(variance, 0.0)))
+
+    @property
+    def prob_profit(self):
+        return self.profit_count / self.count * 100 if self.count else 0.0
+
+    @property
+    def prob_profit_cv(self):
+        """
+        Probability of profit with the input shocks as control variates:
+        p - beta . mean(z), where E[z] = 0 and beta regresses the profit indicator on z.
+        Falls back to the plain estimate when no control moments were collected.
+        """
+        if self.cv_count < 3 or self.cv_count != self.count:
+            return self.prob_profit
+        n = self.cv_count
+        z_bar = self.cv_sum_z / n
+        p_bar = self.profit_count / n
+        cov_zz = self.cv_sum_zz / n - np.outer(z_bar, z_bar)
+        cov_iz = self.cv_sum_iz / n - p_bar * z_bar
+        try:
+            beta = np.linalg.solve(cov_zz, cov_iz)
+        except np.linalg.LinAlgError:
+            return self.prob_profit
+        return float(np.clip(p_bar - beta @ z_bar, 0.0, 1.0)) * 100
+
+    def quantile(self, q):
+        """Linear interpolation inside the bin that holds the q-th value."""
+        if self.count == 0:
+            return 0.0
+        target = q * self.count
+        cumulative = np.cumsum(self.hist_counts)
+        slot = int(np.searchsorted(cumulative, target, side='left'))
+        if slot == 0:
+            return self.minimum
+        if slot == self.bins + 1:
+            return self.maximum
+        before = cumulative[slot - 1]
+        inside = self.hist_counts[slot]
+        fraction = (target - before) / inside if inside else 0.0
+        return self.lo + (slot - 1 + fraction) * self.width
+
+    def expected_shortfall(self, q):
+        """Mean of the worst q share of outcomes (CVaR), from the per-bin sums."""
+        if self.count == 0:
+            return 0.0
+        target = q * self.count
+        cumulative = np.cumsum(self.hist_counts)
+        slot = int(np.searchsorted(cumulative, target, side='left'))
+        tail_sum = self.hist_sums[:slot].sum()
+        tail_count = cumulative[slot - 1] if slot > 0 else 0
+        remaining = target - tail_count
+        if remaining > 0 and self.hist_counts[slot]:
+            tail_sum += self.hist_sums[slot] / self.hist_counts[slot] * remaining
+            tail_count += remaining
+        return tail_sum / tail_count if tail_count else self.minimum
+
+
+def result_range(baseline_rev, baseline_exp, rev_volatility=REV_VOLATILITY, exp_volatility=EXP_VOLATILITY):
+    """Histogram bounds: baseline net result +/- RANGE_SIGMAS standard deviations."""
+    sigma = np.hypot(baseline_rev * rev_volatility, baseline_exp * exp_volatility)
+    sigma = sigma if sigma > 0 else 1.0
+    centre = baseline_rev - baseline_exp
+    return centre - RANGE_SIGMAS * sigma, centre + RANGE_SIGMAS * sigma
+
+
+class NormalSource:
+    """
+    Standard-normal (revenue, expense) shock pairs for one stream.
+    'pseudo' draws plain Generator normals, 'antithetic' pairs every draw with its mirror
+    image, 'sobol' maps a scrambled Sobol sequence through the inverse normal CDF (scipy).
+    """
+
+    def __init__(self, rng, sampling='pseudo'):
+        if sampling not in SAMPLING_METHODS:
+            raise ValueError(f"Unknown sampling '{sampling}'. Choose from {SAMPLING_METHODS}.")
+        self.rng = rng
+        self.sampling = sampling
+        if sampling == 'sobol':
+            try:
+                from scipy.stats import qmc, norm
+            except ImportError as exc:
+                raise ImportError("Sobol sampling needs scipy (scipy.stats.qmc).") from exc
+            self._sobol = qmc.Sobol(d=2, scramble=True, seed=rng)
+            self._ppf = norm.ppf
+
+    def draw(self, n):
+        if self.sampling == 'pseudo':
+            return np.column_stack([self.rng.standard_normal(n), self.rng.standard_normal(n)])
+        if self.sampling == 'antithetic':
+            half = self.rng.standard_normal(((n + 1) // 2, 2))
+            return np.concatenate([half, -half])[:n]
+        import warnings
+        with warnings.catch_warnings():
+            # Chunk sizes need not be powers of two; balance is only slightly weaker
+            warnings.simplefilter('ignore', UserWarning)
+            u = self._sobol.random(n)
+        return self._ppf(np.clip(u, 1e-12, 1 - 1e-12))
+
+
+def simulate_block(seed_seq, paths, baseline_rev, baseline_exp, lo, hi,
+                   rev_volatility=REV_VOLATILITY, exp_volatility=EXP_VOLATILITY,
+                   chunk_size=250_000, bins=HISTOGRAM_BINS, sampling='pseudo', control_variate=False,
+                   paths_path=None):
+    """
+    Worker task: simulates one block of paths on its own Generator stream, chunk by chunk.
+    With paths_path set, the raw paths are also streamed to that parquet file.
+    """
+    source = NormalSource(np.random.default_rng(seed_seq), sampling)
+    acc = SimulationAccumulator(lo=lo, hi=hi, bins=bins)
+    writer = None
+    done = 0
+    try:
+        while done < paths:
+            n = min(chunk_size, paths - done)
+            z = source.draw(n)
+            revs = baseline_rev + baseline_rev * rev_volatility * z[:, 0]
+            exps = baseline_exp + baseline_exp * exp_volatility * z[:, 1]
+            acc.add(revs - exps, controls=z if control_variate else None)
+            if paths_path:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+                table = pa.table({
+                    'Simulated_Revenue_ZAR': revs,
+                    'Simulated_Expense_ZAR': exps,
+                    'Net_Result_ZAR': revs - exps
+                })
+                writer = writer or pq.ParquetWriter(paths_path, table.schema)
+                writer.write_table(table)
+            done += n
+    finally:
+        if writer:
+            writer.close()
+    return acc
+
+
+def run_simulation_engine(baseline_rev, baseline_exp, paths=10_000_000, seed=42, workers=None,
+                          block_size=1_000_000, chunk_size=250_000,
+                          rev_volatility=REV_VOLATILITY, exp_volatility=EXP_VOLATILITY,
+                          sampling='pseudo', control_variate=False, paths_dir=None):
+    """
+    Multi-core Monte Carlo for the Layer 4 net result.
+    Paths are cut into fixed blocks; block i always draws from SeedSequence(seed).spawn()[i],
+    so results are reproducible for a given seed regardless of worker count. Blocks are
+    merged in order into one SimulationAccumulator (flat memory for any path count).
+    sampling / control_variate select the variance-reduction options (see NormalSource).
+    paths_dir, when given, receives the raw paths as one parquet file per block (needs pyarrow).
+    """
+    lo, hi = result_range(baseline_rev, baseline_exp, rev_volatility, exp_volatility)
+    n_blocks = -(-paths // block_size)
+    streams = np.random.SeedSequence(seed).spawn(n_blocks)
+    sizes = [min(block_size, paths - i * block_size) for i in range(n_blocks)]
+    if paths_dir:
+        shutil.rmtree(paths_dir, ignore_errors=True)
+        os.makedirs(paths_dir)
+    part_paths = [os.path.join(paths_dir, f'block_{i:05d}.parquet') if paths_dir else None for i in range(n_blocks)]
+
+    args = [(s, n, baseline_rev, baseline_exp, lo, hi, rev_volatility, exp_volatility,
+             chunk_size, HISTOGRAM_BINS, sampling, control_variate, part)
+            for s, n, part in zip(streams, sizes, part_paths)]
+    result = SimulationAccumulator(lo=lo, hi=hi)
+    if workers == 1 or n_blocks == 1:
+        for a in args:
+            result.merge(simulate_block(*a))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # Results arrive in block order and are folded in immediately
+            for block in pool.map(simulate_block, *zip(*args)):
+                result.merge(block)
+    return result
+
+
+def summarize(acc, baseline_rev, baseline_exp, confidence=0.95):
+    """Executive risk metrics from an accumulator."""
+    tail = 1 - confidence
+    return {
+        'Simulated Paths': acc.count,
+        'Baseline Net Result': baseline_rev - baseline_exp,
+        'Mean Simulated Result': acc.mean,
+        'Std Dev of Result': acc.std,
+        'Probability of Profit (%)': acc.prob_profit_cv,
+        f'{confidence:.0%} Confidence Value at Risk (VaR)': acc.quantile(tail),
+        f'{confidence:.0%} Expected Shortfall (CVaR)': acc.expected_shortfall(tail)
+    }
+
+
+def _adaptive_batch(seed_seq, paths, baseline_rev, baseline_exp, lo, hi, rev_volatility, exp_volatility,
+                    sampling, control_variate, tail):
+    """One adaptive batch: its accumulator plus the batch's own VaR and probability estimates."""
+    acc = simulate_block(seed_seq, paths, baseline_rev, baseline_exp, lo, hi, rev_volatility, exp_volatility,
+                         chunk_size=paths, sampling=sampling, control_variate=control_variate)
+    return acc, acc.quantile(tail), acc.prob_profit_cv
+
+
+def run_adaptive_simulation(baseline_rev, baseline_exp, target_var_ci_pct=0.5, target_prob_ci=0.25,
+                            batch_size=250_000, min_batches=8, max_paths=100_000_000, seed=42, workers=None,
+                            sampling='antithetic', control_variate=True, confidence=0.95, ci_level=0.95,
+                            rev_volatility=REV_VOLATILITY, exp_volatility=EXP_VOLATILITY):
+    """
+    Draws batches until the confidence intervals are tight enough, instead of a fixed path count.
+    Stops once the CI half-width on VaR is within target_var_ci_pct % of |VaR| and the CI
+    half-width on probability of profit is within target_prob_ci percentage points, or at max_paths.
+    CIs come from batch means: each batch is an independent stream (and an independent Sobol
+    scramble), so the spread of batch estimates measures the achieved precision.
+    """
+    tail = 1 - confidence
+    z = NormalDist().inv_cdf((1 + ci_level) / 2)
+    lo, hi = result_range(baseline_rev, baseline_exp, rev_volatility, exp_volatility)
+    seeds = np.random.SeedSequence(seed)
+    round_size = max(1, workers or 1)
+
+    result = SimulationAccumulator(lo=lo, hi=hi)
+    var_estimates, prob_estimates = [], []
+    var_ci = prob_ci = np.inf
+    converged = False
+    pool = ProcessPoolExecutor(max_workers=workers) if round_size > 1 else None
+    try:
+        while result.count < max_paths:
+            n_batches = min(round_size, -(-(max_paths - result.count) // batch_size))
+            args = [(s, min(batch_size, max_paths - result.count - i * batch_size), baseline_rev, baseline_exp,
+                     lo, hi, rev_volatility, exp_volatility, sampling, control_variate, tail)
+                    for i, s in enumerate(seeds.spawn(n_batches))]
+            batches = pool.map(_adaptive_batch, *zip(*args)) if pool else [_adaptive_batch(*a) for a in args]
+            for acc, var_b, prob_b in batches:
+                result.merge(acc)
+                var_estimates.append(var_b)
+                prob_estimates.append(prob_b)
+
+            k = len(var_estimates)
+            if k >= min_batches:
+                var_ci = z * np.std(var_estimates, ddof=1) / np.sqrt(k)
+                prob_ci = z * np.std(prob_estimates, ddof=1) / np.sqrt(k)
+                var_target = abs(np.mean(var_estimates)) * target_var_ci_pct / 100
+                if var_ci <= var_target and prob_ci <= target_prob_ci:
+                    converged = True
+                    break
+    finally:
+        if pool:
+            pool.shutdown()
+
+    metrics = summarize(result, baseline_rev, baseline_exp, confidence)
+    metrics[f'{confidence:.0%} Confidence Value at Risk (VaR)'] = float(np.mean(var_estimates))
+    metrics['Probability of Profit (%)'] = float(np.mean(prob_estimates))
+    metrics.update({
+        'Sampling': sampling + (' + control variates' if control_variate else ''),
+        f'VaR CI Half-Width ({ci_level:.0%})': var_ci,
+        f'Probability CI Half-Width ({ci_level:.0%}, pts)': prob_ci,
+        'Batches': len(var_estimates),
+        'Converged': converged
+    })
+    return metrics
@@ -1,46 +1,103 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.express as px
-import requests
+from sovereign_fx import default_store
+from sovereign_cube import load_cube, query_cube, cube_manifest, period_slice
 
 # --- PAGE CONFIGURATION ---
 st.set_page_config(page_title="Sovereign Alpha | Live FX Engine", layout="wide")
 
-# --- 1. LIVE FX ENGINE (Real-Time API) ---
-@st.cache_data(ttl=3600)  # Cache rates for 1 hour to stay efficient
+# --- 1. LIVE FX ENGINE (shared store: instant from disk, refreshed in the background) ---
 def get_live_rates():
-    """Fetches real-time FX rates from a public API."""
-    try:
-        # Using a free public API for demonstration
-        url = "https://open.er-api.com/v6/latest/USD"
-        response = requests.get(url, timeout=5)
-        data = response.json()
-        if data["result"] == "success":
-            return data["rates"]
-    except Exception:
+    """Current FX rates (per 1 USD) from the shared sovereign_fx store. Never blocks on the API."""
+    fx_info = default_store().get_rates_info()
+    if fx_info['source'] == 'fallback':
         st.warning("⚠️ Live FX feed unavailable. Using fallback static rates.")
-    
-    # Fallback rates if API fails
-    return {"USD": 1.0, "ZAR": 18.55, "EUR": 0.92, "GBP": 0.78, "JPY": 148.20}
+    return fx_info
 
-rates = get_live_rates()
+fx_info = get_live_rates()
+rates = fx_info['rates']
 
 # --- 2. DATA LOADING ---
+# Most recent rows shown in the ledger table (the charts and KPIs always use the full range)
+MAX_TABLE_ROWS = 10_000
+
+# GL cube categories shown by the app, and the measure each one reports
+CUBE_ACCOUNTS = {'revenue': ('Revenue', 'credit_zar'), 'opex': ('OpEx', 'debit_zar'), 'cash': ('Cash', 'debit_zar')}
+
 @st.cache_data
-def load_data():
-    # Integrating your Project 2 transaction style
-    data = {
-        'date': pd.to_datetime(['2024-01-15', '2024-01-20', '2024-02-10', '2024-02-25', '2024-03-05', '2024-03-15']),
-        'account': ['Revenue', 'OpEx', 'Revenue', 'OpEx', 'Revenue', 'Cash'],
-        'amount_usd': [12500, 4200, 18000, 6100, 22000, 45000],
-    }
-    return pd.DataFrame(data)
+def load_data(cube_version=None, zar_per_usd=None, _cube=None):
+    """
+    Ledger sorted by date, so date filters are binary-search slices instead of row masks.
+    With a GL cube (see sovereign_cube) the rows are its monthly group totals in USD;
+    cube_version keys the cache, so the ledger itself is never re-read here.
+    """
+    if _cube is not None and len(_cube) and zar_per_usd:
+        monthly = query_cube(_cube, by=['period', 'account_category'], categories=list(CUBE_ACCOUNTS))
+        category = monthly['account_category'].astype(str)
+        zar = np.select([category == c for c in CUBE_ACCOUNTS], [monthly[m] for _, m in CUBE_ACCOUNTS.values()])
+        df = pd.DataFrame({
+            'date': pd.to_datetime(monthly['period']),
+            'account': category.map({c: label for c, (label, _) in CUBE_ACCOUNTS.items()}),
+            'amount_usd': zar / zar_per_usd
+        })
+    else:
+        # Integrating your Project 2 transaction style
+        data = {
+            'date': pd.to_datetime(['2024-01-15', '2024-01-20', '2024-02-10', '2024-02-25', '2024-03-05', '2024-03-15']),
+            'account': ['Revenue', 'OpEx', 'Revenue', 'OpEx', 'Revenue', 'Cash'],
+            'amount_usd': [12500, 4200, 18000, 6100, 22000, 45000],
+        }
+        df = pd.DataFrame(data)
+    df['account'] = df['account'].astype('category')
+    return df.sort_values('date', kind='mergesort').reset_index(drop=True)
 
-df = load_data()
+@st.cache_data
+def build_daily_cube(cube_version=None, zar_per_usd=None, _df=None):
+    """
+    Pre-aggregated (date x account) cube in USD, cached on the same key as load_data
+    (the frame itself is not hashed).
+    daily: one row per active (date, account), sorted by date, for the trend chart.
+    cumulative: running totals per account by date, so any range total is two row lookups.
+    """
+    daily = _df.groupby(['date', 'account'], observed=True, sort=True)['amount_usd'].sum().reset_index()
+    cumulative = daily.pivot_table(index='date', columns='account', values='amount_usd', aggfunc='sum', observed=True)
+    cumulative = cumulative.fillna(0).cumsum()
+    return daily, cumulative
+
+def date_slice(dates, start, end, monthly=False):
+    """
+    Positions [lo, hi) of sorted dates falling within [start, end]. monthly=True is for the
+    cube's rows, dated on the 1st of their month: whole months are kept (see period_slice).
+    """
+    if monthly:
+        return period_slice(dates, start, end)
+    lo = np.searchsorted(dates, np.datetime64(pd.Timestamp(start)), side='left')
+    hi = np.searchsorted(dates, np.datetime64(pd.Timestamp(end)), side='right')
+    return lo, hi
+
+def range_totals(cumulative, start, end, monthly=False):
+    """USD totals per account over [start, end] from the cumulative cube."""
+    lo, hi = date_slice(cumulative.index.to_numpy(), start, end, monthly)
+    if hi <= lo:
+        return pd.Series(0.0, index=cumulative.columns)
+    before = cumulative.iloc[lo - 1] if lo > 0 else 0.0
+    return cumulative.iloc[hi - 1] - before
+
+# Group ledger totals from the shared GL cube (rebuilt only when the ledger changes)
+gl_cube = load_cube()
+cube_version = cube_manifest().get('version') if gl_cube is not None else None
+df = load_data(cube_version, rates.get('ZAR'), _cube=gl_cube)
+daily_cube, cumulative_cube = build_daily_cube(cube_version, rates.get('ZAR'), _df=df)
+# Table rows are the cube's monthly account totals, or the sample transactions without a cube
+monthly_rows = bool(gl_cube is not None and len(gl_cube) and rates.get('ZAR'))
+row_label = 'monthly account totals' if monthly_rows else 'transactions'
 
 # --- 3. DYNAMIC INTERFACE ---
 st.sidebar.title("🏛️ Sovereign Control")
-st.sidebar.info("The engine is currently using live exchange rates fetched via API.")
+st.sidebar.info(f"The engine is using exchange rates as of {fx_info['rate_date'] or 'fallback table'}"
+                + (" (refreshing in background)." if fx_info['stale'] else "."))
 
 # User selects currency
 target_curr = st.sidebar.selectbox("Reporting Currency", options=sorted(rates.keys()), index=list(sorted(rates.keys())).index("ZAR") if "ZAR" in rates else 0)
@@ -50,12 +107,23 @@ current_rate = rates[target_curr]
 st.sidebar.metric(f"Live USD/{target_curr}", f"{current_rate:.4f}")
 
 # Filter by date
-date_range = st.sidebar.date_input("Analysis Period", [df['date'].min(), df['date'].max()])
+date_range = st.sidebar.date_input("Analysis Period", [df['date'].min(), df['date'].max()],
+                                   help="Ledger totals are monthly: any date selects its whole month." if monthly_rows else None)
 
 # --- 4. CALCULATION ENGINE ---
-df['reported_amount'] = df['amount_usd'] * current_rate
-mask = (df['date'] >= pd.Timestamp(date_range[0])) & (df['date'] <= pd.Timestamp(date_range[1]))
-f_df = df.loc[mask]
+# Currency switches scale the (small) aggregates; raw rows are only converted for the table slice
+if len(date_range) == 2:
+    start_date, end_date = date_range
+else:
+    start_date = end_date = date_range[0]
+
+totals = range_totals(cumulative_cube, start_date, end_date, monthly_rows) * current_rate
+lo, hi = date_slice(daily_cube['date'].to_numpy(), start_date, end_date, monthly_rows)
+trend = daily_cube.iloc[lo:hi].assign(reported_amount=lambda d: d['amount_usd'] * current_rate)
+
+lo, hi = date_slice(df['date'].to_numpy(), start_date, end_date, monthly_rows)
+f_df = df.iloc[max(lo, hi - MAX_TABLE_ROWS):hi].copy()
+f_df['reported_amount'] = f_df['amount_usd'] * current_rate
 
 # --- 5. DASHBOARD ---
 st.title("Sovereign Alpha Engine")
@@ -64,28 +132,31 @@ st.markdown(f"### Global Consolidated View ({target_curr})")
 # KPI Metrics
 c1, c2, c3 = st.columns(3)
 with c1:
-    total = f_df[f_df['account'] == 'Revenue']['reported_amount'].sum()
+    total = totals.get('Revenue', 0.0)
     st.metric("Total Revenue", f"{target_curr} {total:,.2f}")
 with c2:
-    exp = f_df[f_df['account'] == 'OpEx']['reported_amount'].sum()
+    exp = totals.get('OpEx', 0.0)
     st.metric("Total Expenses", f"{target_curr} {exp:,.2f}")
 with c3:
-    cash = f_df[f_df['account'] == 'Cash']['reported_amount'].sum()
+    cash = totals.get('Cash', 0.0)
     st.metric("Cash Position", f"{target_curr} {cash:,.2f}")
 
 st.divider()
 
-# Charts
+# Charts (from the cube, not raw transactions)
 chart_col1, chart_col2 = st.columns(2)
 
 with chart_col1:
-    fig_line = px.line(f_df.sort_values('date'), x='date', y='reported_amount', color='account', title="Trend Analysis", markers=True)
+    fig_line = px.line(trend, x='date', y='reported_amount', color='account', title="Trend Analysis", markers=True)
     st.plotly_chart(fig_line, width="stretch")
 
 with chart_col2:
-    fig_bar = px.bar(f_df.groupby('account')['reported_amount'].sum().reset_index(), x='account', y='reported_amount', title="Account Totals", color='account')
+    totals_df = totals.rename('reported_amount').rename_axis('account').reset_index()
+    fig_bar = px.bar(totals_df, x='account', y='reported_amount', title="Account Totals", color='account')
     st.plotly_chart(fig_bar, width="stretch")
 
 # Data Table
 st.markdown("#### 🔍 Source Ledger (Live Conversion)")
+if hi - lo > MAX_TABLE_ROWS:
+    st.caption(f"Showing the latest {MAX_TABLE_ROWS:,} of {hi - lo:,} {row_label} in the period.")
 st.dataframe(f_df, width="stretch")
@@ -2,26 +2,39 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
-import requests
-from datetime import datetime
+from sovereign_fx import default_store
+from sovereign_cube import load_cube, query_cube, cube_manifest
+from sovereign_statutory import statutory_provisions, corporate_tax, vat_rate, cit_rate
 
 # --- CONFIGURATION & THEME ---
 st.set_page_config(page_title="Sovereign Alpha ERP | Group Command", layout="wide")
 
-# --- 1. LIVE FX GATEWAY ---
-@st.cache_data(ttl=3600)
+# --- 1. LIVE FX GATEWAY (shared store, see sovereign_fx) ---
 def get_live_rates():
-    try:
-        url = "https://open.er-api.com/v6/latest/USD"
-        data = requests.get(url, timeout=5).json()
-        return data["rates"] if data["result"] == "success" else {"USD": 1.0, "ZAR": 18.50, "EUR": 0.92, "GBP": 0.78}
-    except:
-        return {"USD": 1.0, "ZAR": 18.50, "EUR": 0.92, "GBP": 0.78}
+    return default_store().get_rates_info()
 
-rates = get_live_rates()
+fx_info = get_live_rates()
+rates = fx_info['rates']
 
 # --- 2. THE MULTI-MODULE DATA ENGINE ---
-def load_erp_data():
+# GL cube categories that feed the ERP ledger (intercompany is eliminated on consolidation)
+ERP_CATEGORIES = ['revenue', 'opex', 'tax']
+
+@st.cache_data
+def load_erp_data(cube_version=None, zar_per_usd=None, _cube=None):
+    """
+    ERP ledger in USD (credits positive). With a GL cube (see sovereign_cube) one row per month,
+    entity and account; cube_version keys the cache. Otherwise the synthetic sample ledger.
+    """
+    if _cube is not None and len(_cube) and zar_per_usd:
+        rows = query_cube(_cube, by=['period', 'entity', 'account_name', 'account_category'], categories=ERP_CATEGORIES)
+        return pd.DataFrame({
+            'Date': pd.to_datetime(rows['period']),
+            'Category': rows['account_name'].astype(str),
+            'Description': rows['entity'].astype(str),
+            'Amount_USD': (rows['credit_zar'] - rows['debit_zar']) / zar_per_usd,
+            'Vatable': (rows['account_category'] == 'revenue').to_numpy()
+        })
     # Synthetic Ledger simulating high-complexity transactions
     data = {
         'Date': pd.to_datetime(['2024-01-01', '2024-01-15', '2024-02-01', '2024-02-15', '2024-03-01']),
@@ -32,18 +45,22 @@ def load_erp_data():
     }
     return pd.DataFrame(data)
 
-df = load_erp_data()
-
-# --- 3. STATUTORY LOGIC (VAT / PAYE / CIT) ---
-def apply_statutory_logic(amount, is_vatable):
-    vat_rate = 0.15  # South Africa Standard
-    paye_rate = 0.25 # Average effective
-    cit_rate = 0.27  # Corporate Tax
-    
-    vat = amount * vat_rate if is_vatable else 0
-    # Simplification for demo: Payroll usually negative, so we calculate tax on absolute
-    paye = abs(amount) * paye_rate if "Salaries" in str(amount) else 0 
-    return vat, paye
+# Group ledger totals from the shared GL cube (rebuilt only when the ledger changes)
+gl_cube = load_cube()
+df = load_erp_data(cube_manifest().get('version') if gl_cube is not None else None, rates.get('ZAR'), _cube=gl_cube)
+
+# --- 3. STATUTORY LOGIC (VAT / PAYE / CIT, rate tables in sovereign_statutory) ---
+@st.cache_data
+def build_reported_ledger(df, rate, apply_vat):
+    """Reported-currency ledger with VAT and PAYE provisions for every row in one vectorized pass."""
+    ledger = df.copy()
+    ledger['Amount_Reported'] = ledger['Amount_USD'] * rate
+    provisions = statutory_provisions(ledger, 'Amount_Reported', date_col='Date',
+                                      vatable=ledger['Vatable'].to_numpy(dtype=bool) & apply_vat)
+    ledger['VAT_Provision'] = provisions['vat_provision']
+    ledger['PAYE_Provision'] = provisions['paye_provision']
+    ledger['Net_Cash_Flow'] = ledger['Amount_Reported'] - ledger['VAT_Provision']
+    return ledger
 
 # --- 4. SIDEBAR CONTROL ---
 st.sidebar.title("🏛️ Group ERP Control")
@@ -52,13 +69,12 @@ current_rate = rates[target_curr]
 
 st.sidebar.divider()
 st.sidebar.subheader("Compliance Settings")
-vat_toggle = st.sidebar.checkbox("Apply VAT (15%)", value=True)
-tax_toggle = st.sidebar.checkbox("Provision for CIT (27%)", value=True)
+vat_toggle = st.sidebar.checkbox(f"Apply VAT ({vat_rate():.0%})", value=True)
+tax_toggle = st.sidebar.checkbox(f"Provision for CIT ({cit_rate():.0%})", value=True)
 
 # --- 5. CALCULATIONS ---
-df['Amount_Reported'] = df['Amount_USD'] * current_rate
-df['VAT_Provision'] = df.apply(lambda x: x['Amount_Reported'] * 0.15 if x['Vatable'] else 0, axis=1)
-df['Net_Cash_Flow'] = df['Amount_Reported'] - df['VAT_Provision']
+df = build_reported_ledger(df, current_rate, vat_toggle)
+cit_provision = corporate_tax(df['Amount_Reported'].sum()) if tax_toggle else 0.0
 
 # --- 6. DASHBOARD LAYOUT ---
 st.title("Sovereign Alpha: Executive Command Center")
@@ -76,8 +92,9 @@ with kpi3:
     lease_ins = df[df['Category'].isin(['Insurance', 'Lease (IFRS 16)'])]['Amount_Reported'].sum()
     st.metric("Fixed Obligations", f"{target_curr} {abs(lease_ins):,.2f}")
 with kpi4:
-    net_position = df['Net_Cash_Flow'].sum()
-    st.metric("Estimated Net Cash", f"{target_curr} {net_position:,.2f}")
+    net_position = df['Net_Cash_Flow'].sum() - cit_provision
+    st.metric("Estimated Net Cash", f"{target_curr} {net_position:,.2f}",
+              delta=f"CIT -{cit_provision:,.2f}" if tax_toggle else None, delta_color="off")
 
 st.divider()
 
@@ -117,10 +134,11 @@ def highlight_negatives(val):
 
 st.dataframe(
     df.style.applymap(highlight_negatives, subset=['Amount_Reported', 'Net_Cash_Flow'])
-    .format({"Amount_Reported": "{:,.2f}", "VAT_Provision": "{:,.2f}", "Net_Cash_Flow": "{:,.2f}"}),
+    .format({"Amount_Reported": "{:,.2f}", "VAT_Provision": "{:,.2f}", "PAYE_Provision": "{:,.2f}", "Net_Cash_Flow": "{:,.2f}"}),
     use_container_width=True
 )
 
 # FOOTER FOR MANAGEMENT
 st.info(f"Management Note: Leases are currently recognized under IFRS 16 guidelines. "
-        f"Insurance premiums are recognized on an accrual basis. FX Rates refreshed as of {datetime.now().strftime('%H:%M')}.")
+        f"Insurance premiums are recognized on an accrual basis. FX Rates as of {fx_info['rate_date'] or 'fallback table'}"
+        f"{' (refreshing in background)' if fx_info['stale'] else ''}.")
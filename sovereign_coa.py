@@ -0,0 +1,81 @@
+import pandas as pd
+import numpy as np
+import re
+
+# Chart-of-Accounts registry: one place that decides what an account *is*.
+# Layers classify by lookup on the 'account_category' column instead of running
+# their own regex over every row.
+CATEGORIES = ['revenue', 'opex', 'cash', 'liability', 'tax', 'intercompany', 'other']
+
+CHART_OF_ACCOUNTS = {
+    1000: ('Cash', 'cash'),
+    2000: ('Intercompany Payables', 'intercompany'),
+    4000: ('Revenue', 'revenue'),
+    5000: ('Operating Expenses', 'opex')
+}
+
+# Fallback for accounts outside the registry, evaluated once per distinct name (first match wins)
+NAME_RULES = [
+    ('intercompany', r'Intercompany'),
+    ('tax', r'Tax|VAT|Sars|PAYE'),
+    ('revenue', r'Revenue|Sales|Subscription'),
+    ('opex', r'Cost|Expense|Salary|Salaries|Payroll|Operating|Infrastructure|Insurance|OpEx'),
+    ('cash', r'Cash|Bank|Receivable'),
+    ('liability', r'Payable|Liability|Debt')
+]
+_COMPILED_RULES = [(category, re.compile(pattern, re.IGNORECASE)) for category, pattern in NAME_RULES]
+
+# Category groups used by the KPI layers
+CURRENT_ASSET_CATEGORIES = ['cash']
+CURRENT_LIABILITY_CATEGORIES = ['liability', 'intercompany']
+
+def valid_account_codes():
+    return list(CHART_OF_ACCOUNTS.keys())
+
+def _registry_index(code):
+    """Category index for a registered account code ('1000', 1000 and 1000.0 are the same account)."""
+    try:
+        category = CHART_OF_ACCOUNTS.get(int(float(code)), (None, None))[1]
+    except (TypeError, ValueError):
+        return -1
+    return CATEGORIES.index(category) if category else -1
+
+def valid_code_mask(codes):
+    """True where an account code is registered in the Chart of Accounts (checked once per distinct code)."""
+    code_idx, code_values = pd.factorize(pd.Series(codes))
+    lookup = np.array([_registry_index(c) >= 0 for c in code_values] + [False])
+    return lookup[code_idx]
+
+def classify_name(name):
+    """Category for a single account name (used on distinct names only)."""
+    if not isinstance(name, str):
+        return 'other'
+    return next((category for category, rule in _COMPILED_RULES if rule.search(name)), 'other')
+
+def classify_accounts(df, code_col='account_code', name_col='account_name'):
+    """
+    Returns a categorical Series of account categories for df.
+    Known account codes map straight from the registry; other rows fall back to
+    name rules, evaluated once per distinct name and broadcast by integer code.
+    """
+    codes = np.full(len(df), -1, dtype='int8')
+
+    if code_col in df.columns:
+        code_idx, code_values = pd.factorize(df[code_col])
+        lookup = np.array([_registry_index(c) for c in code_values] + [-1], dtype='int8')
+        codes = lookup[code_idx]
+
+    unresolved = codes < 0
+    if unresolved.any() and name_col in df.columns:
+        name_codes, names = pd.factorize(df[name_col])
+        lookup = np.array([CATEGORIES.index(classify_name(n)) for n in names] + [CATEGORIES.index('other')], dtype='int8')
+        # factorize marks missing names as -1, which indexes the trailing 'other'
+        codes = np.where(unresolved, lookup[name_codes], codes)
+
+    codes = np.where(codes < 0, CATEGORIES.index('other'), codes)
+    return pd.Series(pd.Categorical.from_codes(codes, CATEGORIES), index=df.index, name='account_category')
+
+def add_account_category(df, code_col='account_code', name_col='account_name'):
+    """Attaches the 'account_category' categorical column to df in place and returns it."""
+    df['account_category'] = classify_accounts(df, code_col, name_col)
+    return df
@@ -0,0 +1,260 @@
+import pandas as pd
+import numpy as np
+import os
+import json
+import hashlib
+from datetime import datetime
+from sovereign_normalizer import normalize_debit_credit, to_cents, from_cents, DEBIT_COLUMNS, CREDIT_COLUMNS
+from sovereign_storage import (
+    dataset_exists, dataset_signature, iter_dataset, read_dataset, publish_dataset,
+    DATE_COLUMNS, DEFAULT_ENTITY
+)
+from sovereign_coa import classify_accounts, CURRENT_ASSET_CATEGORIES, CURRENT_LIABILITY_CATEGORIES
+
+# Materialized GL cube: (entity x account x month x currency) totals built in one scan of the
+# best available ledger. KPIs, tax, simulation baselines and the apps query this small table
+# instead of re-reading and re-aggregating the ledger each.
+CUBE_NAME = 'ESFE_GL_CUBE'
+
+# Source datasets in order of preference (the consolidated group ledger first)
+SOURCE_DATASETS = ['ESFE_GROUP_CONSOLIDATED_ZAR', 'ESFE_VALIDATED_GL', 'ESFE_FACT_GL']
+# Pins the source ledger for every consumer in a process (set by the pipeline runner);
+# a pinned source that does not exist is an error rather than a fallback
+SOURCE_ENV = 'SOVEREIGN_LEDGER_SOURCE'
+
+SOURCE_COLUMNS = [
+    'entity', 'currency', 'account_code', 'account_name', 'control_status', 'amount', 'amount_zar'
+] + DEBIT_COLUMNS + CREDIT_COLUMNS + DATE_COLUMNS
+
+DIMENSIONS = ['entity', 'currency', 'period', 'account_code', 'account_name', 'account_category']
+# Measures are int64 cents: debit/credit in the entity's currency, *_zar in group reporting currency
+MEASURES = ['rows', 'debit', 'credit', 'debit_zar', 'credit_zar']
+CATEGORICAL_DIMENSIONS = ['entity', 'currency', 'account_code', 'account_name', 'account_category']
+
+# Period roll-ups accepted by query_cube
+GRAINS = {'month': 'M', 'quarter': 'Q', 'year': 'Y'}
+UNDATED_PERIOD = pd.Timestamp('1900-01-01')
+
+# In-process cache: every consumer in one process shares the same loaded cube
+_LOADED = {}
+
+def cube_block(df):
+    """
+    Aggregates one block of ledger rows into cube cells (int64 cents, so blocks merge exactly).
+    Only PASS rows count once validation has run; undated ledgers land in a single 1900-01 period.
+    """
+    if 'control_status' in df.columns:
+        df = df[df['control_status'] == 'PASS']
+    n = len(df)
+
+    date_col = next((c for c in DATE_COLUMNS if c in df.columns), None)
+    if date_col is not None:
+        period = pd.to_datetime(df[date_col], errors='coerce').to_numpy().astype('datetime64[M]').astype('datetime64[ns]')
+    else:
+        period = np.full(n, UNDATED_PERIOD.to_datetime64())
+
+    # Reporting (ZAR) amounts: the shared preference order, reporting_*_zar first
+    debit_zar, credit_zar = normalize_debit_credit(df)
+    try:
+        # Local currency: the entity's own amounts, before group translation
+        debit, credit = normalize_debit_credit(df, amount_cols=['amount'], debit_cols=['debit'], credit_cols=['credit'])
+    except KeyError:
+        debit, credit = debit_zar, credit_zar
+
+    block = pd.DataFrame({
+        'entity': df['entity'].to_numpy() if 'entity' in df.columns else DEFAULT_ENTITY,
+        'currency': df['currency'].to_numpy() if 'currency' in df.columns else 'ZAR',
+        'period': period,
+        'account_code': df['account_code'].to_numpy() if 'account_code' in df.columns else '',
+        'account_name': df['account_name'].to_numpy() if 'account_name' in df.columns else '',
+        'account_category': classify_accounts(df).to_numpy(),
+        'rows': np.ones(n, dtype='int64'),
+        'debit': to_cents(debit), 'credit': to_cents(credit),
+        'debit_zar': to_cents(debit_zar), 'credit_zar': to_cents(credit_zar)
+    })
+    return block.groupby(DIMENSIONS, observed=True, sort=False, dropna=False)[MEASURES].sum().reset_index()
+
+def merge_cube_blocks(blocks):
+    """Combines partial cubes into one (exact integer sums)."""
+    merged = pd.concat(blocks, ignore_index=True)
+    return merged.groupby(DIMENSIONS, observed=True, sort=False, dropna=False)[MEASURES].sum().reset_index()
+
+def _finalize(cube):
+    """Canonical cube layout: compact dimension dtypes, sorted cells."""
+    cube = cube.copy()
+    codes = cube['account_code']
+    cube['account_code'] = codes.where(codes.isna(), codes.astype(str).str.replace(r'\.0$', '', regex=True))
+    for col in CATEGORICAL_DIMENSIONS:
+        cube[col] = cube[col].where(cube[col].isna(), cube[col].astype(str)).astype('category')
+    cube['period'] = pd.to_datetime(cube['period'])
+    for col in MEASURES:
+        cube[col] = cube[col].astype('int64')
+    return cube.sort_values(DIMENSIONS, kind='mergesort').reset_index(drop=True)[DIMENSIONS + MEASURES]
+
+def aggregate_cube(chunks):
+    """In-memory cube from any iterable of ledger frames (build_cube feeds it warehouse chunks)."""
+    cube = None
+    for chunk in chunks:
+        block = cube_block(chunk)
+        cube = block if cube is None else merge_cube_blocks([cube, block])
+    if cube is None:
+        cube = pd.DataFrame({col: [] for col in DIMENSIONS + MEASURES})
+    return _finalize(cube)
+
+def _manifest_path(base_dir):
+    return os.path.join(base_dir, 'data', 'state', f'{CUBE_NAME}.json')
+
+def cube_manifest(base_dir=None):
+    """Build record of the materialized cube (source, source signature, sizes), or {} if never built."""
+    path = _manifest_path(base_dir or os.path.dirname(os.path.abspath(__file__)))
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def cube_source(base_dir=None):
+    """The ledger the cube is built from: the pinned source (SOURCE_ENV), else the most processed dataset available."""
+    pinned = os.environ.get(SOURCE_ENV)
+    if pinned:
+        return pinned if dataset_exists(pinned, base_dir) else None
+    return next((name for name in SOURCE_DATASETS if dataset_exists(name, base_dir)), None)
+
+def build_cube(source_name=None, chunk_size=1_000_000, base_dir=None):
+    """
+    Scans the source ledger once, chunk by chunk, and materializes the cube to the warehouse
+    (parquet, plus a CSV export). Memory is bounded by the chunk plus the cube itself.
+    """
+    base_dir = base_dir or os.path.dirname(os.path.abspath(__file__))
+    source_name = source_name or cube_source(base_dir)
+    if source_name is None or not dataset_exists(source_name, base_dir):
+        print("ERROR: No ledger available to build the GL cube. Run Layer 1 or Layer 2 first.")
+        return None
+
+    signature = dataset_signature(source_name, base_dir)
+    cube = aggregate_cube(iter_dataset(source_name, columns=SOURCE_COLUMNS, chunk_size=chunk_size, base_dir=base_dir))
+
+    publish_dataset(cube, CUBE_NAME, partition_cols=None, base_dir=base_dir)
+    manifest = {
+        'source': source_name,
+        'source_signature': signature,
+        'ledger_rows': int(cube['rows'].sum()),
+        'cells': len(cube),
+        'version': hashlib.sha256(f"{source_name}|{signature}|{len(cube)}".encode()).hexdigest()[:16],
+        'built_at': datetime.now().isoformat(timespec='seconds')
+    }
+    os.makedirs(os.path.dirname(_manifest_path(base_dir)), exist_ok=True)
+    with open(_manifest_path(base_dir), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    print(f"GL cube refreshed from {source_name}: {manifest['ledger_rows']:,} ledger rows -> {manifest['cells']:,} cells")
+    return cube
+
+def _read_cube(base_dir):
+    cube = read_dataset(CUBE_NAME, base_dir=base_dir)
+    return _finalize(cube) if len(cube) else cube
+
+def load_cube(base_dir=None, refresh=True, chunk_size=1_000_000, source_name=None):
+    """
+    The current GL cube. With refresh=True the cube is rebuilt only when the source ledger
+    (source_name, else cube_source) has changed since the last build (file signatures, no data
+    read), so each ledger is scanned once per refresh however many consumers ask.
+    Returns None when the ledger does not exist.
+    """
+    base_dir = base_dir or os.path.dirname(os.path.abspath(__file__))
+    manifest = cube_manifest(base_dir)
+    if refresh:
+        source_name = source_name or cube_source(base_dir)
+        if source_name is None or not dataset_exists(source_name, base_dir):
+            return None
+        stale = (manifest.get('source') != source_name
+                 or manifest.get('source_signature') != dataset_signature(source_name, base_dir)
+                 or not dataset_exists(CUBE_NAME, base_dir))
+        if stale:
+            cube = build_cube(source_name, chunk_size=chunk_size, base_dir=base_dir)
+            if cube is not None:
+                _LOADED[base_dir] = (cube_manifest(base_dir).get('version'), cube)
+            return cube
+    elif not manifest or not dataset_exists(CUBE_NAME, base_dir):
+        return None
+
+    version = manifest.get('version')
+    cached = _LOADED.get(base_dir)
+    if cached is None or cached[0] != version:
+        cached = (version, _read_cube(base_dir))
+        _LOADED[base_dir] = cached
+    return cached[1]
+
+def period_labels(periods, grain='month'):
+    """'2024-03' / '2024Q1' / '2024' labels for month-start timestamps ('all' collapses to 'ALL')."""
+    if grain == 'all':
+        return pd.Series('ALL', index=periods.index, name='period')
+    if grain not in GRAINS:
+        raise ValueError(f"Unknown grain '{grain}'. Use one of {list(GRAINS) + ['all']}.")
+    return periods.dt.to_period(GRAINS[grain]).astype(str).rename('period')
+
+def slice_cube(cube, entities=None, currencies=None, categories=None, accounts=None, period_from=None, period_to=None):
+    """Cells matching every given filter (lists of members; periods are inclusive dates)."""
+    mask = np.ones(len(cube), dtype=bool)
+    for col, members in (('entity', entities), ('currency', currencies),
+                         ('account_category', categories), ('account_name', accounts)):
+        if members is not None:
+            members = [members] if isinstance(members, str) else list(members)
+            mask &= cube[col].isin(members).to_numpy()
+    if period_from is not None:
+        mask &= (cube['period'] >= pd.Timestamp(period_from).to_period('M').to_timestamp()).to_numpy()
+    if period_to is not None:
+        mask &= (cube['period'] <= pd.Timestamp(period_to)).to_numpy()
+    return cube if mask.all() else cube[mask]
+
+def period_slice(periods, start, end):
+    """
+    Positions [lo, hi) of sorted month-start periods within [start, end], compared by calendar
+    month: a mid-month start or end keeps its whole month, as in slice_cube.
+    """
+    lo = np.searchsorted(periods, np.datetime64(pd.Timestamp(start).to_period('M').to_timestamp()), side='left')
+    hi = np.searchsorted(periods, np.datetime64(pd.Timestamp(end).to_period('M').to_timestamp()), side='right')
+    return lo, hi
+
+def query_cube(cube, by=None, grain='month', measures=('debit_zar', 'credit_zar'), as_cents=False, **filters):
+    """
+    Roll-up of the cube: sums of measures grouped by the dimensions in by (e.g. ['entity', 'period']),
+    after slice_cube filters. 'period' follows grain (month, quarter, year or all).
+    Amounts come back as floats in currency units, or as exact int64 cents with as_cents=True.
+    """
+    view = slice_cube(cube, **filters)
+    by = [by] if isinstance(by, str) else list(by or [])
+    measures = list(measures)
+
+    if by:
+        keys = [period_labels(view['period'], grain) if col == 'period' else view[col] for col in by]
+        result = view.groupby(keys, observed=True, sort=True)[measures].sum().reset_index()
+    else:
+        result = view[measures].sum().to_frame().T.astype('int64')
+
+    if not as_cents:
+        for col in measures:
+            if col != 'rows':
+                result[col] = from_cents(result[col])
+    return result
+
+def headline_totals(cube, **filters):
+    """
+    Group headline figures in ZAR: revenue (credits), operating costs (debits), tax postings,
+    current assets (debits) and current liabilities (credits), from one category roll-up.
+    """
+    totals = query_cube(cube, by='account_category', **filters).set_index('account_category')
+
+    def _sum(categories, measure):
+        return float(totals.loc[totals.index.isin(categories), measure].sum())
+
+    return {
+        'revenue': _sum(['revenue'], 'credit_zar'),
+        'opex': _sum(['opex'], 'debit_zar'),
+        'tax': _sum(['tax'], 'debit_zar') + _sum(['tax'], 'credit_zar'),
+        'current_assets': _sum(CURRENT_ASSET_CATEGORIES, 'debit_zar'),
+        'current_liabilities': _sum(CURRENT_LIABILITY_CATEGORIES, 'credit_zar')
+    }
+
+if __name__ == "__main__":
+    gl_cube = load_cube()
+    if gl_cube is not None:
+        print(query_cube(gl_cube, by=['entity', 'period'], grain='quarter').to_string(index=False))
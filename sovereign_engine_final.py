@@ -1,5 +1,98 @@
 from dataclasses import dataclass
-from typing import List, Dict
+from typing import List, Dict, Tuple
+from collections import OrderedDict
+from functools import lru_cache
+import hashlib
+import numpy as np
+
+# Allocation policy. Each risk level cuts the growth multiplier; the cut is floored at RISK_FACTOR_FLOOR.
+# Other labels carry no penalty.
+RISK_PENALTIES = {"High": 0.08, "Medium": 0.04, "Low": 0.0}
+RISK_FACTOR_FLOOR = 0.7
+BASE_GROWTH_SHARE = 0.3
+MIN_GROWTH_SHARE = 0.2
+DEFENSIVE_SHARE = 0.35
+
+ALLOCATION_KEYS = ["Growth Investment", "Defensive Capital", "Liquidity Reserve"]
+
+# Memoized batch results (most recent first out), keyed by a digest of the input arrays
+SCENARIO_CACHE_SIZE = 32
+_scenario_cache: "OrderedDict[str, Dict[str, np.ndarray]]" = OrderedDict()
+
+
+def _allocate(score, risk_factor, capital_base):
+    """Growth / defensive / liquidity split; works elementwise on floats and numpy arrays alike."""
+    growth_allocation = capital_base * np.maximum(BASE_GROWTH_SHARE + score, MIN_GROWTH_SHARE) * risk_factor
+    defensive_allocation = capital_base * DEFENSIVE_SHARE
+    liquidity_reserve = capital_base - (growth_allocation + defensive_allocation)
+    return growth_allocation, defensive_allocation, liquidity_reserve
+
+
+@lru_cache(maxsize=256)
+def _signal_summary(signals: Tuple[Tuple[float, str], ...]) -> Tuple[float, float]:
+    """(aggregate score, risk adjustment factor) for one signal set, computed once per distinct set."""
+    score = 0.0
+    penalty = 0.0
+    for impact, risk_level in signals:
+        score += impact
+        penalty += RISK_PENALTIES.get(risk_level, 0.0)
+    return score, max(1.0 - penalty, RISK_FACTOR_FLOOR)
+
+
+def _risk_penalties(risk_levels) -> np.ndarray:
+    """Maps risk labels (any shape) to penalties, looking up each distinct label once."""
+    labels, inverse = np.unique(np.asarray(risk_levels, dtype=str), return_inverse=True)
+    return np.array([RISK_PENALTIES.get(label, 0.0) for label in labels])[inverse].reshape(np.shape(risk_levels))
+
+
+def _scenario_key(*arrays: np.ndarray) -> str:
+    digest = hashlib.sha256()
+    for array in arrays:
+        digest.update(f"{array.dtype}{array.shape}".encode())
+        digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()
+
+
+def evaluate_scenarios(impacts, risk_levels, capital_bases) -> Dict[str, np.ndarray]:
+    """
+    Batched capital allocation: one vectorized pass over many signal / capital-base combinations.
+
+    impacts: (scenarios, signals) array of signal impacts, or (signals,) for one shared set.
+    risk_levels: risk labels ("High" / "Medium" / "Low") per signal, shape (signals,) or (scenarios, signals).
+    capital_bases: scalar or (scenarios,) array.
+
+    Returns arrays of length scenarios for each allocation (same keys as
+    capital_allocation_recommendation) plus "Score" and "Risk Factor". Identical inputs
+    return the memoized (read-only) arrays of the previous call.
+    """
+    impacts = np.atleast_2d(np.asarray(impacts, dtype='float64'))
+    risk_levels = np.asarray(risk_levels, dtype=str)
+    capital_bases = np.asarray(capital_bases, dtype='float64')
+
+    key = _scenario_key(impacts, risk_levels, capital_bases)
+    cached = _scenario_cache.get(key)
+    if cached is not None:
+        _scenario_cache.move_to_end(key)
+        return cached
+
+    # 1. Score and risk factor per scenario (row sums, no Python loop over signals)
+    score = impacts.sum(axis=1)
+    penalty = np.atleast_2d(_risk_penalties(risk_levels)).sum(axis=1)
+    risk_factor = np.maximum(1.0 - penalty, RISK_FACTOR_FLOOR)
+
+    # 2. Allocation split for every scenario at once (scalars and single rows broadcast)
+    score, risk_factor, capital_bases = np.broadcast_arrays(score, risk_factor, capital_bases)
+    split = _allocate(score, risk_factor, capital_bases)
+    result = {name: np.round(values, 2) for name, values in zip(ALLOCATION_KEYS, split)}
+    result["Score"] = np.array(score)
+    result["Risk Factor"] = np.array(risk_factor)
+    for values in result.values():
+        values.setflags(write=False)
+
+    _scenario_cache[key] = result
+    if len(_scenario_cache) > SCENARIO_CACHE_SIZE:
+        _scenario_cache.popitem(last=False)
+    return result
 
 
 @dataclass
@@ -42,32 +135,31 @@ class SovereignEngine:
             )
         ]
 
+    def _signal_key(self) -> Tuple[Tuple[float, str], ...]:
+        return tuple((s.impact, s.risk_level) for s in self.signals)
+
     def _weighted_signal_score(self) -> float:
-        score = 0.0
-        for signal in self.signals:
-            score += signal.impact
-        return score
+        return _signal_summary(self._signal_key())[0]
 
     def _risk_adjustment_factor(self) -> float:
-        high_risk = sum(1 for s in self.signals if s.risk_level == "High")
-        medium_risk = sum(1 for s in self.signals if s.risk_level == "Medium")
-
-        adjustment = 1.0 - (high_risk * 0.08) - (medium_risk * 0.04)
-        return max(adjustment, 0.7)
+        return _signal_summary(self._signal_key())[1]
 
     def capital_allocation_recommendation(self) -> Dict[str, float]:
-        score = self._weighted_signal_score()
-        risk_factor = self._risk_adjustment_factor()
-
-        growth_allocation = self.capital_base * max(0.3 + score, 0.2) * risk_factor
-        defensive_allocation = self.capital_base * 0.35
-        liquidity_reserve = self.capital_base - (growth_allocation + defensive_allocation)
-
-        return {
-            "Growth Investment": round(growth_allocation, 2),
-            "Defensive Capital": round(defensive_allocation, 2),
-            "Liquidity Reserve": round(liquidity_reserve, 2)
-        }
+        score, risk_factor = _signal_summary(self._signal_key())
+        split = _allocate(score, risk_factor, self.capital_base)
+        return {name: round(float(value), 2) for name, value in zip(ALLOCATION_KEYS, split)}
+
+    def evaluate_scenarios(self, impacts=None, risk_levels=None, capital_bases=None) -> Dict[str, np.ndarray]:
+        """
+        Batched version of capital_allocation_recommendation (see evaluate_scenarios).
+        Arguments left as None default to this engine's signals and capital base,
+        e.g. evaluate_scenarios(impacts=mc_paths) re-scores Monte Carlo impact paths.
+        """
+        return evaluate_scenarios(
+            impacts if impacts is not None else [s.impact for s in self.signals],
+            risk_levels if risk_levels is not None else [s.risk_level for s in self.signals],
+            capital_bases if capital_bases is not None else self.capital_base
+        )
 
     def generate_advisory_report(self) -> str:
         score = self._weighted_signal_score()
@@ -0,0 +1,244 @@
+import pandas as pd
+import os
+import json
+import time
+import threading
+from datetime import datetime, timezone
+
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+    HAS_REQUESTS = True
+except ImportError:
+    HAS_REQUESTS = False
+
+# Shared FX rate subsystem for the Streamlit apps and the engine.
+# Rates are kept on disk as a date x currency history (quoted per 1 unit of the base
+# currency), served from there instantly, and refreshed from the provider in the background.
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_CURRENCY = 'USD'
+DEFAULT_PROVIDER_URL = 'https://open.er-api.com/v6/latest/{base}'
+MAX_AGE_SECONDS = 3600
+REQUEST_TIMEOUT = 5
+
+# Used only until the first successful fetch (or forever, offline with an empty store)
+FALLBACK_RATES = {'USD': 1.0, 'ZAR': 18.55, 'EUR': 0.92, 'GBP': 0.78, 'JPY': 148.20}
+
+HISTORY_COLUMNS = ['date', 'base', 'currency', 'rate']
+
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+
+def shared_session():
+    """One pooled HTTP session per process (keep-alive across refreshes)."""
+    global _SESSION
+    with _SESSION_LOCK:
+        if _SESSION is None and HAS_REQUESTS:
+            _SESSION = requests.Session()
+            _SESSION.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=4))
+            _SESSION.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=4))
+        return _SESSION
+
+def er_api_provider(session, url, base):
+    """Default provider (open.er-api.com response shape). Returns (rate_date, {currency: rate})."""
+    response = session.get(url.format(base=base), timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    payload = response.json()
+    if payload.get('result') != 'success':
+        raise ValueError(f"FX provider returned result={payload.get('result')!r}")
+    stamp = payload.get('time_last_update_unix')
+    rate_date = datetime.fromtimestamp(stamp, timezone.utc).date() if stamp else datetime.now(timezone.utc).date()
+    return rate_date.isoformat(), {k: float(v) for k, v in payload['rates'].items()}
+
+class FXStore:
+    """
+    On-disk FX history with stale-while-revalidate reads.
+    get_rates() never waits on the network: it returns the newest stored rates (or the
+    fallback table) and, when they are older than max_age, starts one background refresh.
+
+    provider_url / provider make the source pluggable (e.g. a local stub server in tests);
+    SOVEREIGN_FX_URL and SOVEREIGN_FX_OFFLINE=1 set the same from the environment.
+    """
+
+    def __init__(self, base_dir=None, base=BASE_CURRENCY, provider_url=None, provider=er_api_provider,
+                 max_age=MAX_AGE_SECONDS, offline=None, session=None):
+        self.base_dir = base_dir or BASE_DIR
+        self.base = base
+        self.provider_url = provider_url or os.environ.get('SOVEREIGN_FX_URL', DEFAULT_PROVIDER_URL)
+        self.provider = provider
+        self.max_age = max_age
+        if offline is None:
+            offline = os.environ.get('SOVEREIGN_FX_OFFLINE', '') not in ('', '0')
+        self.offline = offline or not HAS_REQUESTS
+        self.session = session
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._refreshing = None
+        self._history = None
+        self._history_key = None
+
+    # --- storage ---
+    @property
+    def history_path(self):
+        return os.path.join(self.base_dir, 'data', 'fx', 'FX_RATES_HISTORY.csv')
+
+    @property
+    def meta_path(self):
+        return os.path.join(self.base_dir, 'data', 'fx', 'FX_RATES_META.json')
+
+    def _read_meta(self):
+        if not os.path.isfile(self.meta_path):
+            return {}
+        with open(self.meta_path) as f:
+            return json.load(f)
+
+    def _file_key(self):
+        try:
+            stat = os.stat(self.history_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def history(self):
+        """
+        Long history frame (date, base, currency, rate), cached in memory until the file changes
+        (keyed on its mtime and size, so writes by other processes are picked up too).
+        """
+        with self._lock:
+            key = self._file_key()
+            if self._history is None or key != self._history_key:
+                if key is not None:
+                    df = pd.read_csv(self.history_path, dtype={'base': str, 'currency': str})
+                    df['date'] = pd.to_datetime(df['date'])
+                else:
+                    df = pd.DataFrame(columns=HISTORY_COLUMNS)
+                self._history = df[df['base'] == self.base] if len(df) else df
+                self._history_key = key
+            return self._history
+
+    def history_table(self):
+        """Date x currency rate table (base currency per unit), sorted by date."""
+        df = self.history()
+        if df.empty:
+            return pd.DataFrame()
+        return df.pivot_table(index='date', columns='currency', values='rate', aggfunc='last').sort_index()
+
+    def record(self, rate_date, rates, source=None):
+        """Upserts one day of rates into the history file (atomic replace)."""
+        new = pd.DataFrame({'date': pd.to_datetime(rate_date), 'base': self.base,
+                            'currency': list(rates.keys()), 'rate': list(rates.values())})
+        with self._lock:
+            os.makedirs(os.path.dirname(self.history_path), exist_ok=True)
+            old = pd.read_csv(self.history_path, parse_dates=['date']) if os.path.isfile(self.history_path) else None
+            merged = pd.concat([old, new], ignore_index=True) if old is not None else new
+            merged = merged.drop_duplicates(['date', 'base', 'currency'], keep='last').sort_values(['date', 'base', 'currency'])
+            tmp = self.history_path + '.tmp'
+            merged.to_csv(tmp, index=False, date_format='%Y-%m-%d')
+            os.replace(tmp, self.history_path)
+            with open(self.meta_path + '.tmp', 'w') as f:
+                json.dump({'fetched_at': time.time(), 'rate_date': str(rate_date), 'source': source or self.provider_url}, f)
+            os.replace(self.meta_path + '.tmp', self.meta_path)
+            self._history = None
+
+    # --- refresh ---
+    def refresh(self):
+        """Synchronous fetch + store. Returns True on success; errors are kept in last_error."""
+        if self.offline:
+            return False
+        try:
+            rate_date, rates = self.provider(self.session or shared_session(), self.provider_url, self.base)
+            self.record(rate_date, rates)
+            self.last_error = None
+            return True
+        except Exception as exc:
+            self.last_error = f"{type(exc).__name__}: {exc}"
+            return False
+
+    def refresh_async(self):
+        """Starts a background refresh unless one is already running. Returns the thread."""
+        with self._lock:
+            if self._refreshing is not None and self._refreshing.is_alive():
+                return self._refreshing
+            self._refreshing = threading.Thread(target=self.refresh, name='fx-refresh', daemon=True)
+            self._refreshing.start()
+            return self._refreshing
+
+    def age_seconds(self):
+        fetched_at = self._read_meta().get('fetched_at')
+        return time.time() - fetched_at if fetched_at else None
+
+    def is_stale(self):
+        age = self.age_seconds()
+        return age is None or age > self.max_age
+
+    # --- reads ---
+    def rates_on(self, as_of):
+        """Rates effective on a date: the latest stored day on or before as_of."""
+        table = self.history_table()
+        if table.empty:
+            return None
+        table = table.loc[:pd.Timestamp(as_of)]
+        if table.empty:
+            return None
+        return table.ffill().iloc[-1].dropna().to_dict()
+
+    def get_rates_info(self, as_of=None):
+        """
+        Returns {'rates', 'rate_date', 'source', 'stale'} without blocking on the network.
+        source is 'store' (on-disk history) or 'fallback' (nothing stored yet).
+        """
+        if as_of is None and not self.offline and self.is_stale():
+            self.refresh_async()
+
+        table = self.history_table()
+        if not table.empty:
+            if as_of is not None:
+                table = table.loc[:pd.Timestamp(as_of)]
+            if not table.empty:
+                return {
+                    'rates': table.ffill().iloc[-1].dropna().to_dict(),
+                    'rate_date': table.index[-1].date().isoformat(),
+                    'source': 'store',
+                    'stale': as_of is None and self.is_stale()
+                }
+        return {'rates': dict(FALLBACK_RATES), 'rate_date': None, 'source': 'fallback', 'stale': True}
+
+    def currencies(self):
+        """
+        Currencies the store can translate: those in the stored history, or the fallback table when
+        nothing is stored. Reads the history file only (no refresh), so it is safe inside pipeline stages.
+        """
+        history = self.history()
+        if history.empty:
+            return set(FALLBACK_RATES)
+        return set(history['currency'].astype(str))
+
+    def get_rates(self, as_of=None):
+        return self.get_rates_info(as_of)['rates']
+
+    def cross_rates(self, quote='ZAR', as_of=None):
+        """Units of quote per 1 unit of each currency (e.g. ZAR translation rates), cross-rated through the base."""
+        rates = self.get_rates(as_of)
+        return {currency: rates[quote] / rate for currency, rate in rates.items() if rate}
+
+    def convert(self, amount, from_currency, to_currency, as_of=None):
+        rates = self.get_rates(as_of)
+        return amount / rates[from_currency] * rates[to_currency]
+
+_STORES = {}
+
+def default_store(base_dir=None):
+    """Process-wide FXStore per base_dir (one background refresher, one session)."""
+    key = base_dir or BASE_DIR
+    if key not in _STORES:
+        _STORES[key] = FXStore(base_dir=key)
+    return _STORES[key]
+
+if __name__ == "__main__":
+    store = default_store()
+    print(f"--- Sovereign FX Store ---")
+    if store.refresh():
+        info = store.get_rates_info()
+        print(f"SUCCESS: {len(info['rates'])} rates for {info['rate_date']} saved to {store.history_path}")
+    else:
+        print(f"ERROR: FX refresh failed ({store.last_error or 'offline'}). Serving stored/fallback rates.")
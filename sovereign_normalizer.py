@@ -0,0 +1,145 @@
+import pandas as pd
+import numpy as np
+
+# Column preference orders used when a ledger carries several amount representations (shared by
+# every layer). Reporting amounts come first: on the consolidated ledger reporting_*_zar are the
+# amounts after intercompany elimination, *_zar before it; entity ledgers carry debit/credit only.
+AMOUNT_COLUMNS = ['amount_zar', 'amount']
+DEBIT_COLUMNS = ['reporting_debit_zar', 'rep_debit_zar', 'debit_zar', 'debit']
+CREDIT_COLUMNS = ['reporting_credit_zar', 'rep_credit_zar', 'credit_zar', 'credit']
+
+def parse_amounts(series):
+    """
+    Converts an amount column to float64 in one vectorized pass.
+    Numeric columns are used as-is. Text columns are parsed once per distinct
+    value and understand currency symbols, space/comma/dot thousands separators
+    ("1.234.567", "1.234"), decimal commas ("R 1 234,50") and accounting negatives ("(1,234.50)").
+    Blank values become 0.0; text that still does not parse becomes NaN and is reported.
+    """
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        return np.nan_to_num(series.to_numpy(dtype='float64', na_value=np.nan), nan=0.0)
+
+    # 1. Parse each distinct label once; ledgers repeat the same amounts heavily
+    codes, uniques = pd.factorize(series, use_na_sentinel=True)
+    if len(uniques) == 0:
+        return np.zeros(len(series), dtype='float64')
+    text = pd.Series(uniques, dtype='object').astype(str).str.strip()
+
+    # 2. Sign: leading/trailing minus or accounting brackets
+    negative = text.str.contains('-', regex=False) | (text.str.startswith('(') & text.str.endswith(')'))
+
+    # 3. Keep digits and separators only
+    digits = text.str.replace(r'[^\d,.]', '', regex=True)
+
+    # 4. A comma followed by 1-2 trailing digits is a decimal comma; otherwise commas are thousands.
+    #    Without a comma, several dots or dot-grouped thousands ("12.345") are thousands separators.
+    decimal_comma = digits.str.contains(r',\d{1,2}$', regex=True)
+    dot_thousands = ~digits.str.contains(',', regex=False) & (
+        (digits.str.count(r'\.') > 1) | digits.str.fullmatch(r'[1-9]\d{0,2}(\.\d{3})+'))
+    digits = digits.where(~(decimal_comma | dot_thousands), digits.str.replace('.', '', regex=False).str.replace(',', '.', regex=False))
+    digits = digits.where(decimal_comma, digits.str.replace(',', '', regex=False))
+
+    parsed = pd.to_numeric(digits, errors='coerce').to_numpy(dtype='float64')
+    parsed = np.where(negative.to_numpy(), -parsed, parsed)
+
+    # Plain numeric labels (incl. exponent notation) keep their direct conversion
+    plain = pd.to_numeric(text, errors='coerce').to_numpy(dtype='float64')
+    values = np.where(np.isnan(plain) | dot_thousands.to_numpy(), parsed, plain)
+
+    # Blank labels are zero; anything else that failed to parse stays NaN and is reported
+    blank = (text == '').to_numpy()
+    values[blank] = 0.0
+    bad = np.isnan(values)
+    if bad.any():
+        rows = int(np.isin(codes, np.flatnonzero(bad)).sum())
+        examples = ', '.join(repr(v) for v in text[bad].head(3))
+        print(f"WARNING: {rows:,} amount value(s) could not be parsed and were left as NaN (e.g. {examples})")
+
+    # 5. Broadcast back to rows; missing values map to 0.0
+    return np.where(codes >= 0, values[codes], 0.0)
+
+def normalize_debit_credit(df, amount_cols=None, debit_cols=None, credit_cols=None):
+    """
+    Turns any supported ledger layout into (debit, credit) float64 arrays.
+    Single-column ledgers ('amount'/'amount_zar') are split by sign; two-column
+    ledgers use the first available debit and credit columns from the
+    preference lists ('reporting_debit_zar', ..., 'debit').
+    """
+    amount_cols = AMOUNT_COLUMNS if amount_cols is None else amount_cols
+    debit_cols = DEBIT_COLUMNS if debit_cols is None else debit_cols
+    credit_cols = CREDIT_COLUMNS if credit_cols is None else credit_cols
+    cols = df.columns
+
+    amt_col = next((c for c in amount_cols if c in cols), None)
+    if amt_col is not None:
+        values = parse_amounts(df[amt_col])
+        debit = np.where(values > 0, values, 0.0)
+        credit = np.where(values < 0, -values, 0.0)
+        return debit, credit
+
+    d_col = next((c for c in debit_cols if c in cols), None)
+    c_col = next((c for c in credit_cols if c in cols), None)
+    if d_col is None or c_col is None:
+        raise KeyError(f"No amount or debit/credit columns found in ledger: {list(cols)}")
+    return parse_amounts(df[d_col]), parse_amounts(df[c_col])
+
+def add_normalized_columns(df, **column_prefs):
+    """Attaches 'norm_debit' and 'norm_credit' columns to df in place and returns it."""
+    df['norm_debit'], df['norm_credit'] = normalize_debit_credit(df, **column_prefs)
+    return df
+
+def to_cents(values):
+    """
+    Rounds ZAR amounts to exact int64 cents; integer sums are order-independent, so partial totals merge exactly.
+    NaN (unparseable, already reported by parse_amounts and failed by control C03) counts as 0 cents.
+    """
+    return np.rint(np.nan_to_num(np.asarray(values, dtype='float64'), nan=0.0) * 100).astype('int64')
+
+def from_cents(cents):
+    return np.asarray(cents, dtype='int64') / 100
+
+# 64-bit FNV-1a style fold over 8-byte words, finished with a murmur3 avalanche
+_HASH_SEED = np.uint64(0xcbf29ce484222325)
+_HASH_PRIME = np.uint64(0x100000001b3)
+
+def _avalanche(h):
+    h ^= h >> np.uint64(33)
+    h *= np.uint64(0xff51afd7ed558ccd)
+    h ^= h >> np.uint64(33)
+    return h
+
+def hash_labels(values, seed=_HASH_SEED):
+    """
+    Stable uint64 hash per label (ids, names), computed on fixed-width bytes in a few
+    vectorized passes instead of hashing Python strings one by one. Same label, same hash,
+    in any chunk or process (seed picks the hash family).
+    """
+    labels = np.asarray(values, dtype=object)
+    try:
+        raw = labels.astype('S')
+    except UnicodeEncodeError:
+        raw = np.char.encode(labels.astype(str), 'utf-8')
+    n, width = len(raw), max(raw.dtype.itemsize, 1)
+    words = -(-width // 8)
+    buf = np.zeros((n, words * 8), dtype=np.uint8)
+    buf[:, :raw.dtype.itemsize] = raw.view(np.uint8).reshape(n, raw.dtype.itemsize)
+    buf = buf.view(np.uint64)
+
+    h = np.full(n, np.uint64(seed))
+    with np.errstate(over='ignore'):
+        for j in range(words):
+            h = (h ^ buf[:, j]) * _HASH_PRIME
+        return _avalanche(h)
+
+def hash_integers(values):
+    """Stable uint64 hash per integer (day numbers, cents, codes)."""
+    with np.errstate(over='ignore'):
+        return _avalanche((np.asarray(values).astype('int64').view(np.uint64) ^ _HASH_SEED) * _HASH_PRIME)
+
+def combine_hashes(*hashes, seed=_HASH_SEED):
+    """Order-sensitive combination of per-column hashes into one uint64 per row (seed picks the hash family)."""
+    h = np.full(len(hashes[0]), np.uint64(seed))
+    with np.errstate(over='ignore'):
+        for column in hashes:
+            h = _avalanche((h ^ column) * _HASH_PRIME)
+    return h
@@ -0,0 +1,488 @@
+import os
+import sys
+import ast
+import glob
+import json
+import time
+import hashlib
+import subprocess
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from sovereign_storage import has_warehouse, warehouse_path, csv_path
+from sovereign_cube import SOURCE_ENV
+from layer2_group_consolidation import DEFAULT_RATE_METHOD
+
+# Pipeline runner: the layer DAG with content-hash caching.
+# A stage's key hashes its code (the module and every local module it imports), its parameters
+# and the content of its inputs. A stage is skipped when its key matches the last successful run
+# and its outputs still hold the content recorded then; inputs produced by upstream stages are
+# fingerprinted after those stages finish, so a change re-runs exactly the stages downstream of it.
+#
+# Inputs/outputs are dataset names (warehouse partitions, else the CSV export, as the readers
+# see them) or paths relative to the engine folder (globs allowed).
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Ledger the GL cube (and so tax, KPIs and simulation) is built from; pinned for every stage
+DEFAULT_SOURCE = 'ESFE_GROUP_CONSOLIDATED_ZAR'
+
+STAGES = {
+    'generator': {
+        'run': 'layer1_core_ledger.generate_ledger_vectorized',
+        'params': {'rows': 1_000_000, 'seed': 42, 'chunk_size': 1_000_000},
+        'inputs': [],
+        'outputs': ['ESFE_FACT_GL']
+    },
+    # Terminal branch under the default (consolidated) source: consolidation reads the entity
+    # ledgers, not ESFE_FACT_GL, so ESFE_VALIDATED_GL feeds the cube only with --source ESFE_VALIDATED_GL.
+    # Its end product is otherwise the controls report.
+    'controls': {
+        'run': 'layer2_controls_validation.run_controls_engine',
+        'params': {'chunk_size': 1_000_000},
+        'inputs': ['ESFE_FACT_GL', 'data/fx/FX_RATES_HISTORY.csv'],
+        'outputs': ['ESFE_VALIDATED_GL', 'data/ESFE_CONTROLS_REPORT.csv'],
+        'terminal': True
+    },
+    # Entity batches are ingested through the dedup gate; consolidation reads its history
+    'deduplication': {
+        'run': 'layer2_deduplication.run_deduplication',
+        'params': {'chunk_size': 1_000_000},
+        'inputs': ['data/global_raw/Sovereign_*.csv'],
+        'outputs': ['ESFE_GL_HISTORY']
+    },
+    'consolidation': {
+        'run': 'layer2_group_consolidation.run_group_consolidation',
+        'params': {'chunk_size': 1_000_000, 'rate_method': DEFAULT_RATE_METHOD, 'use_history': True},
+        'inputs': ['ESFE_GL_HISTORY', 'data/fx/FX_RATES_HISTORY.csv'],
+        'outputs': ['ESFE_GROUP_CONSOLIDATED_ZAR']
+    },
+    # Terminal: the reconciliation report of the pairs consolidation eliminated (and the lines it left)
+    'intercompany': {
+        'run': 'layer2_intercompany_matching.run_intercompany_matching',
+        'params': {},
+        'inputs': ['ESFE_GROUP_CONSOLIDATED_ZAR'],
+        'outputs': ['ESFE_IC_RECONCILIATION'],
+        'terminal': True
+    },
+    'cube': {
+        'run': 'sovereign_cube.build_cube',
+        'params': {'chunk_size': 1_000_000},
+        'inputs': ['{source}'],
+        'outputs': ['ESFE_GL_CUBE']
+    },
+    'tax': {
+        'run': 'layer2_tax_processor.process_tax_and_consolidation',
+        'params': {},
+        'inputs': ['ESFE_GL_CUBE'],
+        'outputs': ['data/ESFE_CONSOLIDATED_FINANCIALS.csv']
+    },
+    'kpis': {
+        'run': 'layer3_kpis_engine.run_kpi_engine',
+        'params': {'chunk_size': 1_000_000},
+        'inputs': ['ESFE_GL_CUBE'],
+        'outputs': ['ESFE_KPIS']
+    },
+    'simulation': {
+        'run': 'layer4_reporting_exports.run_scaled_simulation',
+        'params': {'paths': 1_000_000, 'seed': 42},
+        'inputs': ['ESFE_GL_CUBE', 'ESFE_KPIS'],
+        'outputs': ['reports/Strategic_Risk_Summary.xlsx']
+    },
+    'scenarios': {
+        'run': 'layer4_scenario_engine.run_scenario_engine',
+        'params': {'paths': 1_000_000, 'seed': 42},
+        'inputs': ['ESFE_GL_CUBE', 'data/global_raw/Sovereign_*.csv', 'data/fx/FX_RATES_HISTORY.csv'],
+        'outputs': ['reports/Strategic_Group_Scenarios.xlsx']
+    },
+    'executive_report': {
+        'run': 'layer4_reporting_exports.run_executive_report',
+        'params': {},
+        'inputs': ['ESFE_KPIS'],
+        'outputs': ['reports/ESFE_Executive_Report.xlsx']
+    },
+    'dashboard': {
+        'run': 'sovereign_visualizer.generate_strategic_dashboard',
+        # The runner has already decided the render is stale; skip the visualizer's own cache
+        'params': {'force': True},
+        'inputs': ['ESFE_KPIS'],
+        'outputs': ['sovereign_dashboard.png']
+    }
+}
+
+def _state_dir(base_dir):
+    return os.path.join(base_dir, 'data', 'state')
+
+def _manifest_path(base_dir):
+    return os.path.join(_state_dir(base_dir), 'pipeline_manifest.json')
+
+def _load_json(path):
+    if not os.path.isfile(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def _save_json(data, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2)
+
+# --- Fingerprints ---
+
+class ContentHasher:
+    """
+    SHA-256 of file contents, memoized on (size, mtime) in data/state/pipeline_hashes.json,
+    so a multi-GB ledger is read once after it changes rather than on every run.
+    """
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+        self.path = os.path.join(_state_dir(base_dir), 'pipeline_hashes.json')
+        self.memo = _load_json(self.path)
+
+    def file(self, path):
+        st = os.stat(path)
+        key = os.path.relpath(path, self.base_dir)
+        cached = self.memo.get(key)
+        if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+            return cached[2]
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(16 * 1024 * 1024), b''):
+                digest.update(block)
+        self.memo[key] = [st.st_size, st.st_mtime_ns, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def files(self, paths):
+        """One digest over (relative name, content hash) pairs; None when there are no files."""
+        entries = [f"{os.path.relpath(p, self.base_dir)}:{self.file(p)}" for p in sorted(paths)]
+        return hashlib.sha256(';'.join(entries).encode()).hexdigest() if entries else None
+
+    def save(self):
+        _save_json(self.memo, self.path)
+
+def ref_files(ref, base_dir):
+    """Files behind an input/output reference: a dataset's parquet partitions (else its CSV export), or a path/glob."""
+    if '/' not in ref and '.' not in ref:
+        if has_warehouse(ref, base_dir):
+            return glob.glob(os.path.join(warehouse_path(ref, base_dir), '**', '*.parquet'), recursive=True)
+        path = csv_path(ref, base_dir)
+        return [path] if os.path.isfile(path) else []
+    return [p for p in glob.glob(os.path.join(base_dir, ref)) if os.path.isfile(p)]
+
+def local_modules(module, base_dir, seen=None):
+    """The module file plus every engine module it imports, transitively (sorted file names)."""
+    seen = set() if seen is None else seen
+    path = os.path.join(base_dir, f'{module}.py')
+    if module in seen or not os.path.isfile(path):
+        return seen
+    seen.add(module)
+    try:
+        with open(path) as f:
+            tree = ast.parse(f.read())
+    except SyntaxError:
+        return seen
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names = [node.module]
+        else:
+            continue
+        for name in names:
+            local_modules(name.split('.')[0], base_dir, seen)
+    return seen
+
+def code_fingerprint(target, base_dir, hasher):
+    module = target.rsplit('.', 1)[0]
+    paths = [os.path.join(base_dir, f'{m}.py') for m in local_modules(module, base_dir)]
+    return hasher.files(paths)
+
+def resolve_stages(source=DEFAULT_SOURCE, overrides=None):
+    """Stage table with the ledger source substituted and per-stage parameter overrides applied."""
+    stages = {}
+    for name, spec in STAGES.items():
+        params = dict(spec['params'], **(overrides or {}).get(name, {}))
+        if name in ('cube', 'tax', 'kpis'):
+            params['source_name'] = source
+        stages[name] = {
+            'run': spec['run'],
+            'params': params,
+            'inputs': [source if ref == '{source}' else ref for ref in spec['inputs']],
+            'outputs': list(spec['outputs'])
+        }
+    # A stage depends on whichever stages produce its inputs
+    producers = {ref: name for name, spec in stages.items() for ref in spec['outputs']}
+    for name, spec in stages.items():
+        spec['after'] = sorted({producers[ref] for ref in spec['inputs'] if ref in producers and producers[ref] != name})
+    # Branches marked terminal stay terminal only while no stage reads their outputs (the source can change that)
+    consumed = {dep for spec in stages.values() for dep in spec['after']}
+    for name, spec in stages.items():
+        spec['terminal'] = STAGES[name].get('terminal', False) and name not in consumed
+    return stages
+
+def stage_key(name, spec, base_dir, hasher):
+    payload = {
+        'stage': name,
+        'run': spec['run'],
+        'code': code_fingerprint(spec['run'], base_dir, hasher),
+        'params': spec['params'],
+        'inputs': {ref: hasher.files(ref_files(ref, base_dir)) for ref in spec['inputs']}
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+def output_fingerprints(spec, base_dir, hasher):
+    return {ref: hasher.files(ref_files(ref, base_dir)) for ref in spec['outputs']}
+
+# --- Execution ---
+
+def run_stage(name, params_json):
+    """Child-process entry point: calls one stage function with its JSON parameters."""
+    sys.path.insert(0, BASE_DIR)
+    module_name, func_name = STAGES[name]['run'].rsplit('.', 1)
+    module = __import__(module_name, fromlist=[func_name])
+    getattr(module, func_name)(**json.loads(params_json))
+
+def _launch(name, spec, base_dir, source, log_dir):
+    """Runs a stage in its own interpreter; stage functions report errors as 'ERROR:' lines."""
+    log_path = os.path.join(log_dir, f'{name}.log')
+    env = dict(os.environ, **{SOURCE_ENV: source})
+    started = time.time()
+    with open(log_path, 'w') as log:
+        proc = subprocess.run(
+            [sys.executable, os.path.join(base_dir, 'sovereign_pipeline.py'), '--stage', name, '--params', json.dumps(spec['params'])],
+            cwd=base_dir, env=env, stdout=log, stderr=subprocess.STDOUT
+        )
+    with open(log_path) as log:
+        errors = [line.strip() for line in log if line.startswith('ERROR')]
+    # Every output must have been written by this run (stages print errors and return on failure)
+    stale = [ref for ref in spec['outputs']
+             if not any(os.path.getmtime(p) >= started - 1 for p in ref_files(ref, base_dir))]
+    ok = proc.returncode == 0 and not errors and not stale
+    detail = errors[0] if errors else (f"exit code {proc.returncode}" if proc.returncode else
+                                       (f"outputs not written: {', '.join(stale)}" if stale else ''))
+    return ok, time.time() - started, detail, log_path
+
+def run_pipeline(stages=None, source=DEFAULT_SOURCE, force=False, max_parallel=3, overrides=None, base_dir=None):
+    """
+    Runs the layer DAG. stages limits the run to the named stages (others are taken as they are on
+    disk); force re-runs them regardless of the cache. Stages whose dependencies are met run
+    concurrently, up to max_parallel at once, each in its own interpreter (logs in data/state/pipeline_logs).
+    Returns {stage: 'ran' | 'cached' | 'failed' | 'blocked'}.
+    """
+    base_dir = base_dir or BASE_DIR
+    dag = resolve_stages(source, overrides)
+    selected = list(dag) if not stages else [s for s in dag if s in stages]
+    unknown = sorted(set(stages or []) - set(dag))
+    if unknown:
+        print(f"ERROR: Unknown stage(s) {', '.join(unknown)}. Use any of {', '.join(dag)}.")
+        return None
+
+    log_dir = os.path.join(_state_dir(base_dir), 'pipeline_logs')
+    os.makedirs(log_dir, exist_ok=True)
+    manifest = _load_json(_manifest_path(base_dir))
+    hasher = ContentHasher(base_dir)
+    status = {}
+    running = {}
+
+    print(f"--- Sovereign Engine: Pipeline Runner ---")
+    print(f"Ledger source: {source} | Stages: {', '.join(selected)}")
+    terminal = [name for name in selected if dag[name]['terminal']]
+    if terminal:
+        print(f"Terminal branches (outputs not read by other stages with this source): {', '.join(terminal)}")
+    started = time.perf_counter()
+
+    def _blocked(name):
+        return any(status.get(dep) in ('failed', 'blocked') for dep in dag[name]['after'])
+
+    def _ready(name):
+        return all(dep not in selected or status.get(dep) in ('ran', 'cached') for dep in dag[name]['after'])
+
+    with ThreadPoolExecutor(max_workers=max_parallel) as pool:
+        while len(status) < len(selected):
+            # 1. Resolve every stage whose upstream has settled: skip, block or launch
+            for name in selected:
+                if name in status or name in running.values():
+                    continue
+                if _blocked(name):
+                    status[name] = 'blocked'
+                    print(f"  {name:<17} BLOCKED (upstream failed)")
+                    continue
+                if not _ready(name):
+                    continue
+                spec = dag[name]
+                spec['key'] = stage_key(name, spec, base_dir, hasher)
+                record = manifest.get(name, {})
+                outputs = record.get('outputs')
+                if (not force and record.get('key') == spec['key'] and outputs
+                        and None not in outputs.values() and outputs == output_fingerprints(spec, base_dir, hasher)):
+                    status[name] = 'cached'
+                    print(f"  {name:<17} up to date")
+                    continue
+                if len(running) < max_parallel:
+                    running[pool.submit(_launch, name, spec, base_dir, source, log_dir)] = name
+                    print(f"  {name:<17} started")
+
+            if not running:
+                continue
+
+            # 2. Collect finished stages and record their outputs
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                ok, seconds, detail, log_path = future.result()
+                if ok:
+                    status[name] = 'ran'
+                    manifest[name] = {
+                        'key': dag[name]['key'],
+                        'outputs': output_fingerprints(dag[name], base_dir, hasher),
+                        'seconds': round(seconds, 2),
+                        'finished_at': datetime.now().isoformat(timespec='seconds')
+                    }
+                    _save_json(manifest, _manifest_path(base_dir))
+                    print(f"  {name:<17} done in {seconds:.1f}s")
+                else:
+                    status[name] = 'failed'
+                    manifest.pop(name, None)
+                    print(f"  {name:<17} FAILED: {detail} (see {log_path})")
+            hasher.save()
+
+    hasher.save()
+    _save_json(manifest, _manifest_path(base_dir))
+    counts = {state: sum(1 for s in status.values() if s == state) for state in ('ran', 'cached', 'failed', 'blocked')}
+    print(f"-----------------------------------------------")
+    print(f"Ran: {counts['ran']} | Up to date: {counts['cached']} | Failed: {counts['failed']} | "
+          f"Blocked: {counts['blocked']} ({time.perf_counter() - started:.1f}s)")
+    if counts['failed'] or counts['blocked']:
+        print("ERROR: Pipeline incomplete.")
+    else:
+        print(f"SUCCESS: Pipeline outputs are up to date.")
+    return status
+
+# --- In-process mode ---
+
+def run_in_process(ledger=None, source=DEFAULT_SOURCE, rows=1_000_000, seed=42, simulations=1000,
+                   rate_method=DEFAULT_RATE_METHOD, export=False, base_dir=None):
+    """
+    Runs the layers in this interpreter, each on the table the previous layer returned: no
+    intermediate files, no re-parsing, and frames are handed on rather than copied.
+    ledger: a DataFrame or pyarrow Table to start from. Without one, source picks the chain:
+    'ESFE_GROUP_CONSOLIDATED_ZAR' deduplicates and translates the data/global_raw entity ledgers
+    in memory, any other source generates a Layer 1 ledger of rows rows. The GL controls run on
+    every ledger except the consolidated one, as in the file pipeline.
+    export=True writes only the end products (consolidated financials, ESFE_KPIS, risk report).
+    Returns {'ledger', 'cube', 'financials', 'kpis', 'simulation', 'metrics'}.
+    """
+    import pandas as pd
+    from layer1_core_ledger import ledger_blocks
+    from layer2_controls_validation import apply_controls, DuplicateIndex, CONTROL_RULES
+    from layer2_deduplication import fingerprint_rows
+    from layer2_group_consolidation import translate_entity_chunk, eliminate_intercompany, zar_closing_rates
+    from layer2_fx_translation import zar_rate_history, reporting_period_end
+    from layer2_tax_processor import compute_consolidated_financials
+    from layer3_kpis_engine import compute_kpis
+    from layer4_reporting_exports import simulation_baseline, simulate_monte_carlo
+    from sovereign_cube import aggregate_cube
+
+    base_dir = base_dir or BASE_DIR
+    timings = []
+    clock = time.perf_counter()
+
+    def _lap(layer, n):
+        nonlocal clock
+        now = time.perf_counter()
+        timings.append((layer, n, now - clock))
+        clock = now
+
+    print(f"--- Sovereign Engine: In-Process Pipeline ---")
+
+    # 1. Ledger (the only read from disk is the raw entity ledgers themselves)
+    consolidated = source == 'ESFE_GROUP_CONSOLIDATED_ZAR'
+    if ledger is not None:
+        if not isinstance(ledger, pd.DataFrame):
+            ledger = ledger.to_pandas(split_blocks=True)  # Arrow: converted once, column by column
+    elif consolidated:
+        sources = sorted(glob.glob(os.path.join(base_dir, 'data', 'global_raw', 'Sovereign_*.csv')))
+        if not sources:
+            print("ERROR: No entity ledgers matching data/global_raw/Sovereign_*.csv. Run the global generator first.")
+            return None
+        raw = pd.concat([pd.read_csv(path) for path in sources], ignore_index=True)
+        # Same gate as the file pipeline's dedup stage: a row ingested twice (same fingerprint) counts once
+        fps, chks = fingerprint_rows(raw)
+        raw = raw[~pd.DataFrame({'fp': fps, 'chk': chks}).duplicated().to_numpy()].reset_index(drop=True)
+        reporting_date = reporting_period_end(raw['txn_date'])
+        fx_rates = zar_closing_rates(reporting_date)
+        rate_history = None if rate_method == 'closing' else zar_rate_history(fallback=fx_rates)
+        fx_stats = {'pre_history': 0}
+        ledger = eliminate_intercompany(translate_entity_chunk(raw, fx_rates, rate_history, rate_method,
+                                                               reporting_date=reporting_date, stats=fx_stats))
+        if fx_stats['pre_history']:
+            print(f"WARNING: {fx_stats['pre_history']:,} rows predate the FX history and were translated at its earliest rate.")
+    else:
+        ledger = pd.concat(ledger_blocks(rows, seed), ignore_index=True)
+    _lap('ledger', len(ledger))
+
+    # 2. GL controls (adds control_status / failed_controls to the same frame's columns)
+    if not consolidated:
+        stats = {rule: {'applied': False, 'failures': 0, 'seconds': 0.0} for rule in CONTROL_RULES}
+        ledger = apply_controls(ledger, DuplicateIndex(), stats)
+        _lap('controls', len(ledger))
+
+    # 3. GL cube, then tax and KPIs from the same cube
+    cube = aggregate_cube([ledger])
+    _lap('cube', len(cube))
+    financials = compute_consolidated_financials(cube)
+    _lap('tax', len(financials))
+    kpis = compute_kpis(cube)
+    _lap('kpis', len(kpis))
+
+    # 4. Monte Carlo on the cube baseline
+    baseline_rev, baseline_exp = simulation_baseline(cube=cube)
+    simulation, metrics = simulate_monte_carlo(baseline_rev, baseline_exp, simulations=simulations, seed=seed)
+    _lap('simulation', len(simulation))
+
+    # 5. Optional export of the end products only
+    if export:
+        from sovereign_storage import publish_dataset
+        from layer4_report_writer import write_simulation_report, accumulator_from_values
+        financials.to_csv(os.path.join(base_dir, 'data', 'ESFE_CONSOLIDATED_FINANCIALS.csv'), index=False)
+        publish_dataset(kpis, 'ESFE_KPIS', partition_cols=None, base_dir=base_dir)
+        report_path = os.path.join(base_dir, 'reports', 'Strategic_Risk_Simulation.xlsx')
+        os.makedirs(os.path.dirname(report_path), exist_ok=True)
+        write_simulation_report(report_path, metrics, accumulator_from_values(simulation['Net_Result_ZAR'].to_numpy()))
+        _lap('export', 3)
+
+    print(f"\n{'Layer':<12} {'Rows':>14} {'Time (s)':>9}")
+    for layer, n, seconds in timings:
+        print(f"{layer:<12} {n:>14,} {seconds:>9.2f}")
+    print(f"-----------------------------------------------")
+    print(f"Probability of turning a profit: {metrics['Probability of Profit (%)']:.2f}%")
+    print(f"95% Confidence Value at Risk: R {abs(metrics['95% Confidence Value at Risk (VaR)']):,.2f}")
+    print(f"SUCCESS: In-process run complete ({sum(t[2] for t in timings):.1f}s{', end products exported' if export else ', nothing written'})")
+    return {'ledger': ledger, 'cube': cube, 'financials': financials, 'kpis': kpis,
+            'simulation': simulation, 'metrics': metrics}
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Sovereign Engine pipeline runner (cached layer DAG)')
+    parser.add_argument('--stages', type=lambda s: s.split(','), help=f"comma-separated subset of: {', '.join(STAGES)}")
+    parser.add_argument('--source', default=DEFAULT_SOURCE, help='ledger the GL cube, tax and KPIs read')
+    parser.add_argument('--force', action='store_true', help='re-run the selected stages even when up to date')
+    parser.add_argument('--parallel', type=int, default=3, help='maximum stages running at once')
+    parser.add_argument('--rows', type=int, help='Layer 1 generator rows')
+    parser.add_argument('--paths', type=int, help='simulation and scenario paths')
+    parser.add_argument('--in-process', action='store_true', help='run the layers in memory, no intermediate files')
+    parser.add_argument('--export', action='store_true', help='with --in-process: write the end products')
+    # Internal: single stage in a child process
+    parser.add_argument('--stage')
+    parser.add_argument('--params')
+    args = parser.parse_args()
+
+    if args.stage:
+        run_stage(args.stage, args.params)
+    elif args.in_process:
+        run_in_process(source=args.source, rows=args.rows or 1_000_000, export=args.export)
+    else:
+        overrides = {}
+        if args.rows:
+            overrides['generator'] = {'rows': args.rows, 'chunk_size': min(args.rows, 1_000_000)}
+        if args.paths:
+            overrides['simulation'] = overrides['scenarios'] = {'paths': args.paths}
+        run_pipeline(args.stages, args.source, args.force, args.parallel, overrides)
@@ -0,0 +1,87 @@
+import pandas as pd
+import numpy as np
+import re
+
+# Statutory engine: VAT, PAYE and CIT provisions as whole-column arithmetic over a ledger.
+# Each rate table lists (effective_from, rate) per jurisdiction, oldest first; a row takes
+# the rate in force on its date (np.searchsorted), or the latest rate when no date is given.
+VAT_RATES = {
+    'ZA': [('1993-04-07', 0.14), ('2018-04-01', 0.15)]
+}
+PAYE_RATES = {
+    'ZA': [('2000-01-01', 0.25)]   # average effective rate on gross payroll
+}
+CIT_RATES = {
+    'ZA': [('1999-04-01', 0.30), ('2008-04-01', 0.28), ('2022-04-01', 0.27)]
+}
+DEFAULT_JURISDICTION = 'ZA'
+
+# Lines subject to PAYE, matched on account / category / description text (once per distinct value)
+PAYROLL_PATTERN = re.compile(r'Salary|Salaries|Payroll|Wages|Remuneration', re.IGNORECASE)
+
+def _rate_table(table, jurisdiction):
+    try:
+        entries = table[jurisdiction]
+    except KeyError:
+        raise KeyError(f"No statutory rates for jurisdiction '{jurisdiction}'") from None
+    starts = np.array([np.datetime64(start, 'D') for start, _ in entries])
+    rates = np.array([rate for _, rate in entries], dtype='float64')
+    return starts, rates
+
+def rates_on(table, dates=None, jurisdiction=DEFAULT_JURISDICTION):
+    """Rate in force for each date (array), or the current rate as a float when dates is None."""
+    starts, rates = _rate_table(table, jurisdiction)
+    if dates is None:
+        return float(rates[-1])
+    days = pd.to_datetime(pd.Series(dates)).to_numpy().astype('datetime64[D]')
+    idx = np.searchsorted(starts, days, side='right') - 1
+    return rates[np.clip(idx, 0, len(rates) - 1)]
+
+def vat_rate(dates=None, jurisdiction=DEFAULT_JURISDICTION):
+    return rates_on(VAT_RATES, dates, jurisdiction)
+
+def paye_rate(dates=None, jurisdiction=DEFAULT_JURISDICTION):
+    return rates_on(PAYE_RATES, dates, jurisdiction)
+
+def cit_rate(as_of=None, jurisdiction=DEFAULT_JURISDICTION):
+    if as_of is None:
+        return rates_on(CIT_RATES, None, jurisdiction)
+    return float(rates_on(CIT_RATES, [as_of], jurisdiction)[0])
+
+def payroll_mask(df, columns):
+    """True for payroll lines: PAYROLL_PATTERN on any of the text columns, evaluated per distinct value."""
+    mask = np.zeros(len(df), dtype=bool)
+    for column in columns:
+        if column not in df.columns:
+            continue
+        codes, uniques = pd.factorize(df[column])
+        hits = np.array([isinstance(u, str) and bool(PAYROLL_PATTERN.search(u)) for u in uniques] + [False])
+        mask |= hits[codes]
+    return mask
+
+def statutory_provisions(df, amount_col, date_col=None, vatable_col=None, vatable=None,
+                         text_cols=('account_name', 'Category', 'Description'), jurisdiction=DEFAULT_JURISDICTION):
+    """
+    VAT and PAYE provisions for every row of df in one pass (no per-row Python).
+    VAT applies to rows flagged by vatable_col (or the boolean array vatable), at the rate in force
+    on date_col. PAYE applies to payroll lines on the absolute amount (payroll is usually a debit).
+    Returns a frame aligned with df: vat_provision, paye_provision, is_payroll.
+    """
+    amount = df[amount_col].to_numpy(dtype='float64')
+    dates = df[date_col] if date_col else None
+
+    if vatable is None:
+        vatable = df[vatable_col].to_numpy(dtype=bool) if vatable_col else np.zeros(len(df), dtype=bool)
+    vat = np.where(vatable, amount * vat_rate(dates, jurisdiction), 0.0)
+
+    is_payroll = payroll_mask(df, text_cols)
+    paye = np.where(is_payroll, np.abs(amount) * paye_rate(dates, jurisdiction), 0.0)
+
+    return pd.DataFrame({'vat_provision': vat, 'paye_provision': paye, 'is_payroll': is_payroll}, index=df.index)
+
+def corporate_tax(taxable_income, as_of=None, jurisdiction=DEFAULT_JURISDICTION):
+    """CIT provision on taxable income (nil on a loss); works on scalars and arrays."""
+    rate = cit_rate(as_of, jurisdiction)
+    if np.ndim(taxable_income):
+        return np.maximum(0.0, np.asarray(taxable_income, dtype='float64') * rate)
+    return max(0, taxable_income * rate)
@@ -0,0 +1,267 @@
+import pandas as pd
+import os
+import glob
+import shutil
+import uuid
+import hashlib
+
+# Columnar warehouse for inter-layer datasets. Parquet partitions are the
+# hand-off format between layers; CSV files stay as the human-facing export.
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    HAS_ARROW = True
+except ImportError:
+    HAS_ARROW = False
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATE_COLUMNS = ['txn_date', 'date']
+PARTITION_COLUMNS = ['entity', 'fiscal_period']
+DEFAULT_ENTITY = 'ESFE'
+
+def csv_path(name, base_dir=None):
+    return os.path.join(base_dir or BASE_DIR, 'data', f'{name}.csv')
+
+def warehouse_path(name, base_dir=None):
+    return os.path.join(base_dir or BASE_DIR, 'data', 'warehouse', name)
+
+def has_warehouse(name, base_dir=None):
+    return HAS_ARROW and os.path.isdir(warehouse_path(name, base_dir))
+
+def dataset_exists(name, base_dir=None):
+    """True if the dataset is available either as warehouse partitions or as a CSV export."""
+    return has_warehouse(name, base_dir) or os.path.exists(csv_path(name, base_dir))
+
+def _date_column(columns):
+    return next((c for c in DATE_COLUMNS if c in columns), None)
+
+def _prepare_partitions(df, partition_cols):
+    """Adds typed dates plus the entity / fiscal_period partition keys to a shallow copy of df."""
+    df = df.copy(deep=False)
+    date_col = _date_column(df.columns)
+    if date_col is not None:
+        # Unparseable dates become NaT (the controls engine flags them) instead of failing the write
+        df[date_col] = pd.to_datetime(df[date_col], errors='coerce')
+    if 'entity' in partition_cols and 'entity' not in df.columns:
+        df['entity'] = DEFAULT_ENTITY
+    if 'fiscal_period' in partition_cols and 'fiscal_period' not in df.columns:
+        if date_col is None:
+            raise KeyError("Partitioning by fiscal_period needs a 'txn_date' or 'date' column.")
+        df['fiscal_period'] = df[date_col].dt.strftime('%Y-%m')
+    for col in partition_cols:
+        df[col] = df[col].astype(str)
+    return df
+
+def write_dataset(df, name, partition_cols=PARTITION_COLUMNS, mode='overwrite', base_dir=None, write_id=None):
+    """
+    Writes df to data/warehouse/<name> as hive-partitioned Parquet.
+    mode='overwrite' replaces the dataset, mode='append' adds new files (used for chunked loads).
+    Files are named part-<write_id>-<i>.parquet (write_id defaults to a random id), so one
+    append can be found and rolled back (see dataset_files).
+    Returns the dataset path, or None when pyarrow is not installed.
+    """
+    if not HAS_ARROW:
+        print("Note: pyarrow not installed. Columnar warehouse skipped; CSV export remains the hand-off.")
+        return None
+
+    path = warehouse_path(name, base_dir)
+    partition_cols = list(partition_cols or [])
+    df = _prepare_partitions(df, partition_cols) if partition_cols else df
+
+    if mode == 'overwrite' and os.path.isdir(path):
+        shutil.rmtree(path)
+    os.makedirs(path, exist_ok=True)
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    partitioning = None
+    if partition_cols:
+        partitioning = ds.partitioning(pa.schema([(c, pa.string()) for c in partition_cols]), flavor='hive')
+
+    ds.write_dataset(
+        table, path, format='parquet', partitioning=partitioning,
+        basename_template=f'part-{write_id or uuid.uuid4().hex}-{{i}}.parquet',
+        existing_data_behavior='overwrite_or_ignore'
+    )
+    return path
+
+def dataset_files(name, write_id, base_dir=None):
+    """Parquet files written by one write_dataset call (any partition)."""
+    return glob.glob(os.path.join(warehouse_path(name, base_dir), '**', f'part-{write_id}-*.parquet'), recursive=True)
+
+def _arrow_dataset(name, base_dir=None):
+    path = warehouse_path(name, base_dir)
+    partitioning = 'hive' if any('=' in d for d in os.listdir(path)) else None
+    return ds.dataset(path, format='parquet', partitioning=partitioning)
+
+def _build_filter(schema_names, entities=None, date_from=None, date_to=None, undated=False):
+    """
+    Builds an Arrow filter; partition keys prune directories, the date column prunes row groups.
+    undated=True selects only rows without a valid date (the null fiscal_period partition).
+    """
+    expr = None
+
+    def _and(current, new):
+        return new if current is None else current & new
+
+    if entities is not None and 'entity' in schema_names:
+        expr = _and(expr, ds.field('entity').isin(list(entities)))
+
+    date_col = _date_column(schema_names)
+    if date_from is not None:
+        start = pd.Timestamp(date_from)
+        if 'fiscal_period' in schema_names:
+            expr = _and(expr, ds.field('fiscal_period') >= start.strftime('%Y-%m'))
+        if date_col is not None:
+            expr = _and(expr, ds.field(date_col) >= pa.scalar(start.to_pydatetime(), pa.timestamp('ns')))
+    if date_to is not None:
+        end = pd.Timestamp(date_to)
+        if 'fiscal_period' in schema_names:
+            expr = _and(expr, ds.field('fiscal_period') <= end.strftime('%Y-%m'))
+        if date_col is not None:
+            expr = _and(expr, ds.field(date_col) <= pa.scalar(end.to_pydatetime(), pa.timestamp('ns')))
+    if undated:
+        if 'fiscal_period' in schema_names:
+            expr = _and(expr, ds.field('fiscal_period').is_null())
+        if date_col is not None:
+            expr = _and(expr, ds.field(date_col).is_null())
+    return expr
+
+def _csv_usecols(columns):
+    # Filter keys are parsed too, then dropped by _filter_frame
+    return None if columns is None else (lambda c: c in columns or c in DATE_COLUMNS or c == 'entity')
+
+def _filter_frame(df, columns=None, entities=None, date_from=None, date_to=None, undated=False):
+    """Applies entity/date filters and column pruning to a frame parsed from a CSV export."""
+    date_col = _date_column(df.columns)
+    if entities is not None and 'entity' in df.columns:
+        df = df[df['entity'].isin(list(entities))]
+    if date_col is not None and undated:
+        df = df[pd.to_datetime(df[date_col], errors='coerce').isna()]
+    elif date_col is not None and (date_from is not None or date_to is not None):
+        dates = pd.to_datetime(df[date_col], errors='coerce')
+        keep = pd.Series(True, index=df.index)
+        if date_from is not None:
+            keep &= dates >= pd.Timestamp(date_from)
+        if date_to is not None:
+            keep &= dates <= pd.Timestamp(date_to)
+        df = df[keep]
+    if columns is not None:
+        df = df[[c for c in df.columns if c in columns]]
+    return df
+
+def read_dataset(name, columns=None, entities=None, date_from=None, date_to=None, undated=False, base_dir=None):
+    """
+    Loads a layer dataset, reading only the requested columns and partitions.
+    Columns that do not exist in the dataset are ignored, so callers can ask for
+    every layout they understand (e.g. 'amount' and 'debit'/'credit').
+    Falls back to the CSV export when no warehouse copy exists.
+    """
+    if has_warehouse(name, base_dir):
+        dataset = _arrow_dataset(name, base_dir)
+        names = dataset.schema.names
+        wanted = None if columns is None else [c for c in columns if c in names]
+        table = dataset.to_table(columns=wanted, filter=_build_filter(names, entities, date_from, date_to, undated))
+        return table.to_pandas()
+
+    # CSV fallback: prune columns at parse time, filter afterwards
+    df = pd.read_csv(csv_path(name, base_dir), usecols=_csv_usecols(columns))
+    return _filter_frame(df, columns, entities, date_from, date_to, undated)
+
+def iter_dataset(name, columns=None, chunk_size=1_000_000, entities=None, date_from=None, date_to=None, undated=False,
+                 base_dir=None):
+    """
+    Yields a layer dataset as DataFrames of at most chunk_size rows, so callers can
+    aggregate ledgers that do not fit in memory. Same column/partition pruning as read_dataset.
+    """
+    if has_warehouse(name, base_dir):
+        dataset = _arrow_dataset(name, base_dir)
+        names = dataset.schema.names
+        wanted = None if columns is None else [c for c in columns if c in names]
+        scan_filter = _build_filter(names, entities, date_from, date_to, undated)
+        # Partition files yield many small batches; coalesce them into full chunks
+        pending, pending_rows = [], 0
+        for batch in dataset.to_batches(columns=wanted, filter=scan_filter, batch_size=chunk_size):
+            if not batch.num_rows:
+                continue
+            pending.append(batch)
+            pending_rows += batch.num_rows
+            if pending_rows >= chunk_size:
+                table = pa.Table.from_batches(pending)
+                while table.num_rows >= chunk_size:
+                    yield table.slice(0, chunk_size).to_pandas()
+                    table = table.slice(chunk_size)
+                pending, pending_rows = table.to_batches(), table.num_rows
+        if pending_rows:
+            yield pa.Table.from_batches(pending).to_pandas()
+        return
+
+    for chunk in pd.read_csv(csv_path(name, base_dir), usecols=_csv_usecols(columns), chunksize=chunk_size):
+        yield _filter_frame(chunk, columns, entities, date_from, date_to, undated)
+
+def publish_dataset(df, name, partition_cols=PARTITION_COLUMNS, base_dir=None):
+    """Writes a layer output to the warehouse and refreshes its CSV export."""
+    write_dataset(df, name, partition_cols=partition_cols, base_dir=base_dir)
+    output_path = csv_path(name, base_dir)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    df.to_csv(output_path, index=False)
+    return output_path
+
+def ingest_csv(name, partition_cols=PARTITION_COLUMNS, chunk_size=1_000_000, base_dir=None):
+    """Streams an existing CSV export into the warehouse chunk by chunk (bounded memory)."""
+    if not HAS_ARROW:
+        print("ERROR: pyarrow is required to build the columnar warehouse.")
+        return None
+    source = csv_path(name, base_dir)
+    if not os.path.exists(source):
+        print(f"ERROR: {source} not found.")
+        return None
+
+    rows = 0
+    for i, chunk in enumerate(pd.read_csv(source, chunksize=chunk_size)):
+        partitions = partition_cols if _date_column(chunk.columns) else [c for c in partition_cols if c != 'fiscal_period']
+        write_dataset(chunk, name, partition_cols=partitions, mode='overwrite' if i == 0 else 'append', base_dir=base_dir)
+        rows += len(chunk)
+    print(f"SUCCESS: {rows:,} rows of {name} loaded into {warehouse_path(name, base_dir)}")
+    return warehouse_path(name, base_dir)
+
+def export_csv(name, base_dir=None):
+    """Re-creates the CSV export of a warehouse dataset, one record batch at a time."""
+    if not has_warehouse(name, base_dir):
+        print(f"ERROR: No warehouse copy of {name}.")
+        return None
+    output_path = csv_path(name, base_dir)
+    if os.path.exists(output_path):
+        os.remove(output_path)
+    first = True
+    for batch in _arrow_dataset(name, base_dir).to_batches():
+        batch.to_pandas().to_csv(output_path, mode='a', header=first, index=False)
+        first = False
+    return output_path
+
+def dataset_signature(name, base_dir=None):
+    """
+    Cheap content version of a dataset (file names, sizes and mtimes; no data is read).
+    Changes whenever the warehouse partitions or the CSV export are rewritten. None if missing.
+    """
+    if has_warehouse(name, base_dir):
+        root = warehouse_path(name, base_dir)
+        entries = []
+        for dirpath, _, files in os.walk(root):
+            for f in sorted(files):
+                if f.endswith('.parquet'):
+                    st = os.stat(os.path.join(dirpath, f))
+                    entries.append(f"{os.path.relpath(os.path.join(dirpath, f), root)}:{st.st_size}:{st.st_mtime_ns}")
+        return 'warehouse:' + hashlib.sha256(';'.join(sorted(entries)).encode()).hexdigest()
+    path = csv_path(name, base_dir)
+    if os.path.exists(path):
+        st = os.stat(path)
+        return f"csv:{st.st_size}:{st.st_mtime_ns}"
+    return None
+
+if __name__ == "__main__":
+    # Migrate the existing inter-layer CSVs into the columnar warehouse
+    for dataset_name in ['ESFE_FACT_GL', 'ESFE_VALIDATED_GL', 'ESFE_GROUP_CONSOLIDATED_ZAR']:
+        if os.path.exists(csv_path(dataset_name)):
+            ingest_csv(dataset_name)
+    if os.path.exists(csv_path('ESFE_KPIS')):
+        write_dataset(pd.read_csv(csv_path('ESFE_KPIS')), 'ESFE_KPIS', partition_cols=None)
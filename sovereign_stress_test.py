@@ -2,57 +2,261 @@ import pandas as pd
 import numpy as np
 import time
 import os
-# We import the visualization logic from your existing script
+import sys
+import json
+import glob
+import shutil
+import tempfile
+import platform
+import subprocess
+from datetime import datetime
+
 try:
-    from sovereign_visualizer import generate_strategic_dashboard
-except ImportError:
-    print("Note: sovereign_visualizer.py not found. Only data processing will be tested.")
+    import resource
+except ImportError:  # Windows: peak RSS is not reported
+    resource = None
 
-def run_stress_test(row_count=100000):
+# Benchmark suite: every layer, several sizes, each stage in its own process inside a
+# throw-away copy of the engine, so the real data/ and reports/ folders are never touched.
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STAGES = ['generation', 'normalization', 'validation', 'consolidation', 'kpis', 'simulation', 'export']
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+RESULTS_PATH = os.path.join(BASE_DIR, 'reports', 'benchmarks', 'Benchmark_Results.json')
+BASELINE_PATH = os.path.join(BASE_DIR, 'reports', 'benchmarks', 'Benchmark_Baseline.json')
+ENTITY_CURRENCIES = {'Sovereign Germany': 'EUR', 'Sovereign UK': 'GBP', 'Sovereign USA': 'USD'}
+CHUNK_SIZE = 1_000_000
+
+def peak_rss_mb():
+    """Peak resident set size of this process and its finished children (worker pools), in MB."""
+    if resource is None:
+        return None
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024  # ru_maxrss is bytes on macOS, KB on Linux
+    usage = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return round(usage / scale, 1)
+
+def _write_entity_ledgers(base_dir, rows, seed=7):
+    """Benchmark input for consolidation: rows split over the global_raw entity ledgers."""
+    from layer1_core_ledger import build_ledger_chunk
+    raw_dir = os.path.join(base_dir, 'data', 'global_raw')
+    os.makedirs(raw_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    share = -(-rows // len(ENTITY_CURRENCIES))
+    for entity, currency in ENTITY_CURRENCIES.items():
+        path = os.path.join(raw_dir, f"{entity.replace(' ', '_')}.csv")
+        written = 0
+        while written < share:
+            size = min(CHUNK_SIZE, share - written)
+            chunk = build_ledger_chunk(rng, written, size)
+            amount = chunk['amount'].to_numpy()
+            pd.DataFrame({
+                'txn_id': chunk['txn_id'],
+                'journal_id': chunk['journal_id'],
+                'txn_date': chunk['date'],
+                'entity': entity,
+                'currency': currency,
+                'account_code': chunk['account_code'],
+                'account_name': chunk['account_name'],
+                'debit': np.where(amount > 0, amount, 0.0),
+                'credit': np.where(amount < 0, -amount, 0.0)
+            }).to_csv(path, mode='a', header=(written == 0), index=False)
+            written += len(chunk)
+    return share * len(ENTITY_CURRENCIES)
+
+def _stage_generation(base_dir, rows):
+    from layer1_core_ledger import generate_ledger_vectorized
+    generate_ledger_vectorized(rows=rows, chunk_size=min(rows, CHUNK_SIZE))
+    return rows
+
+def _stage_normalization(base_dir, rows):
+    from sovereign_normalizer import add_normalized_columns
+    processed = 0
+    for chunk in pd.read_csv(os.path.join(base_dir, 'data', 'ESFE_FACT_GL.csv'), chunksize=CHUNK_SIZE):
+        add_normalized_columns(chunk)
+        processed += len(chunk)
+    return processed
+
+def _stage_validation(base_dir, rows):
+    from layer2_controls_validation import run_controls_engine
+    run_controls_engine(chunk_size=CHUNK_SIZE)
+    return rows
+
+def _stage_consolidation(base_dir, rows):
+    from layer2_group_consolidation import run_group_consolidation
+    run_group_consolidation(chunk_size=CHUNK_SIZE)
+    return rows
+
+def _stage_kpis(base_dir, rows):
+    from layer3_kpis_engine import run_kpi_engine
+    run_kpi_engine(chunk_size=CHUNK_SIZE)
+    return rows
+
+def _stage_simulation(base_dir, rows):
+    from layer4_reporting_exports import run_scaled_simulation
+    run_scaled_simulation(paths=rows)
+    return rows
+
+def _stage_export(base_dir, rows):
+    from layer4_reporting_exports import run_executive_report
+    from layer4_report_writer import write_workbook, EXCEL_MAX_ROWS
+    run_executive_report()
+    # Stream the ledger itself through the constant-memory writer, up to Excel's row limit
+    ledger = pd.read_csv(os.path.join(base_dir, 'data', 'ESFE_FACT_GL.csv'), nrows=min(rows, EXCEL_MAX_ROWS - 1))
+    write_workbook(os.path.join(base_dir, 'reports', 'Benchmark_Ledger.xlsx'), [('Ledger', ledger)])
+    return len(ledger)
+
+# Untimed preparation a stage needs, run in its own process before the stage starts
+STAGE_SETUP = {'consolidation': _write_entity_ledgers}
+
+def run_setup(stage, rows):
+    """Child-process entry point for a stage's untimed preparation (its own process, so it never counts in the stage's peak RSS)."""
+    base_dir = os.getcwd()
+    sys.path.insert(0, base_dir)
+    STAGE_SETUP[stage](base_dir, rows)
+
+def run_stage(stage, rows, result_path):
+    """Child-process entry point: runs one stage in the current (sandbox) directory and records it."""
+    base_dir = os.getcwd()
+    sys.path.insert(0, base_dir)
+    start = time.perf_counter()
+    processed = globals()[f'_stage_{stage}'](base_dir, rows)
+    seconds = time.perf_counter() - start
+    with open(result_path, 'w') as f:
+        json.dump({
+            'stage': stage,
+            'size': rows,
+            'rows': processed,
+            'seconds': round(seconds, 4),
+            'rows_per_sec': round(processed / seconds, 1) if seconds > 0 else None,
+            'peak_rss_mb': peak_rss_mb()
+        }, f)
+
+def _make_sandbox():
+    """Temp copy of the engine modules with empty data/ and reports/ folders."""
+    sandbox = tempfile.mkdtemp(prefix='sovereign_bench_')
+    for module in glob.glob(os.path.join(BASE_DIR, '*.py')):
+        shutil.copy(module, sandbox)
+    os.makedirs(os.path.join(sandbox, 'data'))
+    os.makedirs(os.path.join(sandbox, 'reports'))
+    return sandbox
+
+def run_benchmark_suite(sizes=DEFAULT_SIZES, stages=STAGES, output_path=RESULTS_PATH, keep_sandbox=False):
     """
-    Simulates high-volume data ingestion and triggers the visualization engine.
-    This proves the engine can handle 100k rows in seconds.
+    Runs every stage at every size. Each size gets a fresh sandbox; stages run in order
+    (later stages read what earlier ones wrote), each in its own interpreter so peak RSS
+    is per stage. Results are written as JSON to output_path.
     """
-    print(f"--- STARTING SOVEREIGN ENGINE STRESS TEST: {row_count:,} ROWS ---")
-    start_time = time.time()
-
-    # 1. GENERATE MASSIVE DATASET (SIMULATING 100k TRANSACTIONS)
-    # This mimics a massive export from an ERP like SAP or Oracle
-    data = {
-        'txn_id': [f'TXN-{i}' for i in range(row_count)],
-        'account_name': np.random.choice(['Revenue', 'Operating Expenses', 'Cash', 'Intercompany'], row_count),
-        'amount': np.random.uniform(100, 5000, row_count),
-        'currency': 'ZAR'
+    print(f"--- SOVEREIGN ENGINE BENCHMARK SUITE ---")
+    results = []
+    for size in sizes:
+        sandbox = _make_sandbox()
+        print(f"\n[{size:,} rows] sandbox: {sandbox}")
+        try:
+            for stage in stages:
+                result_path = os.path.join(sandbox, f'.bench_{stage}.json')
+                log_path = os.path.join(sandbox, f'.bench_{stage}.log')
+                script = os.path.join(sandbox, 'sovereign_stress_test.py')
+                with open(log_path, 'w') as log:
+                    proc = None
+                    if stage in STAGE_SETUP:
+                        proc = subprocess.run(
+                            [sys.executable, script, '--setup', stage, '--rows', str(size)],
+                            cwd=sandbox, stdout=log, stderr=subprocess.STDOUT
+                        )
+                    if proc is None or proc.returncode == 0:
+                        proc = subprocess.run(
+                            [sys.executable, script, '--stage', stage, '--rows', str(size), '--result', result_path],
+                            cwd=sandbox, stdout=log, stderr=subprocess.STDOUT
+                        )
+                if proc.returncode != 0 or not os.path.isfile(result_path):
+                    print(f"  {stage:<14} FAILED (see {log_path})")
+                    results.append({'stage': stage, 'size': size, 'status': 'FAILED'})
+                    keep_sandbox = True
+                    continue
+                with open(result_path) as f:
+                    result = dict(json.load(f), status='OK')
+                results.append(result)
+                print(f"  {stage:<14} {result['seconds']:>9.2f}s {result['rows_per_sec'] or 0:>14,.0f} rows/s {result['peak_rss_mb'] or 0:>9,.1f} MB")
+        finally:
+            if not keep_sandbox:
+                shutil.rmtree(sandbox, ignore_errors=True)
+
+    report = {
+        'created': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'results': results
     }
-    df_huge = pd.DataFrame(data)
-    
-    gen_time = time.time() - start_time
-    print(f"Successfully generated {row_count:,} rows in {gen_time:.2f} seconds.")
-
-    # 2. ENGINE LOGIC (CONSOLIDATION)
-    # We group the 100k rows into the 4 strategic categories the dashboard needs
-    summary = df_huge.groupby('account_name')['amount'].sum().reset_index()
-    
-    # Save this huge result as our primary data source for the visualizer
-    os.makedirs('data', exist_ok=True)
-    df_huge.to_csv('data/ESFE_FACT_GL.csv', index=False)
-    
-    print("\n[Engine Logic] Data Consolidated for Dashboarding:")
-    print(summary)
-
-    # 3. TRIGGER DASHBOARD
-    # This runs your Project 5 visualization logic on the massive dataset
-    print("\n[Visualizer] Generating Dashboard from High-Volume Data...")
-    try:
-        generate_strategic_dashboard()
-        print("SUCCESS: sovereign_dashboard.png updated with stress-test data.")
-    except NameError:
-        print("Skipping dashboard generation (visualizer logic not imported).")
-    
-    total_time = time.time() - start_time
-    print(f"\n--- TEST COMPLETE ---")
-    print(f"Total time to process {row_count:,} rows and update visuals: {total_time:.2f} seconds.")
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nSUCCESS: Benchmark results saved to {output_path}")
+    return report
+
+def compare_results(current_path=RESULTS_PATH, baseline_path=BASELINE_PATH, tolerance=0.2):
+    """
+    Flags (stage, size) pairs whose wall time or peak RSS grew more than tolerance
+    over the baseline. Returns the list of regressions (empty when clean).
+    """
+    if not os.path.isfile(baseline_path):
+        print(f"ERROR: Baseline {baseline_path} not found. Save one with --save-baseline first.")
+        return None
+    with open(current_path) as f:
+        current = json.load(f)['results']
+    with open(baseline_path) as f:
+        baseline = {(r['stage'], r['size']): r for r in json.load(f)['results'] if r.get('status') == 'OK'}
+
+    print(f"--- BENCHMARK COMPARISON (tolerance {tolerance:.0%}) ---")
+    regressions = []
+    for result in current:
+        base = baseline.get((result['stage'], result['size']))
+        if base is None or result.get('status') != 'OK':
+            continue
+        flags = []
+        for metric in ('seconds', 'peak_rss_mb'):
+            if base.get(metric) and result.get(metric) and result[metric] > base[metric] * (1 + tolerance):
+                flags.append(f"{metric} {base[metric]:,} -> {result[metric]:,}")
+        status = 'REGRESSION' if flags else 'ok'
+        print(f"  {result['stage']:<14} {result['size']:>12,}  {status:<10} {'; '.join(flags)}")
+        if flags:
+            regressions.append({'stage': result['stage'], 'size': result['size'], 'detail': flags})
+
+    print(f"\n{len(regressions)} regression(s) found." if regressions else "\nSUCCESS: No regressions against baseline.")
+    return regressions
+
+def run_stress_test(row_count=100000):
+    """Single-size run of the benchmark suite (kept for the original entry point)."""
+    return run_benchmark_suite(sizes=[row_count])
 
 if __name__ == "__main__":
-    run_stress_test()
-    
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser(description='Sovereign Engine benchmark suite')
+    parser.add_argument('--sizes', type=lambda s: [int(float(x)) for x in s.split(',')], default=DEFAULT_SIZES,
+                        help='comma-separated row counts, e.g. 1e4,1e5,1e6,1e7,1e8')
+    parser.add_argument('--stages', type=lambda s: s.split(','), default=STAGES)
+    parser.add_argument('--output', default=RESULTS_PATH)
+    parser.add_argument('--compare', nargs='?', const=BASELINE_PATH, help='compare the results against a baseline JSON')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--save-baseline', action='store_true', help='store this run as the baseline')
+    parser.add_argument('--keep-sandbox', action='store_true')
+    # Internal: single stage inside a sandbox
+    parser.add_argument('--stage')
+    parser.add_argument('--setup')
+    parser.add_argument('--rows', type=int)
+    parser.add_argument('--result')
+    args = parser.parse_args()
+
+    if args.setup:
+        run_setup(args.setup, args.rows)
+    elif args.stage:
+        run_stage(args.stage, args.rows, args.result)
+    else:
+        run_benchmark_suite(args.sizes, args.stages, args.output, args.keep_sandbox)
+        if args.save_baseline:
+            os.makedirs(os.path.dirname(BASELINE_PATH), exist_ok=True)
+            shutil.copy(args.output, BASELINE_PATH)
+            print(f"Baseline saved to {BASELINE_PATH}")
+        if args.compare:
+            regressions = compare_results(args.output, args.compare, args.tolerance)
+            # No baseline (None) is a failed gate, not a clean one
+            sys.exit(1 if regressions is None or regressions else 0)
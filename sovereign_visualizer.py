@@ -1,56 +1,103 @@
+import matplotlib
+matplotlib.use('Agg')  # file output only; no GUI backend start-up cost
 import matplotlib.pyplot as plt
-import seaborn as sns
+from matplotlib.ticker import FuncFormatter
 import pandas as pd
 import numpy as np
+import os
+import json
+import hashlib
+from sovereign_engine_final import SovereignEngine
+from sovereign_storage import dataset_exists, read_dataset
 
-def generate_strategic_dashboard():
-    """
-    Generates an advanced Strategic Finance Dashboard for Project 5.
-    Output: sovereign_dashboard.png
-    """
-    # 1. Setup Data based on the Sovereign Engine Output
-    allocation_data = {
-        'Category': ['Growth Investment', 'Defensive Capital', 'Liquidity Reserve'],
-        'Amount_USD': [163800000, 175000000, 161200000]
-    }
-    
-    risk_signals = {
-        'Signal': ['Macro Tightening', 'Core Resilience', 'Tech Leverage', 'Geopolitical'],
-        'Impact Score': [-0.18, 0.22, 0.15, -0.10],
-        'Risk Level': [3, 1, 2, 2]
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RISK_SCORES = {'Low': 1, 'Medium': 2, 'High': 3}
+ALLOCATION_COLORS = ['#2E86C1', '#28B463', '#D35400']
+
+# Render settings per mode: 'full' is print quality, 'preview' is a fast draft
+RENDER_MODES = {
+    'full': {'dpi': 300, 'shadow': True},
+    'preview': {'dpi': 72, 'shadow': False}
+}
+# Bump when the chart layout changes so cached renders are invalidated
+DASHBOARD_VERSION = 2
+
+def dashboard_inputs(engine=None, base_dir=None):
+    """Everything the dashboard draws, as plain JSON-able values (also the cache key source)."""
+    base_dir = base_dir or BASE_DIR
+    engine = engine or SovereignEngine()
+    allocation = engine.capital_allocation_recommendation()
+    inputs = {
+        'allocation': {'Category': list(allocation.keys()), 'Amount_USD': list(allocation.values())},
+        'signals': {
+            'Signal': [s.name for s in engine.signals],
+            'Impact Score': [s.impact for s in engine.signals],
+            'Risk Level': [RISK_SCORES.get(s.risk_level, 2) for s in engine.signals]
+        },
+        'kpis': None
     }
-    
-    df_alloc = pd.DataFrame(allocation_data)
-    df_risk = pd.DataFrame(risk_signals)
-    
-    # 2. Initialize the visual style
+    if dataset_exists('ESFE_KPIS', base_dir):
+        kpis = read_dataset('ESFE_KPIS', columns=['account_name', 'total_volume_zar'], base_dir=base_dir)
+        kpis = kpis.sort_values('total_volume_zar', ascending=False, kind='mergesort')
+        inputs['kpis'] = {
+            'Account': kpis['account_name'].astype(str).tolist(),
+            'Total Volume ZAR': [round(float(v), 2) for v in kpis['total_volume_zar']]
+        }
+    return inputs
+
+def render_key(inputs, mode, formats):
+    payload = json.dumps({'inputs': inputs, 'mode': mode, 'formats': sorted(formats), 'version': DASHBOARD_VERSION}, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def _cache_path(base_dir):
+    return os.path.join(base_dir, 'data', 'state', 'dashboard_render_cache.json')
+
+def _load_cache(base_dir):
+    path = _cache_path(base_dir)
+    if not os.path.isfile(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def _save_cache(cache, base_dir):
+    path = _cache_path(base_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(cache, f, indent=2)
+
+def build_dashboard_figure(inputs, shadow=True):
+    """Draws the dashboard from dashboard_inputs() (matplotlib only)."""
+    df_alloc = pd.DataFrame(inputs['allocation'])
+    df_risk = pd.DataFrame(inputs['signals'])
+    kpis = pd.DataFrame(inputs['kpis']) if inputs['kpis'] else None
+
+    # 1. Initialize the visual style
     plt.style.use('ggplot')
-    fig = plt.figure(figsize=(18, 10))
-    gs = fig.add_gridspec(2, 2)
-    
+    fig = plt.figure(figsize=(24, 10) if kpis is not None else (18, 10))
+    gs = fig.add_gridspec(2, 3 if kpis is not None else 2)
+
     fig.suptitle('SOVEREIGN ENGINE: STRATEGIC FINANCE INTELLIGENCE DASHBOARD', fontsize=22, fontweight='bold', y=0.98)
 
     # --- CHART 1: PIE CHART (Capital Composition) ---
     ax1 = fig.add_subplot(gs[0, 0])
-    colors = ['#2E86C1', '#28B463', '#D35400']
-    # FIX: changed 'fontWeight' (CamelCase) to 'fontweight' (lowercase)
-    ax1.pie(df_alloc['Amount_USD'], labels=df_alloc['Category'], autopct='%1.1f%%', 
-            startangle=140, colors=colors, explode=(0.05, 0, 0), shadow=True, textprops={'fontweight': 'bold'})
+    # A negative reserve cannot be drawn as a slice
+    ax1.pie(df_alloc['Amount_USD'].clip(lower=0), labels=df_alloc['Category'], autopct='%1.1f%%',
+            startangle=140, colors=ALLOCATION_COLORS, explode=(0.05, 0, 0)[:len(df_alloc)], shadow=shadow,
+            textprops={'fontweight': 'bold'})
     ax1.set_title('Strategic Capital Weighting', fontsize=14, pad=20)
 
     # --- CHART 2: BAR CHART (Allocation Totals) ---
     ax2 = fig.add_subplot(gs[0, 1])
-    sns.barplot(x='Category', y='Amount_USD', data=df_alloc, palette=colors, ax=ax2)
+    ax2.bar(df_alloc['Category'], df_alloc['Amount_USD'], color=ALLOCATION_COLORS)
     ax2.set_title('Allocation Value ($ USD)', fontsize=14)
     ax2.set_ylabel('Amount (Millions)')
-    
-    from matplotlib.ticker import FuncFormatter
     ax2.get_yaxis().set_major_formatter(FuncFormatter(lambda x, p: f'${x*1e-6:,.0f}M'))
 
     # --- CHART 3: HORIZONTAL BAR (Risk Signal Impact) ---
     ax3 = fig.add_subplot(gs[1, 0])
-    signal_colors = ['red' if x < 0 else 'green' for x in df_risk['Impact Score']]
-    sns.barplot(x='Impact Score', y='Signal', data=df_risk, palette=signal_colors, ax=ax3)
+    signal_colors = np.where(df_risk['Impact Score'] < 0, 'red', 'green')
+    ax3.barh(df_risk['Signal'], df_risk['Impact Score'], color=signal_colors)
+    ax3.invert_yaxis()
     ax3.axvline(0, color='black', linewidth=1)
     ax3.set_title('Strategic Signal Impact Analysis', fontsize=14)
     ax3.set_xlabel('Weighted Score Impact')
@@ -58,17 +105,66 @@ def generate_strategic_dashboard():
     # --- CHART 4: RISK HEATMAP ---
     ax4 = fig.add_subplot(gs[1, 1])
     heatmap_data = df_risk.pivot_table(index='Signal', values='Risk Level')
-    sns.heatmap(heatmap_data, annot=True, cmap='RdYlGn_r', cbar=False, ax=ax4)
+    ax4.imshow(heatmap_data.to_numpy(), cmap='RdYlGn_r', vmin=1, vmax=3, aspect='auto')
+    for row, value in enumerate(heatmap_data['Risk Level']):
+        ax4.text(0, row, f'{value:g}', ha='center', va='center', fontsize=12)
+    ax4.set_yticks(range(len(heatmap_data)), heatmap_data.index)
+    ax4.set_xticks([0], ['Risk Level'])
+    ax4.grid(False)
     ax4.set_title('Risk Concentration Heatmap (1=Low, 3=High)', fontsize=14)
 
-    # 3. Final Branding and Save
-    plt.figtext(0.5, 0.02, "Sovereign Engine v1.0 | Developed by Jatin Chotoo | Strategic Finance Division", 
+    # --- CHART 5: ACCOUNT VOLUMES (Layer 3 KPIs) ---
+    if kpis is not None:
+        ax5 = fig.add_subplot(gs[:, 2])
+        ax5.barh(kpis['Account'], kpis['Total Volume ZAR'], color='#2E86C1')
+        ax5.invert_yaxis()
+        ax5.set_title('Ledger Volume by Account (ZAR)', fontsize=14)
+        ax5.get_xaxis().set_major_formatter(FuncFormatter(lambda x, p: f'R{x*1e-6:,.1f}M'))
+
+    # 2. Final Branding
+    plt.figtext(0.5, 0.02, "Sovereign Engine v1.0 | Developed by Jatin Chotoo | Strategic Finance Division",
                 ha="center", fontsize=12, fontweight='bold', bbox={"facecolor":"#2E86C1", "alpha":0.1, "pad":8})
-    
+
     plt.tight_layout(rect=[0, 0.05, 1, 0.95])
-    plt.savefig('sovereign_dashboard.png', dpi=300)
-    print("\nSUCCESS: Dashboard generated as 'sovereign_dashboard.png'")
+    return fig
+
+def generate_strategic_dashboard(engine=None, output_stem=None, mode='full', formats=('png',), force=False, base_dir=None):
+    """
+    Generates the Strategic Finance Dashboard from SovereignEngine and the Layer 3 KPIs.
+    Renders are cached on a hash of the inputs, mode and formats: unchanged inputs
+    return the existing files without drawing. mode='preview' is a fast low-dpi draft.
+    All requested formats are saved from one drawn figure.
+    Output: sovereign_dashboard.<format> for each format
+    """
+    base_dir = base_dir or BASE_DIR
+    if mode not in RENDER_MODES:
+        print(f"ERROR: Unknown render mode '{mode}'. Use one of {list(RENDER_MODES)}.")
+        return
+    output_stem = output_stem or os.path.join(base_dir, 'sovereign_dashboard' if mode == 'full' else 'sovereign_dashboard_preview')
+    formats = [f.lower().lstrip('.') for f in formats]
+    outputs = [f'{output_stem}.{fmt}' for fmt in formats]
+
+    # 1. Cache check
+    inputs = dashboard_inputs(engine, base_dir)
+    key = render_key(inputs, mode, formats)
+    cache = _load_cache(base_dir)
+    if not force and cache.get(output_stem) == key and all(os.path.isfile(p) for p in outputs):
+        print(f"\nDashboard inputs unchanged; reusing {', '.join(os.path.basename(p) for p in outputs)}")
+        return outputs
+
+    # 2. Render once, save every format
+    settings = RENDER_MODES[mode]
+    fig = build_dashboard_figure(inputs, shadow=settings['shadow'])
+    try:
+        for path in outputs:
+            fig.savefig(path, dpi=settings['dpi'])
+    finally:
+        plt.close(fig)
+
+    cache[output_stem] = key
+    _save_cache(cache, base_dir)
+    print(f"\nSUCCESS: Dashboard generated as {', '.join(os.path.basename(p) for p in outputs)}")
+    return outputs
 
 if __name__ == "__main__":
     generate_strategic_dashboard()
-    
\ No newline at end of file
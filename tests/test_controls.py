@@ -0,0 +1,70 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import sovereign_fx
+from layer2_controls_validation import (
+    apply_controls, check_journal_balance, check_account_codes, check_non_negative, check_period,
+    check_currency, key_hashes, DuplicateIndex, CONTROL_RULES
+)
+
+def _stats():
+    return {rule: {'applied': False, 'failures': 0, 'seconds': 0.0} for rule in CONTROL_RULES}
+
+def test_c01_unbalanced_journal_fails_every_line():
+    chunk = pd.DataFrame({'journal_id': ['J1', 'J1', 'J2', 'J2'], 'amount': [100.0, -100.0, 50.0, -49.99]})
+    assert check_journal_balance(chunk).tolist() == [False, False, True, True]
+
+def test_c02_unknown_account_code():
+    chunk = pd.DataFrame({'account_code': [1000, 4000, 9999]})
+    assert check_account_codes(chunk).tolist() == [False, False, True]
+
+def test_c03_two_column_and_signed_ledgers():
+    two_column = pd.DataFrame({'debit': ['10.00', '-5', '0'], 'credit': ['0', '0', 'n/a']})
+    assert check_non_negative(two_column).tolist() == [False, True, True]
+    signed = pd.DataFrame({'amount': [125.5, -125.5, 0.0, np.nan]})
+    assert check_non_negative(signed).tolist() == [False, False, True, True]
+
+def test_c04_dates_outside_period_or_missing():
+    chunk = pd.DataFrame({'date': ['2023-01-01', '2023-12-31', '2024-01-01', 'not a date']})
+    assert check_period(chunk, ('2023-01-01', '2023-12-31')).tolist() == [False, False, True, True]
+
+def test_c05_currency_lookup_is_offline(monkeypatch):
+    def no_network(self):
+        raise AssertionError("C05 must not refresh the FX store")
+    monkeypatch.setattr(sovereign_fx.FXStore, 'refresh', no_network)
+    monkeypatch.setattr(sovereign_fx.FXStore, 'refresh_async', no_network)
+    chunk = pd.DataFrame({'currency': ['EUR', 'USD', 'XXX']})
+    entity = np.array(['Sovereign Germany', 'Sovereign Germany', 'Unregistered Ltd'], dtype=object)
+    assert check_currency(chunk, entity).tolist() == [False, True, True]
+
+def test_c06_duplicates_across_chunks():
+    index = DuplicateIndex()
+    entity = np.array(['A', 'A', 'B'], dtype=object)
+    first = index.flag(*key_hashes(pd.DataFrame({'txn_id': ['T1', 'T1', 'T1']}), entity))
+    second = index.flag(*key_hashes(pd.DataFrame({'txn_id': ['T2', 'T1', 'T3']}), entity))
+    assert first.tolist() == [False, True, False]
+    assert second.tolist() == [False, True, False]
+
+def test_c06_first_hash_collision_is_confirmed_by_the_check_hash():
+    index = DuplicateIndex()
+    hashes = np.array([7, 7], dtype=np.uint64)
+    assert index.flag(hashes, np.array([1, 2], dtype=np.uint64)).tolist() == [False, False]
+    assert index.flag(np.array([7, 7], dtype=np.uint64), np.array([2, 3], dtype=np.uint64)).tolist() == [True, False]
+
+def test_apply_controls_labels_failed_rules():
+    chunk = pd.DataFrame({
+        'txn_id': ['T1', 'T2', 'T2'],
+        'journal_id': ['J1', 'J1', 'J2'],
+        'date': ['2023-03-01', '2023-03-01', '2023-03-02'],
+        'account_code': [1000, 4000, 9999],
+        'amount': [100.0, -100.0, 0.0],
+        'currency': ['ZAR', 'ZAR', 'ZAR']
+    })
+    stats = _stats()
+    result = apply_controls(chunk, DuplicateIndex(), stats)
+    assert result['control_status'].tolist() == ['PASS', 'PASS', 'FAIL']
+    assert result['failed_controls'].tolist() == ['', '', 'C02;C03;C06']
+    assert stats['C06']['failures'] == 1 and stats['C01']['failures'] == 0
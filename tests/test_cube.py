@@ -0,0 +1,40 @@
+import os
+import sys
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sovereign_cube import period_slice, load_cube, aggregate_cube, query_cube, cube_manifest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCE = 'ESFE_GROUP_CONSOLIDATED_ZAR'
+
+def _account_totals(cube):
+    return query_cube(cube, by='account_name', measures=['rows', 'debit_zar', 'credit_zar'], as_cents=True)
+
+def test_period_slice_keeps_whole_months():
+    periods = pd.to_datetime(['2023-01-01', '2023-02-01', '2023-03-01', '2023-04-01']).to_numpy()
+    assert period_slice(periods, '2023-02-15', '2023-03-10') == (1, 3)
+    assert period_slice(periods, '2023-02-01', '2023-02-28') == (1, 2)
+    assert period_slice(periods, '2022-06-30', '2023-01-01') == (0, 1)
+    assert period_slice(periods, '2023-05-02', '2023-12-31') == (4, 4)
+
+def test_cube_is_rebuilt_only_when_its_source_changes(tmp_path, capsys):
+    base_dir = str(tmp_path)
+    (tmp_path / 'data').mkdir()
+    with open(os.path.join(REPO_DIR, 'data', SOURCE + '.csv')) as f:
+        lines = f.readlines()
+    source = tmp_path / 'data' / (SOURCE + '.csv')
+    source.write_text(''.join(lines[:100]))
+
+    first = load_cube(base_dir, source_name=SOURCE)
+    version = cube_manifest(base_dir)['version']
+    assert 'GL cube refreshed' in capsys.readouterr().out
+    assert load_cube(base_dir, source_name=SOURCE) is first
+    assert 'GL cube refreshed' not in capsys.readouterr().out
+
+    with open(source, 'a') as f:
+        f.writelines(lines[100:])
+    rebuilt = load_cube(base_dir, source_name=SOURCE)
+    assert 'GL cube refreshed' in capsys.readouterr().out
+    assert cube_manifest(base_dir)['version'] != version
+    pd.testing.assert_frame_equal(_account_totals(rebuilt), _account_totals(aggregate_cube([pd.read_csv(source)])))
@@ -0,0 +1,34 @@
+import os
+import sys
+import shutil
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from layer2_deduplication import run_deduplication
+from layer2_group_consolidation import run_group_consolidation
+from layer3_kpis_engine import compute_kpis
+from sovereign_cube import aggregate_cube
+from sovereign_storage import csv_path
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _raw_copy(tmp_path):
+    raw = tmp_path / 'data' / 'global_raw'
+    shutil.copytree(os.path.join(REPO_DIR, 'data', 'global_raw'), raw)
+    return raw
+
+def _group_kpis(base_dir):
+    run_deduplication(base_dir=base_dir)
+    run_group_consolidation(workers=1, use_history=True, base_dir=base_dir)
+    return compute_kpis(aggregate_cube([pd.read_csv(csv_path('ESFE_GROUP_CONSOLIDATED_ZAR', base_dir))]))
+
+def test_reingested_file_leaves_kpis_unchanged(tmp_path, monkeypatch):
+    monkeypatch.setenv('SOVEREIGN_FX_OFFLINE', '1')
+    raw = _raw_copy(tmp_path)
+    before = _group_kpis(str(tmp_path))
+
+    shutil.copy(raw / 'Sovereign_UK.csv', raw / 'Sovereign_UK_resend.csv')
+    after = _group_kpis(str(tmp_path))
+
+    pd.testing.assert_frame_equal(before, after)
+    assert len(pd.read_csv(tmp_path / 'data' / 'ESFE_DUPLICATES.csv')) == 200
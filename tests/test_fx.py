@@ -0,0 +1,63 @@
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sovereign_fx import FXStore, FALLBACK_RATES
+
+class StubProvider:
+    """Serves fixed days of rates in order; gate (an Event) holds each fetch until it is set."""
+    def __init__(self, days, gate=None):
+        self.days = list(days)
+        self.gate = gate
+        self.calls = 0
+
+    def __call__(self, session, url, base):
+        self.calls += 1
+        if self.gate is not None:
+            self.gate.wait(5)
+        return self.days[min(self.calls, len(self.days)) - 1]
+
+def _store(tmp_path, provider, **kwargs):
+    return FXStore(base_dir=str(tmp_path), provider=provider, offline=False, session=object(), **kwargs)
+
+def test_stub_provider_fills_the_history(tmp_path):
+    provider = StubProvider([('2024-01-02', {'USD': 1.0, 'ZAR': 18.0}), ('2024-01-03', {'USD': 1.0, 'ZAR': 19.0})])
+    store = _store(tmp_path, provider)
+    assert store.refresh() and store.refresh()
+
+    assert store.rates_on('2024-01-02') == {'USD': 1.0, 'ZAR': 18.0}
+    assert store.rates_on('2024-01-31') == {'USD': 1.0, 'ZAR': 19.0}
+    assert store.rates_on('2023-12-31') is None
+    assert store.currencies() == {'USD', 'ZAR'}
+    # Another store on the same folder reads what this one wrote
+    assert FXStore(base_dir=str(tmp_path), offline=True).get_rates_info()['rates'] == {'USD': 1.0, 'ZAR': 19.0}
+
+def test_stale_reads_never_wait_for_the_refresh(tmp_path):
+    gate = threading.Event()
+    provider = StubProvider([('2024-01-02', {'USD': 1.0, 'ZAR': 18.0})], gate=gate)
+    store = _store(tmp_path, provider)
+
+    first = store.get_rates_info()
+    second = store.get_rates_info()
+    assert first['source'] == 'fallback' and first['rates'] == FALLBACK_RATES and first['stale']
+    assert second['source'] == 'fallback'
+
+    # Still the one refresh the first read started
+    refresh = store.refresh_async()
+    gate.set()
+    refresh.join(5)
+    assert provider.calls == 1
+    info = store.get_rates_info()
+    assert info['source'] == 'store' and info['rates'] == {'USD': 1.0, 'ZAR': 18.0} and not info['stale']
+    assert provider.calls == 1
+
+def test_offline_store_never_calls_the_provider(tmp_path, monkeypatch):
+    monkeypatch.setenv('SOVEREIGN_FX_OFFLINE', '1')
+    provider = StubProvider([('2024-01-02', {'USD': 1.0, 'ZAR': 18.0})])
+    store = FXStore(base_dir=str(tmp_path), provider=provider)
+
+    assert not store.refresh()
+    assert store.get_rates_info()['source'] == 'fallback'
+    assert store.currencies() == set(FALLBACK_RATES)
+    assert provider.calls == 0
@@ -0,0 +1,75 @@
+import os
+import sys
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import layer3_incremental_kpis
+from layer3_incremental_kpis import run_incremental_kpi_engine
+from layer3_kpis_engine import compute_kpis
+from sovereign_cube import aggregate_cube
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCE = 'ESFE_GROUP_CONSOLIDATED_ZAR'
+
+def _ledger_lines():
+    with open(os.path.join(REPO_DIR, 'data', SOURCE + '.csv')) as f:
+        return f.readlines()
+
+def _write(path, lines, mode='w'):
+    with open(path, mode) as f:
+        f.writelines(lines)
+
+def _assert_matches_full_run(base_dir, path):
+    incremental = pd.read_csv(os.path.join(base_dir, 'data', 'ESFE_KPIS.csv'))
+    full = compute_kpis(aggregate_cube([pd.read_csv(path)]))
+    pd.testing.assert_frame_equal(incremental, full.reset_index(drop=True), check_dtype=False)
+
+def _setup(tmp_path, monkeypatch):
+    monkeypatch.setattr(layer3_incremental_kpis, 'PREFIX_BLOCK_BYTES', 512)
+    (tmp_path / 'data').mkdir()
+    return str(tmp_path), str(tmp_path / 'data' / (SOURCE + '.csv'))
+
+def _correct_a_middle_line(path, lines):
+    # Same byte length, so only the block checksums can notice it
+    line = 75
+    assert ',Revenue,0.0,4795.86,' in lines[line - 1]
+    lines[line - 1] = lines[line - 1].replace(',4795.86,', ',9795.86,').replace(',114055.39\n', ',914055.39\n')
+    _write(path, lines)
+
+def test_appends_match_a_full_run(tmp_path, monkeypatch):
+    base_dir, path = _setup(tmp_path, monkeypatch)
+    lines = _ledger_lines()
+    _write(path, lines[:80])
+    run_incremental_kpi_engine(source_name=SOURCE, base_dir=base_dir)
+    _assert_matches_full_run(base_dir, path)
+
+    _write(path, lines[80:], mode='a')
+    run_incremental_kpi_engine(source_name=SOURCE, base_dir=base_dir)
+    _assert_matches_full_run(base_dir, path)
+
+def test_full_verification_catches_a_correction_on_the_next_run(tmp_path, monkeypatch):
+    base_dir, path = _setup(tmp_path, monkeypatch)
+    lines = _ledger_lines()
+    _write(path, lines)
+    run_incremental_kpi_engine(source_name=SOURCE, base_dir=base_dir)
+
+    _correct_a_middle_line(path, lines)
+    run_incremental_kpi_engine(verify_prefix='full', source_name=SOURCE, base_dir=base_dir)
+    _assert_matches_full_run(base_dir, path)
+
+def test_sampled_verification_reaches_every_block(tmp_path, monkeypatch, capsys):
+    base_dir, path = _setup(tmp_path, monkeypatch)
+    lines = _ledger_lines()
+    _write(path, lines)
+    run_incremental_kpi_engine(source_name=SOURCE, base_dir=base_dir)
+
+    _correct_a_middle_line(path, lines)
+    blocks = -(-os.path.getsize(path) // 512)
+    capsys.readouterr()
+    for _ in range(-(-blocks // layer3_incremental_kpis.SAMPLE_BLOCKS)):
+        run_incremental_kpi_engine(source_name=SOURCE, base_dir=base_dir)
+        if 'Upstream correction detected' in capsys.readouterr().out:
+            break
+    else:
+        raise AssertionError("the rotating sample never re-read the corrected block")
+    _assert_matches_full_run(base_dir, path)
@@ -0,0 +1,21 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sovereign_normalizer import parse_amounts, to_cents
+
+def test_dot_thousands_separators():
+    values = parse_amounts(pd.Series(['1.234.567', '1.234', '12.345.678,90', 'R 1 234,50', '(1,234.50)', '1234.567', '0.125']))
+    np.testing.assert_allclose(values, [1234567.0, 1234.0, 12345678.90, 1234.50, -1234.50, 1234.567, 0.125])
+
+def test_unparseable_text_is_nan_and_reported(capsys):
+    values = parse_amounts(pd.Series(['12.50', 'n/a', '', None, 'n/a']))
+    assert values[0] == 12.50
+    assert np.isnan(values[1]) and np.isnan(values[4])
+    assert values[2] == 0.0 and values[3] == 0.0
+    assert "2 amount value(s) could not be parsed" in capsys.readouterr().out
+
+def test_to_cents_ignores_nan():
+    assert to_cents(np.array([1.005, np.nan, -2.5])).tolist() == [100, 0, -250]
@@ -0,0 +1,46 @@
+import os
+import sys
+import glob
+import shutil
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sovereign_pipeline import run_pipeline
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STAGES = ['deduplication', 'consolidation']
+
+def _engine_copy(tmp_path):
+    # Stages run base_dir/sovereign_pipeline.py and write next to their own modules
+    for path in glob.glob(os.path.join(REPO_DIR, '*.py')):
+        shutil.copy(path, tmp_path)
+    shutil.copytree(os.path.join(REPO_DIR, 'data', 'global_raw'), tmp_path / 'data' / 'global_raw')
+    return str(tmp_path)
+
+def _run(base_dir, **kwargs):
+    return run_pipeline(stages=STAGES, max_parallel=1, base_dir=base_dir, **kwargs)
+
+def test_cache_hits_and_invalidation(tmp_path, monkeypatch):
+    monkeypatch.setenv('SOVEREIGN_FX_OFFLINE', '1')
+    base_dir = _engine_copy(tmp_path)
+    assert _run(base_dir) == {'deduplication': 'ran', 'consolidation': 'ran'}
+    assert _run(base_dir) == {'deduplication': 'cached', 'consolidation': 'cached'}
+
+    # Parameters: only the stage whose parameters changed
+    assert _run(base_dir, overrides={'consolidation': {'chunk_size': 50}}) == {'deduplication': 'cached', 'consolidation': 'ran'}
+
+    # Code: a stage re-runs when its module changes
+    with open(tmp_path / 'layer2_group_consolidation.py', 'a') as f:
+        f.write('\n# touched\n')
+    assert _run(base_dir, overrides={'consolidation': {'chunk_size': 50}}) == {'deduplication': 'cached', 'consolidation': 'ran'}
+
+    # Outputs: a stage whose outputs are gone re-runs even though its key matches
+    shutil.rmtree(tmp_path / 'data' / 'warehouse' / 'ESFE_GROUP_CONSOLIDATED_ZAR', ignore_errors=True)
+    os.remove(tmp_path / 'data' / 'ESFE_GROUP_CONSOLIDATED_ZAR.csv')
+    assert _run(base_dir, overrides={'consolidation': {'chunk_size': 50}}) == {'deduplication': 'cached', 'consolidation': 'ran'}
+
+    # Inputs: a new entity batch re-runs the dedup gate and everything downstream of it
+    raw = tmp_path / 'data' / 'global_raw'
+    lines = (raw / 'Sovereign_UK.csv').read_text().splitlines()
+    (raw / 'Sovereign_UK_late.csv').write_text('\n'.join([lines[0], lines[1].replace('Sov-1000', 'Sov-9000')]) + '\n')
+    assert _run(base_dir, overrides={'consolidation': {'chunk_size': 50}}) == {'deduplication': 'ran', 'consolidation': 'ran'}
+    assert _run(base_dir, overrides={'consolidation': {'chunk_size': 50}}) == {'deduplication': 'cached', 'consolidation': 'cached'}
@@ -2,15 +2,32 @@ import streamlit as st
 import pandas as pd
 import plotly.graph_objects as go
 import plotly.express as px
+import os
 from datetime import datetime
+from sovereign_storage import csv_path
+from sovereign_coa import classify_accounts, CURRENT_ASSET_CATEGORIES, CURRENT_LIABILITY_CATEGORIES
 
 # --- SETTINGS ---
 # Updated for 2026 Streamlit standards to avoid deprecation warnings
 st.set_page_config(page_title="Sovereign Alpha | Capital & Treasury", layout="wide")
 
 # --- 1. THE ARCHITECTURAL DATA ENGINE ---
-# Simulating a live feed of Assets, Liabilities, and Equity for the Group
-def get_live_balance_sheet():
+# Ledger positions come from the Layer 3 KPIs (data/ESFE_KPIS.csv) once the pipeline has run:
+# cash and current liabilities at their net ZAR balances. Group lines the GL does not carry
+# (property, investments, lease liability, share capital) keep the built-in figures below and
+# retained earnings balance the statement. Without KPIs the built-in group position is shown.
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+KPIS_PATH = csv_path('ESFE_KPIS', BASE_DIR)
+LEDGER_CATEGORIES = {'Current Asset': CURRENT_ASSET_CATEGORIES, 'Current Liability': CURRENT_LIABILITY_CATEGORIES}
+
+def balance_sheet_version():
+    """Cache key for everything derived from the balance sheet: changes only when the KPIs do."""
+    if os.path.isfile(KPIS_PATH):
+        stat = os.stat(KPIS_PATH)
+        return f"{stat.st_mtime_ns}-{stat.st_size}"
+    return "static"
+
+def group_position():
     data = {
         'Category': ['Current Asset', 'Fixed Asset', 'Investment', 'Current Liability', 'Long-term Liability', 'Equity', 'Equity'],
         'Account': ['Cash & Equivalents', 'Property (Leasehold)', 'Equities Portfolio', 'VAT/PAYE Payable', 'IFRS 16 Lease Liab', 'Share Capital', 'Retained Earnings'],
@@ -18,18 +35,65 @@ def get_live_balance_sheet():
     }
     return pd.DataFrame(data)
 
-df_bs = get_live_balance_sheet()
+@st.cache_data
+def get_live_balance_sheet(version):
+    df_bs = group_position()
+    if version == "static":
+        return df_bs
+    kpis = pd.read_csv(KPIS_PATH, usecols=['account_name', 'debit', 'credit'])
+    category = classify_accounts(kpis)
+    # Debit balances are positive, credit balances negative (the sign convention of the built-in lines)
+    ledger = pd.DataFrame({'Account': kpis['account_name'], 'Amount_ZAR': kpis['debit'] - kpis['credit']})
+    ledger.loc[category.isin(CURRENT_ASSET_CATEGORIES), 'Account'] = 'Cash & Equivalents'
+    lines = [df_bs[~df_bs['Category'].isin(list(LEDGER_CATEGORIES)) & (df_bs['Account'] != 'Retained Earnings')]]
+    for label, categories in LEDGER_CATEGORIES.items():
+        lines.append(ledger[category.isin(categories)].groupby('Account', as_index=False, sort=False)['Amount_ZAR'].sum()
+                     .assign(Category=label))
+    statement_order = pd.unique(df_bs['Category'])
+    df_bs = pd.concat(lines, ignore_index=True)[['Category', 'Account', 'Amount_ZAR']]
+    retained = pd.DataFrame({'Category': ['Equity'], 'Account': ['Retained Earnings'], 'Amount_ZAR': [-df_bs['Amount_ZAR'].sum()]})
+    df_bs = pd.concat([df_bs, retained], ignore_index=True)
+    order = pd.Categorical(df_bs['Category'], categories=statement_order).codes
+    return df_bs.iloc[order.argsort(kind='stable')].reset_index(drop=True)
 
 # --- 2. CALCULATIONS (THE CFO LOGIC) ---
-total_assets = df_bs[df_bs['Category'].str.contains('Asset|Investment')]['Amount_ZAR'].sum()
-total_liabilities = abs(df_bs[df_bs['Category'].str.contains('Liability')]['Amount_ZAR'].sum())
-total_equity = abs(df_bs[df_bs['Category'] == 'Equity']['Amount_ZAR'].sum())
+@st.cache_data
+def compute_treasury_metrics(version):
+    """Every ratio the page needs, computed once per balance-sheet version."""
+    df_bs = get_live_balance_sheet(version)
+    current_liabilities = abs(df_bs[df_bs['Category'] == 'Current Liability']['Amount_ZAR'].sum())
+    metrics = {
+        'total_assets': df_bs[df_bs['Category'].str.contains('Asset|Investment')]['Amount_ZAR'].sum(),
+        'total_liabilities': abs(df_bs[df_bs['Category'].str.contains('Liability')]['Amount_ZAR'].sum()),
+        'total_equity': abs(df_bs[df_bs['Category'] == 'Equity']['Amount_ZAR'].sum()),
+        # Key Metrics for Executive Reporting
+        'cash_on_hand': df_bs[df_bs['Account'] == 'Cash & Equivalents']['Amount_ZAR'].sum(),
+        'investment_value': df_bs[df_bs['Account'] == 'Equities Portfolio']['Amount_ZAR'].sum(),
+        'current_liabilities': current_liabilities
+    }
+    metrics['current_ratio'] = metrics['cash_on_hand'] / current_liabilities if current_liabilities else float('inf')  # Cash / Current Liab
+    metrics['debt_to_equity'] = metrics['total_liabilities'] / metrics['total_equity'] if metrics['total_equity'] else float('inf')
+    return {k: float(v) for k, v in metrics.items()}
+
+@st.cache_resource
+def build_figures(version):
+    """Plotly figures are built once per version and shared (cache_resource skips copying)."""
+    df_bs = get_live_balance_sheet(version)
+    metrics = compute_treasury_metrics(version)
+    fig_assets = px.sunburst(df_bs[df_bs['Amount_ZAR'] > 0], path=['Category', 'Account'], values='Amount_ZAR',
+                             color_discrete_sequence=px.colors.qualitative.Pastel)
+    fig_cap = go.Figure(data=[go.Pie(labels=['Liabilities', 'Equity'],
+                                   values=[metrics['total_liabilities'], metrics['total_equity']],
+                                   hole=.6,
+                                   marker_colors=['#E74C3C', '#2ECC71'])])
+    return fig_assets, fig_cap
 
-# Key Metrics for Executive Reporting
-cash_on_hand = df_bs[df_bs['Account'] == 'Cash & Equivalents']['Amount_ZAR'].values[0]
-investment_value = df_bs[df_bs['Account'] == 'Equities Portfolio']['Amount_ZAR'].values[0]
-current_ratio = cash_on_hand / 850000 # Cash / Current Liab
-debt_to_equity = total_liabilities / total_equity
+@st.cache_data
+def build_display_ledger(version):
+    # Formatting the dataframe for board-ready presentation
+    display_df = get_live_balance_sheet(version).copy()
+    display_df['Amount_ZAR_Formatted'] = display_df['Amount_ZAR'].map(lambda x: f"R {x:,.2f}")
+    return display_df[['Category', 'Account', 'Amount_ZAR_Formatted']]
 
 # --- 3. INVESTMENT SIGNAL LOGIC ---
 def get_investment_signal(cash, equity):
@@ -42,6 +106,14 @@ def get_investment_signal(cash, equity):
     else:
         return "✅ HOLD / STABLE", "Cash reserves are optimized relative to Equity position.", "info"
 
+version = balance_sheet_version()
+metrics = compute_treasury_metrics(version)
+total_assets = metrics['total_assets']
+total_liabilities = metrics['total_liabilities']
+total_equity = metrics['total_equity']
+cash_on_hand = metrics['cash_on_hand']
+current_ratio = metrics['current_ratio']
+
 signal, advice, status = get_investment_signal(cash_on_hand, total_equity)
 
 # --- 4. DASHBOARD UI ---
@@ -74,39 +146,42 @@ kpi4.metric("Current Ratio", f"{current_ratio:.2f}x", delta="Healthy" if current
 # ROW 3: VISUALIZATIONS
 col_chart1, col_chart2 = st.columns(2)
 
+fig_assets, fig_cap = build_figures(version)
+
 with col_chart1:
     st.subheader("Asset Composition")
-    fig_assets = px.sunburst(df_bs[df_bs['Amount_ZAR'] > 0], path=['Category', 'Account'], values='Amount_ZAR',
-                             color_discrete_sequence=px.colors.qualitative.Pastel)
     # Using 'stretch' to comply with 2026 Streamlit UI standards
     st.plotly_chart(fig_assets, use_container_width=True)
 
 with col_chart2:
     st.subheader("Capital Structure (Debt vs Equity)")
-    fig_cap = go.Figure(data=[go.Pie(labels=['Liabilities', 'Equity'], 
-                                   values=[total_liabilities, total_equity], 
-                                   hole=.6,
-                                   marker_colors=['#E74C3C', '#2ECC71'])])
     st.plotly_chart(fig_cap, use_container_width=True)
 
 # ROW 4: THE LIVE LEDGER
 st.subheader("Integrated Statement of Financial Position")
-# Formatting the dataframe for board-ready presentation
-display_df = df_bs.copy()
-display_df['Amount_ZAR_Formatted'] = display_df['Amount_ZAR'].apply(lambda x: f"R {x:,.2f}")
-
-st.dataframe(display_df[['Category', 'Account', 'Amount_ZAR_Formatted']], use_container_width=True)
+st.dataframe(build_display_ledger(version), use_container_width=True)
 
 # ROW 5: SIMULATION TOOLS (The "What-If" for Management)
-st.sidebar.title("🛠️ Treasury Simulator")
-st.sidebar.markdown("Test the impact of a large purchase or investment.")
-sim_spend = st.sidebar.slider("Simulate Cash Spend (ZAR)", 0, 4000000, 0, step=500000)
-
-if sim_spend > 0:
-    new_cash = cash_on_hand - sim_spend
-    new_signal, new_advice, _ = get_investment_signal(new_cash, total_equity)
-    st.sidebar.warning(f"**New Signal:** {new_signal}")
-    st.sidebar.write(new_advice)
+# A fragment: moving the slider reruns only this block (signal + what-if tiles), not the page
+@st.fragment
+def treasury_simulator(cash, equity, current_liabilities):
+    st.title("🛠️ Treasury Simulator")
+    st.markdown("Test the impact of a large purchase or investment.")
+    sim_spend = st.slider("Simulate Cash Spend (ZAR)", 0, 4000000, 0, step=500000)
+
+    if sim_spend > 0:
+        new_cash = cash - sim_spend
+        new_signal, new_advice, _ = get_investment_signal(new_cash, equity)
+        st.warning(f"**New Signal:** {new_signal}")
+        st.write(new_advice)
+        tile1, tile2 = st.columns(2)
+        tile1.metric("Cash After Spend", f"R {new_cash:,.0f}", delta=f"-R {sim_spend:,.0f}")
+        if current_liabilities:
+            tile2.metric("Current Ratio", f"{new_cash / current_liabilities:.2f}x",
+                         delta=f"{(new_cash - cash) / current_liabilities:.2f}x")
+
+with st.sidebar:
+    treasury_simulator(cash_on_hand, total_equity, metrics['current_liabilities'])
 
 st.sidebar.divider()
 st.sidebar.markdown("**Equity Controls**")